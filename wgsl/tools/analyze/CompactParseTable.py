@@ -0,0 +1,781 @@
+#!/usr/bin/env python3
+#
+# Copyright 2022 Google LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of works must retain the original copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the original
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#
+# 3. Neither the name of the W3C nor the names of its contributors
+# may be used to endorse or promote products derived from this work
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compact parse tables: the action and goto tables of a parser as arrays of
+32-bit integers, with binary file formats that can be mapped into memory
+and queried without parsing.
+
+An action is encoded as a single word, with its kind in the low 2 bits,
+and its argument above them:
+  - ACTION_ERROR:  0.  Any combination not in the parser table.
+  - ACTION_SHIFT:  the argument is the next state.
+  - ACTION_REDUCE: the argument is the reduction index.
+  - ACTION_ACCEPT: no argument.
+
+A goto entry is the next state, or NO_STATE.
+
+There are two layouts:
+  - CompactParseTable holds dense tables, with an entry for every state
+    and symbol.
+  - CombParseTable holds the same tables compressed by row displacement.
+    See CombVector.
+
+The action table has a column for each terminal class, rather than for each
+terminal.  Terminals with identical actions in every state can share a class.
+See CompactParseTable.with_terminal_classes.
+
+Each state also has a bitmask of its valid terminals: those with an action
+in the table as built from the grammar.  A tokenizer need only try those.
+The mask is kept when default reductions fill in error entries.  Bit t of
+the mask is bit t % 32 of word t // 32 of the state's row.
+
+CompactParseTable file layout, with integers in little-endian order:
+  - the header: FILE_MAGIC, then 14 unsigned 32-bit integers:
+      the format version,
+      the number of states, terminals, nonterminals, reductions, conflicts,
+      the byte offset and byte size of the symbol table,
+      the byte offsets of the action table, the goto table, and the reductions,
+      the number of terminal classes, the byte offset of the class map,
+      and the byte offset of the valid terminal masks.
+  - the action table: a row of one word per terminal class, for each state.
+  - the goto table: a row of one word per nonterminal, for each state.
+  - the reductions: the nonterminal index of each reduction, and then
+    the number of symbols each reduction pops.
+  - the class map: the terminal class of each terminal.
+  - the valid terminal masks: a row of valid_words(terminals) words for
+    each state.
+  - the symbol table: UTF-8 JSON for {"terminals": [...], "nonterminals": [...]}
+
+CombParseTable file layout, with integers in little-endian order:
+  - the header: COMB_FILE_MAGIC, then 10 unsigned 32-bit integers:
+      the format version,
+      the number of states, terminals, nonterminals, reductions, conflicts,
+      the number of slots in the action and goto comb vectors,
+      the byte size of the symbol table, and the number of terminal classes.
+  - the action comb vector, over rows for states and columns for terminal
+    classes: the base and default of each state, then the check and next
+    of each slot.
+  - the goto comb vector, over rows for nonterminals: the base and default
+    of each nonterminal, then the check and next of each slot.
+  - the reductions, the class map, and the valid terminal masks, as for
+    CompactParseTable.
+  - the symbol table, as for CompactParseTable.
+"""
+
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+FILE_MAGIC = b'WGSLPT\0\0'
+FILE_FORMAT_VERSION = 3
+HEADER = struct.Struct('<8s14I')
+
+COMB_FILE_MAGIC = b'WGSLPTC\0'
+COMB_FILE_FORMAT_VERSION = 3
+COMB_HEADER = struct.Struct('<8s10I')
+
+# The string for the end-of-text terminal.
+END_OF_TEXT = "EndOfText"
+
+ACTION_ERROR = 0
+ACTION_SHIFT = 1
+ACTION_REDUCE = 2
+ACTION_ACCEPT = 3
+NO_STATE = -1
+
+# The files store 32-bit words.
+assert array('i').itemsize == 4
+
+def encode_action(kind, argument=0):
+    return (argument << 2) | kind
+
+def action_kind(word):
+    return word & 3
+
+def action_argument(word):
+    return word >> 2
+
+def action_str(word):
+    """
+    Returns the string form of an encoded action, as for the
+    Action classes in Grammar.py, or "err" for an error.
+    """
+    kind = action_kind(word)
+    if kind == ACTION_SHIFT:
+        return "s#{}".format(action_argument(word))
+    if kind == ACTION_REDUCE:
+        return "r#{}".format(action_argument(word))
+    if kind == ACTION_ACCEPT:
+        return "acc"
+    return "err"
+
+def valid_words(num_terminals):
+    """
+    Returns the number of words in the valid terminal mask of a state.
+    """
+    return (num_terminals + 31) // 32
+
+def masks_to_words(masks, num_terminals):
+    """
+    Returns the rows of valid terminal masks, as signed 32-bit words,
+    for a sequence of bitmasks over terminal indices.
+    """
+    words = array('i')
+    for mask in masks:
+        for w in range(valid_words(num_terminals)):
+            word = (mask >> (32 * w)) & 0xffffffff
+            words.append(word - (1 << 32) if word >= (1 << 31) else word)
+    return words
+
+def mask_from_words(valid, num_terminals, state):
+    """
+    Returns the valid terminal mask of a state, as a bitmask over terminal
+    indices, from the rows of words made by masks_to_words.
+    """
+    width = valid_words(num_terminals)
+    mask = 0
+    for w in range(width):
+        mask |= (valid[state * width + w] & 0xffffffff) << (32 * w)
+    return mask
+
+def words_to_bytes(words):
+    """
+    Returns the little-endian bytes of a sequence of 32-bit words.
+    """
+    words = array('i', words)
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return words.tobytes()
+
+def words_from_buffer(buffer, offset, count):
+    """
+    Returns count 32-bit words stored little-endian in a memoryview, at a
+    byte offset.  On a little-endian machine the result is a view of the
+    buffer, and is not copied.
+
+    Raises RuntimeError when the buffer is too short.
+    """
+    if offset + 4 * count > len(buffer):
+        raise RuntimeError("parse table file is truncated")
+    view = buffer[offset:offset + 4 * count]
+    if sys.byteorder == 'little':
+        return view.cast('i')
+    result = array('i', view.tobytes())
+    result.byteswap()
+    return result
+
+def symbols_to_bytes(terminals, nonterminals):
+    return json.dumps({"terminals": terminals, "nonterminals": nonterminals},
+                      separators=(',',':')).encode('utf-8')
+
+def symbols_from_buffer(buffer, offset, size, num_terminals, num_nonterminals):
+    """
+    Returns the pair (terminals, nonterminals) stored by symbols_to_bytes.
+
+    Raises RuntimeError when they are missing, or do not have the given sizes.
+    """
+    if offset + size > len(buffer):
+        raise RuntimeError("parse table file is truncated")
+    try:
+        symbols = json.loads(bytes(buffer[offset:offset + size]).decode('utf-8'))
+        if len(symbols["terminals"]) != num_terminals or len(symbols["nonterminals"]) != num_nonterminals:
+            raise RuntimeError("parse table file has a mismatched symbol table")
+        return (symbols["terminals"], symbols["nonterminals"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise RuntimeError("parse table file has a bad symbol table: {}".format(e))
+
+
+def check_terminal_classes(terminal_class, num_classes):
+    """
+    Raises RuntimeError unless the class map uses exactly the classes
+    0 .. num_classes-1.
+    """
+    if set(terminal_class) != set(range(num_classes)):
+        raise RuntimeError("parse table file has a bad terminal class map")
+
+
+class MappedTable:
+    """
+    Base class for tables stored as arrays of words, which can be saved to a
+    file, and loaded by mapping the file into memory.
+
+    Subclasses implement:
+      - to_bytes(), returning the file contents.
+      - from_bytes(buffer), a static method returning the table in a buffer.
+      - arrays(), returning the table's arrays.
+    """
+    def __init__(self):
+        # The mapped file, if loaded from one.
+        self.mapped = None
+
+    def write(self,path):
+        """
+        Saves the table to the given path.
+        Writes to a temporary file first, so readers never see a partial table.
+        """
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path,'wb') as outfile:
+            outfile.write(self.to_bytes())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls,path):
+        """
+        Returns the table saved at the given path, mapped into memory.
+        Call close when done with it.
+
+        Raises RuntimeError when the file does not hold a table.
+        """
+        with open(path,'rb') as infile:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            result = cls.from_bytes(mapped)
+        except Exception:
+            mapped.close()
+            raise
+        result.mapped = mapped
+        return result
+
+    def close(self):
+        """
+        Releases the mapped file, if any.  The table can not be used afterward.
+        """
+        if self.mapped is not None:
+            for a in self.arrays():
+                if isinstance(a, memoryview):
+                    a.release()
+            self.mapped.close()
+            self.mapped = None
+
+
+class CompactParseTable(MappedTable):
+    """
+    A parser table held in dense arrays, with fields:
+
+      .terminals:        The list of terminal strings.  A terminal is
+                         identified by its index in the list.
+      .nonterminals:     The list of nonterminal names.  A nonterminal is
+                         identified by its index in the list.
+      .num_states:       The number of states.  States are numbered from 0,
+                         and the parser starts in state 0.
+      .terminal_class:   Maps a terminal index to its terminal class.
+      .num_classes:      The number of terminal classes.
+      .action:           The encoded action for state s and terminal class c
+                         is at index s * num_classes + c.
+      .goto:             The next state for state s and nonterminal n is at
+                         index s * len(nonterminals) + n.
+      .reduction_lhs:    Maps a reduction index to its nonterminal index.
+      .reduction_length: Maps a reduction index to the number of symbols
+                         on its right-hand side.
+      .num_conflicts:    The number of conflicts in the original table.
+                         Only the first action of a conflict is kept.
+      .valid:            The valid terminal masks.  Bit t of the mask for
+                         state s is in word s * valid_words(len(terminals))
+                         + t // 32.
+
+    The arrays are array('i') objects, or memoryviews of a mapped file.
+    """
+    def __init__(self,terminals,nonterminals,action,goto,reduction_lhs,reduction_length,num_conflicts=0,
+                 terminal_class=None,valid=None):
+        super().__init__()
+        self.terminals = terminals
+        self.nonterminals = nonterminals
+        # By default, each terminal is a class of its own.
+        if terminal_class is None:
+            terminal_class = array('i', range(len(terminals)))
+        self.terminal_class = terminal_class
+        self.num_classes = 1 + max(terminal_class, default=-1)
+        self.num_states = len(action) // max(1,self.num_classes)
+        self.action = action
+        self.goto = goto
+        self.reduction_lhs = reduction_lhs
+        self.reduction_length = reduction_length
+        self.num_conflicts = num_conflicts
+        # By default, the valid terminals are those with an action.
+        if valid is None:
+            valid = masks_to_words([sum([1 << t for t in range(len(terminals))
+                                         if self.lookup_action(state,t) != ACTION_ERROR])
+                                    for state in range(self.num_states)], len(terminals))
+        self.valid = valid
+        self.terminal_index = dict([(t,i) for i,t in enumerate(terminals)])
+        self.nonterminal_index = dict([(n,i) for i,n in enumerate(nonterminals)])
+
+    def lookup_action(self,state,terminal):
+        """
+        Returns the encoded action for a state and a terminal index.
+        """
+        return self.action[state * self.num_classes + self.terminal_class[terminal]]
+
+    def lookup_goto(self,state,nonterminal):
+        """
+        Returns the next state for a state and a nonterminal index, or NO_STATE.
+        """
+        return self.goto[state * len(self.nonterminals) + nonterminal]
+
+    def valid_terminals(self,state):
+        """
+        Returns the valid terminals of a state, as a bitmask over terminal indices.
+        """
+        return mask_from_words(self.valid, len(self.terminals), state)
+
+    def valid_terminals_str(self):
+        """
+        Returns a summary of the number of valid terminals per state.
+        """
+        counts = [bin(self.valid_terminals(s)).count('1') for s in range(self.num_states)]
+        return "valid terminals per state: {:.1f} on average, at most {}, of {} terminals\n".format(
+                sum(counts) / max(1,len(counts)), max(counts, default=0), len(self.terminals))
+
+    def arrays(self):
+        return [self.action, self.goto, self.reduction_lhs, self.reduction_length, self.terminal_class,
+                self.valid]
+
+    def terminal_classes(self):
+        """
+        Returns the list of terminal classes, each a list of terminal indices.
+        """
+        classes = [[] for _ in range(self.num_classes)]
+        for terminal, c in enumerate(self.terminal_class):
+            classes[c].append(terminal)
+        return classes
+
+    def with_terminal_classes(self):
+        """
+        Returns a copy of this table where terminals whose actions are the
+        same in every state share a terminal class, and so a column of the
+        action table.  Lookups return the same actions.
+
+        Classes are numbered in order of their first terminal.
+        """
+        columns = [tuple(self.action[c::self.num_classes]) for c in range(self.num_classes)]
+        # Maps a column to its new class.
+        class_of_column = dict()
+        # Maps a new class to an old class with its column.
+        representative = []
+        terminal_class = array('i')
+        for c in self.terminal_class:
+            if columns[c] not in class_of_column:
+                class_of_column[columns[c]] = len(representative)
+                representative.append(c)
+            terminal_class.append(class_of_column[columns[c]])
+        action = array('i')
+        for state in range(self.num_states):
+            row = self.action[state * self.num_classes:(state + 1) * self.num_classes]
+            action.extend([row[c] for c in representative])
+        return CompactParseTable(self.terminals, self.nonterminals, action, array('i', self.goto),
+                                 array('i', self.reduction_lhs), array('i', self.reduction_length),
+                                 self.num_conflicts, terminal_class, array('i', self.valid))
+
+    def terminal_classes_str(self):
+        """
+        Returns a summary of the terminal classes, listing those with more
+        than one terminal.
+        """
+        parts = ["{} terminal classes for {} terminals\n".format(self.num_classes, len(self.terminals))]
+        for c in self.terminal_classes():
+            if len(c) > 1:
+                parts.append("{}\n".format(" ".join([self.terminals[t] for t in c])))
+        return "".join(parts)
+
+    def optimized(self,default_reductions=True,chain_reductions=True):
+        """
+        Returns a copy of this table, changed so a parser takes fewer steps
+        and consults fewer entries, and a TableOptimization describing the
+        changes.  The parser accepts exactly the same inputs.
+
+        Fewer steps need not make LRParser.Parser faster.  On the WGSL spec
+        examples, the optimized table takes 12% fewer steps, but parses in
+        about the same time, within the noise of a run.
+
+        Args:
+            default_reductions: When True, in each state with a reduce
+                action, the most common reduction becomes the default: it
+                replaces every error entry.  A syntax error is then found in
+                a later state, but still before the offending token is
+                shifted.
+            chain_reductions: When True, bypass states whose only action is
+                to reduce a chain production A -> B, where B is a nonterminal.
+                A goto over B into such a state is redirected to the goto over
+                A, saving the reduction.  A parse tree made with the table
+                skips the node for A.
+        """
+        num_classes = self.num_classes
+        num_nonterminals = len(self.nonterminals)
+        action = array('i', self.action)
+        goto = array('i', self.goto)
+        stats = TableOptimization()
+
+        if default_reductions:
+            for state in range(self.num_states):
+                row = action[state * num_classes:(state + 1) * num_classes]
+                reductions = collections.Counter([w for w in row if action_kind(w) == ACTION_REDUCE])
+                if len(reductions) == 0:
+                    continue
+                (word, _) = reductions.most_common(1)[0]
+                for c, w in enumerate(row):
+                    if w == ACTION_ERROR:
+                        action[state * num_classes + c] = word
+                stats.default_reductions += 1
+
+        if chain_reductions:
+            # Maps a state to A, when its only action is to reduce by a
+            # production with one symbol, A -> X, and it has no gotos.
+            # X may be a terminal, as for A -> 'x', when the state is
+            # reached by a shift.  That is harmless: only goto entries are
+            # rewritten below, so the state is only bypassed where a goto
+            # leads to it.
+            chain_lhs = dict()
+            for state in range(self.num_states):
+                words = set(action[state * num_classes:(state + 1) * num_classes])
+                words.discard(ACTION_ERROR)
+                if len(words) != 1:
+                    continue
+                [word] = words
+                if action_kind(word) != ACTION_REDUCE or self.reduction_length[action_argument(word)] != 1:
+                    continue
+                if any(g != NO_STATE for g in goto[state * num_nonterminals:(state + 1) * num_nonterminals]):
+                    continue
+                chain_lhs[state] = self.reduction_lhs[action_argument(word)]
+            bypassed = set()
+            for state in range(self.num_states):
+                for nonterminal in range(num_nonterminals):
+                    target = goto[state * num_nonterminals + nonterminal]
+                    visited = set()
+                    while target in chain_lhs and target not in visited:
+                        visited.add(target)
+                        next_target = goto[state * num_nonterminals + chain_lhs[target]]
+                        if next_target == NO_STATE:
+                            break
+                        bypassed.add(target)
+                        target = next_target
+                    if target != goto[state * num_nonterminals + nonterminal]:
+                        goto[state * num_nonterminals + nonterminal] = target
+                        stats.redirected_gotos += 1
+            stats.bypassed_states = len(bypassed)
+
+        table = CompactParseTable(self.terminals, self.nonterminals, action, goto,
+                                  array('i', self.reduction_lhs), array('i', self.reduction_length),
+                                  self.num_conflicts, array('i', self.terminal_class), array('i', self.valid))
+        return (table, stats)
+
+    def to_bytes(self):
+        symbols = symbols_to_bytes(self.terminals, self.nonterminals)
+        offsets = [HEADER.size]
+        for a in self.arrays():
+            offsets.append(offsets[-1] + 4 * len(a))
+        parts = [HEADER.pack(FILE_MAGIC, FILE_FORMAT_VERSION,
+                             self.num_states, len(self.terminals), len(self.nonterminals),
+                             len(self.reduction_lhs), self.num_conflicts,
+                             offsets[6], len(symbols),
+                             offsets[0], offsets[1], offsets[2],
+                             self.num_classes, offsets[4], offsets[5])]
+        parts.extend([words_to_bytes(a) for a in self.arrays()])
+        parts.append(symbols)
+        return b''.join(parts)
+
+    @staticmethod
+    def from_bytes(buffer):
+        """
+        Returns the table held in a buffer written by to_bytes.
+        On a little-endian machine the arrays are views of the buffer,
+        and are not copied.
+
+        Raises RuntimeError when the buffer does not hold a table.
+        """
+        buffer = memoryview(buffer)
+        if len(buffer) < HEADER.size:
+            raise RuntimeError("parse table file is too short")
+        (magic, version, num_states, num_terminals, num_nonterminals, num_reductions, num_conflicts,
+         symbols_offset, symbols_size, action_offset, goto_offset, reductions_offset,
+         num_classes, class_offset, valid_offset) = HEADER.unpack_from(buffer)
+        if magic != FILE_MAGIC:
+            raise RuntimeError("not a parse table file")
+        if version != FILE_FORMAT_VERSION:
+            raise RuntimeError("unsupported parse table file version: {}".format(version))
+        (terminals, nonterminals) = symbols_from_buffer(buffer, symbols_offset, symbols_size,
+                                                        num_terminals, num_nonterminals)
+        terminal_class = words_from_buffer(buffer, class_offset, num_terminals)
+        check_terminal_classes(terminal_class, num_classes)
+        return CompactParseTable(terminals, nonterminals,
+                                 words_from_buffer(buffer, action_offset, num_states * num_classes),
+                                 words_from_buffer(buffer, goto_offset, num_states * num_nonterminals),
+                                 words_from_buffer(buffer, reductions_offset, num_reductions),
+                                 words_from_buffer(buffer, reductions_offset + 4 * num_reductions, num_reductions),
+                                 num_conflicts, terminal_class,
+                                 words_from_buffer(buffer, valid_offset, num_states * valid_words(num_terminals)))
+
+
+class TableOptimization:
+    """
+    Statistics on the changes made by CompactParseTable.optimized, with fields:
+
+      .default_reductions: The number of states given a default reduction.
+      .bypassed_states:    The number of chain reduction states bypassed by
+                           at least one goto.
+      .redirected_gotos:   The number of goto entries redirected.
+    """
+    def __init__(self):
+        self.default_reductions = 0
+        self.bypassed_states = 0
+        self.redirected_gotos = 0
+
+    def __str__(self):
+        return "{} default reductions, {} chain reduction states bypassed by {} gotos".format(
+                self.default_reductions, self.bypassed_states, self.redirected_gotos)
+
+
+class CombVector:
+    """
+    A matrix of words compressed by row displacement, into a "comb vector".
+    Each row keeps only the entries that differ from its default value.
+    The rows are overlaid in one pair of arrays, each shifted by its own
+    base offset, so that no two rows use the same slot.
+
+      .base:    Maps a row to the offset of its entries in check and next.
+      .default: Maps a row to the value of the entries left out of the row.
+      .check:   Maps a slot to the row using it, or -1.
+      .next:    Maps a slot to its value.
+
+    The entry at (row, column) is next[base[row] + column] when
+    check[base[row] + column] is row, and default[row] otherwise.
+    There is a slot for base[row] + column, for every row and column.
+    """
+    def __init__(self,base,default,check,next):
+        self.base = base
+        self.default = default
+        self.check = check
+        self.next = next
+
+    @staticmethod
+    def compress(rows, num_columns):
+        """
+        Returns the CombVector for a matrix, given as a list of rows of
+        num_columns words.  Every entry is kept exactly: the default of a row
+        is its most common value, and every other entry is placed in a slot.
+
+        Rows are placed first-fit, from the one with the most entries kept.
+        """
+        base = array('i',[0]) * len(rows)
+        default = array('i',[0]) * len(rows)
+        entries = []
+        for r, row in enumerate(rows):
+            default[r] = collections.Counter(row).most_common(1)[0][0] if num_columns > 0 else 0
+            entries.append([(c, x) for c, x in enumerate(row) if x != default[r]])
+
+        # A bitmask over the used slots.
+        used = 0
+        num_slots = num_columns
+        for r in sorted(range(len(rows)), key=lambda r: -len(entries[r])):
+            row_entries = entries[r]
+            if len(row_entries) == 0:
+                continue
+            # Bit b is set when base b would put some entry in a used slot.
+            conflicts = 0
+            row_bits = 0
+            for c, _ in row_entries:
+                conflicts |= used >> c
+                row_bits |= 1 << c
+            # Use the lowest base without a conflict.
+            b = ((conflicts + 1) & ~conflicts).bit_length() - 1
+            base[r] = b
+            used |= row_bits << b
+            num_slots = max(num_slots, b + num_columns)
+
+        check = array('i',[-1]) * num_slots
+        next = array('i',[0]) * num_slots
+        for r, row_entries in enumerate(entries):
+            for c, x in row_entries:
+                check[base[r] + c] = r
+                next[base[r] + c] = x
+        return CombVector(base, default, check, next)
+
+    def lookup(self,row,column):
+        i = self.base[row] + column
+        if self.check[i] == row:
+            return self.next[i]
+        return self.default[row]
+
+    def arrays(self):
+        return [self.base, self.default, self.check, self.next]
+
+    def size(self):
+        """
+        Returns the number of words in the arrays.
+        """
+        return sum([len(a) for a in self.arrays()])
+
+
+class CombParseTable(MappedTable):
+    """
+    A parser table held in comb vectors, with fields:
+
+      .terminals, .nonterminals, .num_states, .reduction_lhs,
+      .reduction_length, .num_conflicts: as for CompactParseTable
+      .terminal_class, .num_classes, .valid: as for CompactParseTable
+      .action:  The CombVector for the action table, with a row for each
+                state and a column for each terminal class.
+      .goto:    The CombVector for the goto table, with a row for each
+                nonterminal and a column for each state.  The targets of
+                a nonterminal are few, so this packs better than a row
+                for each state.
+
+    Lookups return exactly what they do for the CompactParseTable it was
+    made from.
+    """
+    def __init__(self,terminals,nonterminals,num_states,action,goto,reduction_lhs,reduction_length,num_conflicts,
+                 terminal_class,valid):
+        super().__init__()
+        self.terminals = terminals
+        self.nonterminals = nonterminals
+        self.terminal_class = terminal_class
+        self.num_classes = 1 + max(terminal_class, default=-1)
+        self.num_states = num_states
+        self.action = action
+        self.goto = goto
+        self.reduction_lhs = reduction_lhs
+        self.reduction_length = reduction_length
+        self.num_conflicts = num_conflicts
+        self.valid = valid
+        self.terminal_index = dict([(t,i) for i,t in enumerate(terminals)])
+        self.nonterminal_index = dict([(n,i) for i,n in enumerate(nonterminals)])
+
+    @staticmethod
+    def from_compact(compact):
+        """
+        Returns the CombParseTable for a CompactParseTable.
+        """
+        num_classes = compact.num_classes
+        num_nonterminals = len(compact.nonterminals)
+        action_rows = [compact.action[s * num_classes:(s + 1) * num_classes]
+                       for s in range(compact.num_states)]
+        goto_rows = [compact.goto[n:len(compact.goto):num_nonterminals]
+                     for n in range(num_nonterminals)]
+        return CombParseTable(compact.terminals, compact.nonterminals, compact.num_states,
+                              CombVector.compress(action_rows, num_classes),
+                              CombVector.compress(goto_rows, compact.num_states),
+                              array('i', compact.reduction_lhs), array('i', compact.reduction_length),
+                              compact.num_conflicts, array('i', compact.terminal_class),
+                              array('i', compact.valid))
+
+    def lookup_action(self,state,terminal):
+        """
+        Returns the encoded action for a state and a terminal index.
+        """
+        return self.action.lookup(state,self.terminal_class[terminal])
+
+    def lookup_goto(self,state,nonterminal):
+        """
+        Returns the next state for a state and a nonterminal index, or NO_STATE.
+        """
+        return self.goto.lookup(nonterminal,state)
+
+    def valid_terminals(self,state):
+        """
+        Returns the valid terminals of a state, as a bitmask over terminal indices.
+        """
+        return mask_from_words(self.valid, len(self.terminals), state)
+
+    def dense_size(self):
+        """
+        Returns the number of words in the dense action and goto tables.
+        """
+        return self.num_states * (len(self.terminals) + len(self.nonterminals))
+
+    def size(self):
+        """
+        Returns the number of words in the action and goto comb vectors.
+        """
+        return self.action.size() + self.goto.size()
+
+    def compression_ratio(self):
+        """
+        Returns the size of the dense tables over the size of the comb vectors.
+        """
+        return self.dense_size() / max(1,self.size())
+
+    def size_str(self):
+        return "{} words in comb vectors, {} words dense, compression ratio {:.2f}".format(
+                self.size(), self.dense_size(), self.compression_ratio())
+
+    def arrays(self):
+        return self.action.arrays() + self.goto.arrays() + [self.reduction_lhs, self.reduction_length,
+                                                            self.terminal_class, self.valid]
+
+    def to_bytes(self):
+        symbols = symbols_to_bytes(self.terminals, self.nonterminals)
+        parts = [COMB_HEADER.pack(COMB_FILE_MAGIC, COMB_FILE_FORMAT_VERSION,
+                                  self.num_states, len(self.terminals), len(self.nonterminals),
+                                  len(self.reduction_lhs), self.num_conflicts,
+                                  len(self.action.check), len(self.goto.check), len(symbols),
+                                  self.num_classes)]
+        parts.extend([words_to_bytes(a) for a in self.arrays()])
+        parts.append(symbols)
+        return b''.join(parts)
+
+    @staticmethod
+    def from_bytes(buffer):
+        """
+        Returns the table held in a buffer written by to_bytes.
+        On a little-endian machine the arrays are views of the buffer,
+        and are not copied.
+
+        Raises RuntimeError when the buffer does not hold a table.
+        """
+        buffer = memoryview(buffer)
+        if len(buffer) < COMB_HEADER.size:
+            raise RuntimeError("parse table file is too short")
+        (magic, version, num_states, num_terminals, num_nonterminals, num_reductions, num_conflicts,
+         action_slots, goto_slots, symbols_size, num_classes) = COMB_HEADER.unpack_from(buffer)
+        if magic != COMB_FILE_MAGIC:
+            raise RuntimeError("not a compressed parse table file")
+        if version != COMB_FILE_FORMAT_VERSION:
+            raise RuntimeError("unsupported compressed parse table file version: {}".format(version))
+        offset = COMB_HEADER.size
+        arrays = []
+        for count in (num_states, num_states, action_slots, action_slots,
+                      num_nonterminals, num_nonterminals, goto_slots, goto_slots,
+                      num_reductions, num_reductions, num_terminals,
+                      num_states * valid_words(num_terminals)):
+            arrays.append(words_from_buffer(buffer, offset, count))
+            offset += 4 * count
+        (terminals, nonterminals) = symbols_from_buffer(buffer, offset, symbols_size,
+                                                        num_terminals, num_nonterminals)
+        check_terminal_classes(arrays[10], num_classes)
+        return CombParseTable(terminals, nonterminals, num_states,
+                              CombVector(*arrays[0:4]), CombVector(*arrays[4:8]),
+                              arrays[8], arrays[9], num_conflicts, arrays[10], arrays[11])
@@ -42,11 +42,17 @@ Represent and process a grammar:
     conflicts if they exist.
 """
 
+import concurrent.futures
 import json
 import functools
+import hashlib
+import itertools
+import os
 import sys
+from array import array
 from ObjectRegistry import RegisterableObject, ObjectRegistry
-from collections import defaultdict
+from CompactParseTable import CompactParseTable, encode_action, masks_to_words, ACTION_SHIFT, ACTION_REDUCE, ACTION_ACCEPT, NO_STATE
+from collections import defaultdict, deque
 
 EPSILON = u"\u03b5"
 MIDDLE_DOT = u"\u00b7"
@@ -54,6 +60,12 @@ LBRACE = "{"
 RBRACE = "}"
 # The name of the nonterminal for the entire language
 LANGUAGE = "language"
+# Every Grammar registers its Empty and EndOfText objects first, so they
+# have these registry indices.
+EMPTY_INDEX = 0
+END_OF_TEXT_INDEX = 1
+END_OF_TEXT_BIT = 1 << END_OF_TEXT_INDEX
+EMPTY_SET = frozenset()
 
 # These just have to be different.
 CLASS_FIXED=0
@@ -68,6 +80,16 @@ CLASS_ITEM=8
 CLASS_ITEM_SET=9
 CLASSES_BUCKET_SIZE=10 # Use 10 for readability
 
+# Methods for computing LALR(1) item sets. See Grammar.LALR1
+LALR1_ENGINE_SWEEP="sweep"
+LALR1_ENGINE_WORKLIST="worklist"
+LALR1_ENGINE_PROPAGATE="propagate"
+LALR1_ENGINE_DEREMER_PENNELLO="dp"
+LALR1_ENGINES=(LALR1_ENGINE_SWEEP, LALR1_ENGINE_WORKLIST, LALR1_ENGINE_PROPAGATE, LALR1_ENGINE_DEREMER_PENNELLO)
+
+# The version of the serialized ParseTable format. See ParseTable.to_json_dict
+PARSE_TABLE_FORMAT_VERSION=1
+
 def raiseRE(s):
     raise RuntimeError(s)
 
@@ -194,16 +216,24 @@ class PrintOption:
         return result
 
 class Rule(RegisterableObject):
+    __slots__ = ('first_data', 'first_data_initialized_for_terminals', 'follow', 'known_to_derive_empty')
+
     def __init__(self,**kwargs):
         super().__init__(**kwargs)
-        self.name = self.__class__.__name__
         self.reset_first_follow()
 
+    @property
+    def name(self):
+        return self.__class__.__name__
+
     def reset_first_follow(self):
-        self.first_data = set()
+        # Share one immutable empty set until the sets are computed.
+        self.first_data = EMPTY_SET
         self.first_data_initialized_for_terminals = False
-        self.follow = set()
-        self.known_to_derive_empty = False
+        self.follow = EMPTY_SET
+        # True or False once known, or None when derives_empty should
+        # look for Empty in the First set.
+        self.known_to_derive_empty = None
 
     def first(self):
         if self.is_terminal() or self.is_empty():
@@ -236,8 +266,8 @@ class Rule(RegisterableObject):
 
     def derives_empty(self):
         """Returns True if this object is known to generate the empty string"""
-        if self.known_to_derive_empty:
-            return True
+        if self.known_to_derive_empty is not None:
+            return self.known_to_derive_empty
         for item in self.first():
             if item.is_empty():
                 self.known_to_derive_empty = True
@@ -253,7 +283,7 @@ class Rule(RegisterableObject):
     # The fn(self,True) is called on entry and fn(self,False) on exit.
     def traverse(self,fn):
         fn(self,True)
-        if "children" in dir(self):
+        if isinstance(self,ContainerRule):
             for c in self.children:
                 c.traverse(fn)
         fn(self,False)
@@ -261,7 +291,7 @@ class Rule(RegisterableObject):
     def string_internal(self):
         parts = []
         def f(parts,obj,on_entry):
-            if "content" in dir(obj):
+            if isinstance(obj,LeafRule):
                 if on_entry:
                     if isinstance(obj, SymbolName):
                         parts.append(obj.content)
@@ -466,12 +496,14 @@ class ContainerRule(Rule):
     Once created, it must not change: don't add, replace, reorder, or remove
     its objects.
     """
+    __slots__ = ('children',)
+
     def __init__(self,children,**kwargs):
         super().__init__(**kwargs)
         self.children = children
 
     def ordered(self):
-        return self.ordered_children if ('ordered_children' in dir(self)) else self.children
+        return self.children
 
     # Emulate an indexable sequence by adding certain standard methods:
     def __len__(self):
@@ -499,16 +531,20 @@ class ContainerRule(Rule):
         return self.children.__contains__(item)
 
 class Choice(ContainerRule):
+    __slots__ = ()
+    class_id = CLASS_CHOICE
+
     def __init__(self,children,**kwargs):
-        self.class_id = CLASS_CHOICE
         # Order does not matter among the children.
         # Children must have been registered.
         self.key = (self.class_id, frozenset([i.reg_info.index for i in children]))
         super().__init__(children,**kwargs)
 
 class Seq(ContainerRule):
+    __slots__ = ()
+    class_id = CLASS_SEQ
+
     def __init__(self,children,**kwargs):
-        self.class_id = CLASS_SEQ
         # Order does matter among the children.
         # Store the tuple.
         # Children must have been registered.
@@ -516,10 +552,12 @@ class Seq(ContainerRule):
         super().__init__(children,**kwargs)
 
 class Repeat1(ContainerRule):
+    __slots__ = ()
+    class_id = CLASS_REPEAT1
+
     def __init__(self,children,**kwargs):
         if len(children) != 1:
             raise RuntimeError("Repeat1 must have exactly one child: {}".format(str(children)))
-        self.class_id = CLASS_REPEAT1
         # Children must have been registered.
         self.key = (self.class_id,children[0].reg_info.index)
         super().__init__(children,**kwargs)
@@ -531,25 +569,43 @@ class LeafRule(Rule):
 
     Once created, it must not be changed.
     """
+    __slots__ = ('content',)
+
     def __init__(self,content,**kwargs):
         super().__init__(**kwargs)
         self.content = content
 
+    def string_internal(self):
+        # Same as Rule.string_internal, without the traversal.
+        if isinstance(self, SymbolName):
+            return self.content
+        if isinstance(self, Fixed):
+            return "'{}'".format(self.content)
+        if isinstance(self, Pattern):
+            return "/{}/".format(self.content)
+        return super().string_internal()
+
 class SymbolName(LeafRule):
+    __slots__ = ()
+    class_id = CLASS_SYMBOL
+
     def __init__(self,content,**kwargs):
-        self.class_id = CLASS_SYMBOL
         self.key = self.combine_class_id(self.register_string(content,**kwargs))
         super().__init__(content,**kwargs)
 
 class Empty(LeafRule):
+    __slots__ = ()
+    class_id = CLASS_EMPTY
+
     def __init__(self,**kwargs):
-        self.class_id = CLASS_EMPTY
         self.key = self.combine_class_id(0)
         super().__init__(None,**kwargs)
 
 class EndOfText(LeafRule):
+    __slots__ = ()
+    class_id = CLASS_END_OF_TEXT
+
     def __init__(self,**kwargs):
-        self.class_id = CLASS_END_OF_TEXT
         self.key = self.combine_class_id(0)
         super().__init__(None,**kwargs)
 
@@ -557,6 +613,8 @@ class Token(LeafRule):
     """
     A Token is a non-empty contiguous sequence of code points
     """
+    __slots__ = ()
+
     def __init__(self,content,**kwargs):
         self.key = self.combine_class_id(self.register_string(content,**kwargs))
         super().__init__(content,**kwargs)
@@ -565,16 +623,20 @@ class Fixed(Token):
     """
     A Fixed is a token with a given sequence of code points.
     """
+    __slots__ = ()
+    class_id = CLASS_FIXED
+
     def __init__(self,content,**kwargs):
-        self.class_id = CLASS_FIXED
         super().__init__(content,**kwargs)
 
 class Pattern(Token):
     """
     A Pattern represents a token matched by a regular expression.
     """
+    __slots__ = ()
+    class_id = CLASS_PATTERN
+
     def __init__(self,content,**kwargs):
-        self.class_id = CLASS_PATTERN
         super().__init__(content,**kwargs)
 
 
@@ -742,6 +804,11 @@ class Item(RegisterableObject):
        self.position: an integer index: the "dot" representing the current position
            in the rule appears to the left of the item at this indexed position.
     """
+    __slots__ = ('lhs', 'rule', 'position', 'the_items', 'the_next',
+                 'rest_derives_empty', 'rest_firsts_without_empty',
+                 'grammar', 'the_items_generated_by_next')
+    class_id = CLASS_ITEM
+
     def __init__(self,lhs,rule,position,**kwargs):
         """
         Args:
@@ -750,7 +817,6 @@ class Item(RegisterableObject):
             position: Index of the position, where 0 is to the left
               of the first item in the choice
         """
-        self.class_id = CLASS_ITEM
         self.lhs = lhs
         self.rule = rule
         self.position = position
@@ -777,29 +843,27 @@ class Item(RegisterableObject):
         if self.the_items is None:
             self.the_items = self.compute_items()
             self.the_next = self.the_items[self.position] if self.position < len(self.the_items) else None
-            self.the_rest = self.the_items[self.position+1:]
-            self.rest_derives_empty = derives_empty(grammar.rules, self.the_rest)
-            self.rest_firsts_without_empty = without_empty(first(grammar, self.the_rest))
+            ir = grammar.lower()
+            (bits, self.rest_derives_empty) = ir.suffix_first(self.rule,self.position+1)
+            self.rest_firsts_without_empty = grammar.interned_lookahead(ir.registry_bits(bits))
             self.grammar = grammar
             self.the_items_generated_by_next = None
         return self
 
     def rest_lookahead_with_other_lookahead(self,other_la):
         """
-        Returns a new LookaheadSet containing:
+        Returns an interned LookaheadSet containing:
            - the firsts tokens of the 'rest' of the production after the 'next' symbol,
              but without the empty token
            - and when that rest of the production can derive empty, also add the
              tokens from the other lookahead set 'other_la'
         This is needed for closing an ItemSet.
         """
-        # First make a copy
-        result = LookaheadSet(self.rest_firsts_without_empty)
         if self.rest_derives_empty:
             # When the_rest can derive an empty string, then the result could depend on the
             # contents of the other lookahead
-            result.merge(other_la)
-        return result
+            return self.grammar.interned_lookahead(self.rest_firsts_without_empty.bits | other_la.bits)
+        return self.rest_firsts_without_empty
 
     def items_generated_by_next(self):
         """
@@ -808,14 +872,10 @@ class Item(RegisterableObject):
         at the end of the list of items, and therefore B exists, and B is a symbol.
         Cache the result, as it does not change over time.
         """
-        def lookup(rule):
-            return self.grammar.rules[rule.content] if rule.is_symbol_name() else rule
         if self.the_items_generated_by_next is None:
             self.the_items_generated_by_next = []
-            rhs = lookup(self.grammar.rules[self.the_next.content])
-            rhs = [rhs] if rhs.is_terminal() else rhs
             # iterate over the alternatives of a Choice
-            for production in rhs:
+            for production in self.grammar.alternatives(self.the_next.content):
                 if production.is_empty():
                     # Avoid creating useless productions that have no right-hand-side
                     # They can only lead to redundant reductions, and sometimes useless
@@ -848,7 +908,8 @@ class Item(RegisterableObject):
         elif rule.is_empty():
             self.the_items = []
         elif isinstance(rule, Seq):
-            self.the_items = [i for i in rule]
+            # Share the list. Neither the Seq nor the Item may change it.
+            self.the_items = rule.children
         else:
             raise RuntimeError("invalid item object: {}".format(str(rule)))
         return self.the_items
@@ -910,8 +971,10 @@ def json_hook(grammar,memo,tokens_only,dct):
     Args:
       grammar: The grammar in which this node is created.
       memo: A memoization dictionary of previously created nodes.
-        It's a dictionary mapping the Python string name of a node to
-        the previously created node, if any.
+        It's a dictionary mapping the node type and the Python string name
+        of a node to the previously created node, if any.  The type is part
+        of the key because a rule can have the same name as a string token,
+        like const_assert in WGSL.
       tokens_only: if true, only resolve tokens
       dct: A JSON dictionary
 
@@ -931,9 +994,9 @@ def json_hook(grammar,memo,tokens_only,dct):
             if  type_entry == "TOKEN":
                 result = dct["content"]
             elif  type_entry == "STRING":
-                result = memoize(memo,dct["value"],grammar.MakeFixed(dct["value"]))
+                result = memoize(memo,(type_entry,dct["value"]),grammar.MakeFixed(dct["value"]))
             elif  type_entry == "PATTERN":
-                result = memoize(memo,dct["value"],grammar.MakePattern(dct["value"]))
+                result = memoize(memo,(type_entry,dct["value"]),grammar.MakePattern(dct["value"]))
             elif not tokens_only:
                 if  type_entry == "BLANK":
                     result = grammar.empty
@@ -949,7 +1012,7 @@ def json_hook(grammar,memo,tokens_only,dct):
                     result = grammar.MakeRepeat1([dct["content"]])
                     result = grammar.MakeChoice([result, grammar.empty])
                 elif  type_entry == "SYMBOL":
-                    result = memoize(memo,dct["name"],grammar.MakeSymbolName(dct["name"]))
+                    result = memoize(memo,(type_entry,dct["name"]),grammar.MakeSymbolName(dct["name"]))
                 else:
                     raise RuntimeError("unknown node type: {}".format(type_entry))
     return result
@@ -1062,101 +1125,76 @@ def compute_first_sets(grammar,rules):
     Computes the First set for each node in the grammar.
     Populates the `first` attribute of each node.
 
+    The sets are computed over the GrammarIR, and then copied back
+    to the top-level rule nodes.
+
     Args:
-        rules: a GrammarDict in Canonical Form
+        rules: a GrammarDict in Canonical Form, the rules of the grammar
     """
     grammar.reset_first_follow()
 
-    names_of_non_terminals = []
     grammar.end_of_text.first_data = set({grammar.end_of_text})
     grammar.empty.first_data = set({grammar.empty})
+    ir = grammar.lower()
     for key, rule in rules.items():
         if rule.is_terminal() or rule.is_empty():
             # If X is a terminal, then First(X) is {X}
             # Lazy load it.
             dummy = rule.first()
-        elif rule.is_symbol_name():
-            names_of_non_terminals.append(key)
         else:
-            # rule is a Choice node
-            for rhs in rule:
-                # If X -> empty is a production, then add Empty
-                if rhs.is_empty():
-                    rule.first_data = set({rhs})
-            names_of_non_terminals.append(key)
-
-    def lookup(rule):
-        return rules[rule.content] if isinstance(rule,SymbolName) else rule
-
-    def dynamic_first(rule,depth):
-        """
-        Returns the currently computed approximation to the First set for a
-        rule.
-
-        The rule is from a Canonical grammar, so a non-terminal can be as
-        complex as a Choice over Sequences over symbols that may reference
-        other non-terminals.  Gather updated First set info for at most
-        those first two levels, and use a previous-computed approximation for
-        the nonterminals at that second level.
+            n = ir.nonterminal_id[key]
+            rule.first_data = ir.terminal_set(ir.first[n], ir.nullable[n])
+            rule.known_to_derive_empty = ir.nullable[n]
 
-        Args:
-            rule: the Rule in question
-            depth: recursion depth
 
-        Returns:
-            A new approximation to the First set for the given rule.
-        """
+def compute_nullable(rules):
+    """
+    Returns the set of names of the rules that derive the empty string.
 
-        if rule.is_symbol_name():
-            return rules[rule.content].first()
-        if rule.is_empty():
-            return rule.first()
-        if rule.is_terminal():
-            # The terminal isn't registered in the dictionary.
-            return set({rule})
-        if isinstance(rule,Choice):
-            result = rule.first()
-            #for item in [lookup(i) for i in rule]:
-            for item in rule:
-                result = result.union(dynamic_first(item,depth+1))
-            return result
-        if isinstance(rule,Seq):
-            result = rule.first()
+    Takes time linear in the size of the grammar.  Each alternative counts
+    its symbols not yet known to derive the empty string, and alternatives
+    with a terminal are never counted.  A worklist holds the names found to
+    derive the empty string, and decrements the counts of the alternatives
+    using them.  An alternative whose count reaches zero makes its rule's
+    name derive the empty string.
 
-            # Only recurse 2 levels deep
-            if depth < 2:
-                items = [lookup(item) for item in rule]
+    Args:
+        rules: a GrammarDict in Canonical Form, the rules of the grammar
+    """
+    result = set()
+    worklist = []
+    # Maps an alternative to the name of its rule.
+    lhs = []
+    # Maps an alternative to the count of its symbols not yet known to
+    # derive the empty string.
+    count = []
+    # Maps a name to the alternatives using it, once for each use.
+    uses = dict()
+    for name, rule in rules.items():
+        for alternative in (rule if isinstance(rule,Choice) else [rule]):
+            if alternative.is_empty():
+                members = []
+            elif isinstance(alternative,Seq):
+                members = [x for x in alternative if not x.is_empty()]
             else:
-                items = rule
-            # Add the first sets for Yi if all the earlier items can derive
-            # empty.  But don't add empty itself from this prefix.
-            for item in items:
-                from_first = dynamic_first(item,depth+1)
-                from_first = without_empty(from_first)
-                result = result.union(from_first)
-                if not item.derives_empty():
-                    # Not known to derive empty. Stop here.
-                    break
-            # If all the items derive empty, then add Empty to the first set.
-            if all([lookup(item).derives_empty() for item in rule]):
-                result = result.union({grammar.empty})
-            return result
-        raise RuntimeError("trying to dynamically compute the First set of: "
-                + str(rule))
-
-    # Repeat until settling.
-    keep_going = True
-    while keep_going:
-        keep_going = False
-        for key in names_of_non_terminals:
-            rule = rules[key]
-            # Accumulate First items from right-hand sides
-            df = dynamic_first(rule,0)
-            new_items = df - rule.first()
-            if len(new_items) > 0:
-                rule.first_data = rule.first().union(new_items)
-                keep_going = True
-
+                members = [alternative]
+            if any([x.is_terminal() for x in members]):
+                continue
+            a = len(lhs)
+            lhs.append(name)
+            count.append(len(members))
+            for x in members:
+                uses.setdefault(x.content,[]).append(a)
+            if len(members) == 0 and name not in result:
+                result.add(name)
+                worklist.append(name)
+    while len(worklist) > 0:
+        for a in uses.get(worklist.pop(),[]):
+            count[a] = count[a] - 1
+            if count[a] == 0 and lhs[a] not in result:
+                result.add(lhs[a])
+                worklist.append(lhs[a])
+    return result
 
 def without_empty(s):
     """
@@ -1222,81 +1260,17 @@ def compute_follow_sets(grammar):
     Assumes First sets have been computed.
     Populates the `follow` attribute of each node.
 
+    The sets are computed over the GrammarIR, and then copied back
+    to the top-level rule nodes.
+
     Args:
         grammar: a Grammar in Canonical Form, with First sets populated
     """
-
-    # 1. Place $ in FOLLOW(S), where S is the start symbol and $ is the input
-    # right end marker.
-    grammar.rules[grammar.start_symbol].follow = set({grammar.end_of_text})
-
-    def lookup(rule):
-        return grammar.rules[rule.content] if isinstance(rule,SymbolName) else rule
-
-    def process_seq(key,seq,keep_going):
-        """
-        Add to Follow sets by processing the given Seq node.
-
-        Args:
-            key: Python string name for the production
-            seq: a Seq rule for the production
-            keep_going: A boolean
-
-        Returns:
-            True if a Follow set was modified.
-            keep_going otherwise
-        """
-
-        # Process indirections through symbols
-        seq = [lookup(i) for i in seq]
-
-        last_index = len(seq)-1
-        for bi in range(0,len(seq)):
-            b = seq[bi]
-            # We only care about nonterminals in the sequence
-            if b.is_terminal() or b.is_empty():
-                continue
-
-            # If there is a production A -> alpha B beta
-            # then everything in First(beta) except Empty is
-            # added to Follow(B)
-            beta = seq[bi+1:len(seq)]
-            first_beta = first(grammar, beta)
-            new_items = without_empty(first_beta) - b.follow
-            if len(new_items) > 0:
-                keep_going = True
-                b.follow = b.follow.union(new_items)
-
-            # If A -> alpha B, or A -> alpha B beta, where First(beta)
-            # contains epsilon, then add Follow(A) to Follow(B)
-            if (bi==last_index) or derives_empty(grammar.rules,beta):
-                new_items = grammar.rules[key].follow - b.follow
-                if len(new_items) > 0:
-                    keep_going = True
-                    b.follow = b.follow.union(new_items)
-
-        return keep_going
-
-    # Iterate until settled
-    keep_going = True
-    while keep_going:
-        keep_going = False
-        for key, rule in grammar.rules.items():
-            if rule.is_terminal() or rule.is_empty():
-                continue
-
-            if isinstance(rule,Seq):
-                keep_going = process_seq(key,rule,keep_going)
-                continue
-
-            if rule.is_symbol_name():
-                keep_going = process_seq(key,[rule],keep_going)
-                continue
-
-            # Now process Choice over sequences:
-            if isinstance(rule,Choice):
-                for seq in [i.as_container() for i in rule]:
-                    keep_going = process_seq(key,seq,keep_going)
+    ir = grammar.lower()
+    for key, rule in grammar.rules.items():
+        follow = ir.follow[ir.nonterminal_id[key]]
+        if follow is not None:
+            rule.follow = ir.terminal_set(follow)
 
 
 def dump_rule_parts(key,rule):
@@ -1315,6 +1289,18 @@ def dump_grammar(rules):
     for key, rule in rules.items():
         dump_rule(key,rule)
 
+def analyzer_digest():
+    """
+    Returns a hex digest of the analyzer's source code.
+    Cached results are keyed by it, so they are discarded whenever the code
+    computing them changes.
+    """
+    h = hashlib.sha256()
+    for module_name in (__name__, RegisterableObject.__module__, CompactParseTable.__module__):
+        with open(sys.modules[module_name].__file__,'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
 def walk(obj,dict_fn):
     """
     Walk a JSON structure, yielding a new copy of the object.
@@ -1331,59 +1317,175 @@ def walk(obj,dict_fn):
     return obj
 
 
-class LookaheadSet(set):
+def bit_indices(bits):
+    """
+    Yields the indices of the 1 bits in a non-negative integer, in increasing order.
+    """
+    while bits != 0:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits = bits ^ low
+
+def digraph(vertices,relation,initial):
+    """
+    The 'digraph' algorithm from DeRemer and Pennello,
+    "Efficient Computation of LALR(1) Look-Ahead Sets", TOPLAS 1982.
+
+    Computes the smallest function F satisfying:
+
+        F(x) = initial[x] union { F(y) | x R y }
+
+    Vertices in the same strongly connected component of R get the same value,
+    so each vertex and each edge is visited only once.
+    Values are combined with the '|' operator, so they may be sets or integer
+    bitmasks.
+
+    Args:
+        vertices: an iterable over the vertices
+        relation: a dictionary mapping a vertex x to the list of vertices y
+           such that x R y.  Vertices without an entry have no successors.
+        initial: a dictionary mapping each vertex to its initial value
+
+    Returns: a dictionary mapping each vertex x to F(x)
+    """
+    INFINITY = float('inf')
+    # Maps a vertex to 0 if unvisited, its depth on the stack while being
+    # visited, or INFINITY when finished.
+    N = dict()
+    F = dict()
+    stack = []
+    no_successors = ()
+    for start in vertices:
+        if N.get(start,0) != 0:
+            continue
+        # Emulate the recursive traversal with an explicit call stack.
+        # Each frame is [vertex, depth, iterator over successors].
+        stack.append(start)
+        N[start] = len(stack)
+        F[start] = initial[start]
+        calls = [[start, len(stack), iter(relation.get(start,no_successors))]]
+        while len(calls) > 0:
+            frame = calls[-1]
+            x = frame[0]
+            descended = False
+            for y in frame[2]:
+                if N.get(y,0) == 0:
+                    stack.append(y)
+                    N[y] = len(stack)
+                    F[y] = initial[y]
+                    calls.append([y, len(stack), iter(relation.get(y,no_successors))])
+                    descended = True
+                    break
+                N[x] = min(N[x],N[y])
+                F[x] = F[x] | F[y]
+            if descended:
+                continue
+            # All successors of x are done.
+            calls.pop()
+            if N[x] == frame[1]:
+                # x is the root of a strongly connected component.
+                while True:
+                    top = stack.pop()
+                    N[top] = INFINITY
+                    F[top] = F[x]
+                    if top == x:
+                        break
+            if len(calls) > 0:
+                parent = calls[-1][0]
+                N[parent] = min(N[parent],N[x])
+                F[parent] = F[parent] | F[x]
+    return F
+
+
+class LookaheadSet:
     """
-    A LookaheadSet is a set of terminals
+    A LookaheadSet is a set of terminals.
+    When printing First sets, it may also contain Empty.
+
+    It is represented as an integer bitmask: bit i is set when the object with
+    registry index i is a member.  Terminals are registered before nonterminals,
+    so their indices are small and dense.  Members are only turned back into
+    objects, via the registry, when iterating or printing.
 
     Once created, it must not change except via the merge method.
+
+    The lookaheads of the items in an ItemSet are interned by the grammar,
+    and never change, so items, item sets and goto edges share them freely.
+    An ItemSet changes a lookahead by replacing it with the interned union.
+    See Grammar.interned_lookahead and ItemSet.merge_lookahead.
     """
-    def __init__(self,*args):
-        super().__init__(*args)
-        self.reset()
+    __slots__ = ('bits', 'registry', 'str', 'interned')
 
-    def reset(self):
+    def __init__(self,elements=(),bits=0,registry=None):
+        """
+        Args:
+            elements: an iterable over registered terminals, or another LookaheadSet
+            bits: a bitmask of registry indices to include
+            registry: the ObjectRegistry for members named by 'bits'
+        """
+        if isinstance(elements,LookaheadSet):
+            bits = bits | elements.bits
+            registry = registry or elements.registry
+        else:
+            for element in elements:
+                bits = bits | (1 << element.reg_info.index)
+                registry = element.reg_info.registry
+        self.bits = bits
+        self.registry = registry
         self.str = None
-        self.hash = None
-        self.has_end_of_text = None
+        # True when shared via Grammar.interned_lookahead.  It must not change.
+        self.interned = False
 
     def includesEndOfText(self):
-        if self.has_end_of_text is None:
-            self.rehash()
-        return self.has_end_of_text
-
-    def rehash(self):
-        """Recomputes self.str and self.hash"""
-        self.str = "{}{}{}".format(LBRACE, " ".join(sorted([str(i) for i in self])), RBRACE)
-        self.hash = self.str.__hash__()
-        self.has_end_of_text = any([isinstance(i,EndOfText) for i in self])
+        return (self.bits & END_OF_TEXT_BIT) != 0
 
     def __str__(self):
         if self.str is None:
-            self.rehash()
+            self.str = "{}{}{}".format(LBRACE, " ".join(sorted([str(i) for i in self])), RBRACE)
         return self.str
 
     def __hash__(self):
-        if self.hash is None:
-            self.rehash()
-        return self.hash
+        return self.bits.__hash__()
+
+    def __eq__(self,other):
+        if not isinstance(other,LookaheadSet):
+            return NotImplemented
+        return self.bits == other.bits
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __contains__(self,element):
+        return (self.bits >> element.reg_info.index) & 1 == 1
+
+    def __iter__(self):
+        """Yields the members, in registry index order"""
+        for index in bit_indices(self.bits):
+            yield self.registry.findByIndex(index)
 
     def merge(self, other):
         """
         Adds the members of the other set.
         Returns: True when something was added to the current set.
         """
-        extras = other.difference(self)
-        if len(extras) > 0:
-            self.update(extras)
-            self.reset()
+        if self.merge_bits(other.bits):
+            self.registry = self.registry or other.registry
             return True
         return False
 
-    def add(self, element):
-        raise RuntimeError("Don't do Lookahead.add")
-
-    def remove(self, element):
-        raise RuntimeError("Don't do Lookahead.remove")
+    def merge_bits(self, bits):
+        """
+        Adds the members encoded as a bitmask of registry indices.
+        Returns: True when something was added to the current set.
+        """
+        extras = bits & ~self.bits
+        if extras != 0:
+            if self.interned:
+                raiseRE("an interned LookaheadSet is immutable")
+            self.bits = self.bits | extras
+            self.str = None
+            return True
+        return False
 
 
 @functools.total_ordering
@@ -1394,17 +1496,23 @@ class ItemSet:
     An ItemSet can only be mutated via methods:
         - close, which can add items and modify lookaheads
     """
+    __slots__ = ('grammar', 'id_to_item', 'id_to_lookahead', 'kernel_item_ids',
+                 'core_index', 'goto', 'is_closed')
+
     class GotoEdge:
         """
         A GotoEdge represents a transition from a source ItemSet
         to a destination ItemSet.  The transition embodies the state change
         that occurs when matching a grammar terminal or nonterminal.
         """
+        __slots__ = ('x', 'next', 'next_item_set_cache')
+
         def __init__(self,x):
             self.x = x
             # Maps source item ID to (next item, lookahead).
             # When    [ A -> alpha . x beta ] is the source item,
             # then    [ A -> alpha x . beta ] is the destination item
+            # The lookahead is the source item's interned lookahead.
             self.next = dict()
 
             self.next_item_set_cache = None
@@ -1418,9 +1526,10 @@ class ItemSet:
 
         def NextItemSet(self,grammar,by_index_memo=None):
             """
-            Lazily creates an unclosed ItemSet out of the next_items tracked by this edge.
+            Lazily creates a closed ItemSet out of the next_items tracked by this edge.
             If by_index_memo is not None, then find and return the previously saved
-            ItemSet with the same core items, if one exists there.
+            ItemSet with the same core items, if one exists there.  It is found
+            by the kernel of the destination, before making an ItemSet.
 
             Returns a pair (bool,ItemSet)
                - True if the ItemSet was newly created
@@ -1428,6 +1537,15 @@ class ItemSet:
             """
             changed = False
             if self.next_item_set_cache is None:
+                if by_index_memo is not None:
+                    # The next items all have the dot past the left end,
+                    # so they are the kernel of the destination.
+                    kernel = frozenset([next_item for (next_item, _) in self.next.values()])
+                    core_index = grammar.item_set_core_index.get(kernel)
+                    if core_index in by_index_memo:
+                        self.next_item_set_cache = by_index_memo[core_index]
+                        return (False, self.next_item_set_cache)
+
                 # Create the item set from the "next" items and associated lookaheads.
                 d = dict()
                 for item_id, next_and_lookahead in self.next.items():
@@ -1465,9 +1583,14 @@ class ItemSet:
         # Maps the ID of a nonterminal X to its GotoEdge.
         self.goto = None
 
+        # True after close() has added all the items it generates.
+        # Closing again can then only modify lookaheads.
+        self.is_closed = False
+
     def internal_add(self,item,lookahead):
         """
         Adds an item-to-lookahead mapping.
+        The item gets the interned lookahead with the same members.
         """
         assert isinstance(item, Item)
         assert isinstance(lookahead, LookaheadSet)
@@ -1475,8 +1598,22 @@ class ItemSet:
         assert isinstance(index,int)
         assert index not in self.id_to_item
         self.id_to_item[index] = item
+        if not lookahead.interned:
+            lookahead = self.grammar.interned_lookahead(lookahead.bits)
         self.id_to_lookahead[index] = lookahead
 
+    def merge_lookahead(self,item_id,bits):
+        """
+        Adds the terminals in a bitmask of registry indices to the lookahead of
+        an item, by replacing it with the interned union.
+        Returns: True when something was added.
+        """
+        lookahead = self.id_to_lookahead[item_id]
+        if bits & ~lookahead.bits == 0:
+            return False
+        self.id_to_lookahead[item_id] = self.grammar.interned_lookahead(lookahead.bits | bits)
+        return True
+
     def as_ordered_parts(self):
         # For readability, put the kernel parts first
         kernel_parts = []
@@ -1508,13 +1645,20 @@ class ItemSet:
         # Note: This is slow. Only use this for tests and printing.
         return self.content_str() < other.content_str()
 
+    def fingerprint(self):
+        """
+        Returns a hashable value identifying the items and lookaheads of this
+        item set: the frozenset of pairs (item index, lookahead bits).
+        Item sets from the same grammar have the same fingerprint exactly
+        when they have the same content_str.
+        """
+        return frozenset([(item_id, lookahead.bits) for item_id, lookahead in self.id_to_lookahead.items()])
+
     def __hash__(self):
-        # Note: This is slow. Only use this for tests and printing.
-        return self.content_str().__hash__()
+        return self.fingerprint().__hash__()
 
     def __eq__(self,other):
-        # Note: This is slow. Only use this for tests and printing.
-        return self.content_str() == other.content_str()
+        return self.fingerprint() == other.fingerprint()
 
     def pretty_key(self):
         # Use this for sorting for output
@@ -1557,44 +1701,50 @@ class ItemSet:
 
         Returns: self
         """
-        def lookup(rule):
-            return grammar.rules[rule.content] if isinstance(rule,SymbolName) else rule
-
-        dirty_dict = self.id_to_lookahead.copy()
-        while len(dirty_dict) > 0:
-            # From the dragon book, 1st ed. 4.38 Sets of LR(1) items construction.
-            #
-            # For each item [ A -> alpha . B beta, a ] in I,
-            # and each production " B -> gamma " in the grammar,
-            # and each terminal b in FIRST(beta a),
-            # add [ B -> . gamma, b ] to I if it is not already there.
-            work_list = dirty_dict
-            dirty_dict = dict()
-            for item_id, lookahead in work_list.items():
-                item = self.id_to_item[item_id]
-                if item.at_end():
-                    continue
-                B = item.next()
-                if not B.is_symbol_name():
-                    continue
-
-                # Compute lookahead. (A fresh LookaheadSet)
-                new_item_lookahead = item.rest_lookahead_with_other_lookahead(lookahead)
-
-                # Iterate over items  [ B -> . B_prod ]
-                # for each production   B -> B_prod   in the grammar.
-                for candidate in item.items_generated_by_next():
-                    candidate_id = candidate.reg_info.index
-                    if candidate_id not in self.id_to_item:
-                        la = LookaheadSet(new_item_lookahead)
-                        self.internal_add(candidate, LookaheadSet(new_item_lookahead))
-                        dirty_dict[candidate_id] = la
-                    else:
-                        if self.id_to_lookahead[candidate_id].merge(new_item_lookahead):
-                            dirty_dict[candidate_id] = self.id_to_lookahead[candidate_id]
+        # From the dragon book, 1st ed. 4.38 Sets of LR(1) items construction.
+        #
+        # For each item [ A -> alpha . B beta, a ] in I,
+        # and each production " B -> gamma " in the grammar,
+        # and each terminal b in FIRST(beta a),
+        # add [ B -> . gamma, b ] to I if it is not already there.
+        #
+        # The items reachable from B, and how lookaheads flow into them, do not
+        # depend on the item set.  So use the closure template for B from the
+        # GrammarIR, and only combine lookaheads here.
+        ir = grammar.lower()
+
+        # The seed items are those in the item set before closing.
+        seeds = [item for item in self.id_to_item.values()
+                 if not item.at_end() and item.next().is_symbol_name()]
+        seed_ids = set([item.reg_info.index for item in seeds])
+
+        # Add missing items, in the same order as a breadth-first closure.
+        if not self.is_closed:
+            items = [ir.item(item) for item in self.id_to_item.values()]
+            for item in ir.closure(items)[len(items):]:
+                self.internal_add(ir.item_object(item), grammar.interned_lookahead(0))
+            self.is_closed = True
+
+        changed = True
+        while changed:
+            changed = False
+            # Maps a nonterminal number to the lookaheads flowing into its productions
+            # from the seed items, i.e. the union of FIRST(beta a).
+            contribution = dict()
+            for item in seeds:
+                bits = item.rest_firsts_without_empty.bits
+                if item.rest_derives_empty:
+                    bits = bits | self.id_to_lookahead[item.reg_info.index].bits
+                n = ir.nonterminal_id[item.next().content]
+                contribution[n] = contribution.get(n,0) | bits
+            for n, bits in contribution.items():
+                for item_id, const_bits, inherits in ir.registry_closure_template(n):
+                    if self.merge_lookahead(item_id, const_bits | bits if inherits else const_bits):
+                        # A seed can be generated by another seed.
+                        changed = changed or (item_id in seed_ids)
         return self
 
-    def gotos_internal(self,grammar,by_index_memo=None):
+    def gotos_internal(self,grammar,by_index_memo=None,changed_item_sets=None):
         """
         Computes the goto mapping for this item set.
 
@@ -1617,6 +1767,9 @@ class ItemSet:
            grammar: The grammar being traversed
            by_index_memo: None, or a dictionary mapping an item-set's core index to the unique
               LALR1 item set with that core.
+           changed_item_sets: None, or a set. When a set, the core index of each
+              destination item set is added to it when the item set was newly created,
+              or when its lookaheads were modified.
 
         Assumes self is closed.
 
@@ -1650,7 +1803,7 @@ class ItemSet:
                     self.goto[xid] = self.GotoEdge(X)
                 edge = self.goto[xid]
                 next_item = grammar.MakeItem(item.lhs, item.rule, item.position+1)
-                edge.add(item,next_item,LookaheadSet(self.id_to_lookahead[item_id]))
+                edge.add(item,next_item,self.id_to_lookahead[item_id])
             changed_initial = True
 
         # The first time around, construct the destination item sets for each edge.
@@ -1658,29 +1811,62 @@ class ItemSet:
         goto_list = []
         changed = changed_initial
         for edge in self.goto.values():
+            # A newly created item set is already closed.
             (created, next_item_set) = edge.NextItemSet(grammar,by_index_memo=by_index_memo)
-            if created:
-                next_item_set.close(grammar)
-            else:
+            grew = False
+            if not created:
                 # Propagate lookaheads
-                for src_item_id, (dest_item,stale_lookahead) in edge.next.items():
-                    src_lookahead = self.id_to_lookahead[src_item_id]
-                    dest_lookahead = next_item_set.id_to_lookahead[dest_item.reg_info.index]
-                    changed = changed | dest_lookahead.merge(src_lookahead)
-                # Propagate to non-kernel items
-                next_item_set.close(grammar)
-
-            changed = changed | created
+                for src_item_id, (dest_item,_) in edge.next.items():
+                    src_bits = self.id_to_lookahead[src_item_id].bits
+                    grew = next_item_set.merge_lookahead(dest_item.reg_info.index, src_bits) | grew
+                if grew:
+                    # Propagate to non-kernel items.
+                    # Otherwise the item set is still closed.
+                    next_item_set.close(grammar)
+
+            if (created or grew) and (changed_item_sets is not None):
+                changed_item_sets.add(next_item_set.core_index)
+            changed = changed | created | grew
             goto_list.append((edge.x, next_item_set))
 
         return (changed,goto_list)
 
-    def gotos(self,grammar,by_index_memo=None):
+    def gotos(self,grammar,by_index_memo=None,changed_item_sets=None):
         # TODO(dneto): I'm keeping this indirection as a convenient place
         # to insert debug output.
-        result = self.gotos_internal(grammar,by_index_memo=by_index_memo)
+        result = self.gotos_internal(grammar,by_index_memo=by_index_memo,changed_item_sets=changed_item_sets)
         return result
 
+class StateSplits:
+    """
+    Statistics on the states of a minimal LR(1) parser, compared to the
+    LALR(1) parser for the same grammar, with fields:
+
+      .cores:  The number of item set cores, i.e. of LALR(1) states.
+      .states: The number of minimal LR(1) states.
+      .split:  A dictionary mapping the core index of each core that was split
+               to the number of states it was split into.
+      .merge_conflicts:
+               The list of the table's Conflicts that no canonical LR(1) state
+               with the same core has on the same terminal.  Merging states
+               made them.
+    """
+    def __init__(self,cores,states,split,merge_conflicts=()):
+        self.cores = cores
+        self.states = states
+        self.split = split
+        self.merge_conflicts = list(merge_conflicts)
+
+    def __str__(self):
+        parts = ["{} states for {} cores, {} cores split\n".format(self.states,self.cores,len(self.split))]
+        for core_index in sorted(self.split):
+            parts.append("#{}: {} states\n".format(core_index,self.split[core_index]))
+        if len(self.merge_conflicts) > 0:
+            parts.append("{} conflicts from merging states:\n".format(len(self.merge_conflicts)))
+            for conflict in self.merge_conflicts:
+                parts.append("{}\n".format(str(conflict)))
+        return "".join(parts)
+
 class ParseTable:
     """
     An LALR(1) parser table with fields:
@@ -1688,11 +1874,16 @@ class ParseTable:
       .grammar:    The Grammar.  Use this to look up symbols and item sets by index.
       .states:     The list of parser states, where each state is identified with
                    an LALR(1) item set. Each ItemSet is closed and has a core index.
+                   In a minimal LR(1) table, several states may share a core.
+                   Each has an index of its own, held in its core_index.
       .action:     The parser action table, mapping (state.core_index,token) to an Action object.
                    Any combination not in the table is a parse error.
       .goto:       The goto table, mapping (state.core_index,nonterminal) to another state.
       .reductions: A list of Reduce objects, in index order.
       .conflicts:  A list of Conflicts
+      .valid_terminals: Maps state.core_index to a bitmask over the registry
+                   indices of the terminals with an action in that state.
+                   A tokenizer need only try those terminals.
     """
     def __init__(self,grammar,states,action_table,goto,reductions,conflicts):
         self.grammar = grammar
@@ -1702,6 +1893,10 @@ class ParseTable:
         self.reductions = reductions
         self.conflicts = conflicts
 
+        self.valid_terminals = dict([(s.core_index,0) for s in self.states])
+        for (state_id,terminal_id) in self.action:
+            self.valid_terminals[state_id] |= 1 << terminal_id
+
         self.core_index_to_state = dict()
         for s in self.states:
             self.core_index_to_state[s.core_index] = s
@@ -1781,6 +1976,694 @@ class ParseTable:
     def __str__(self):
         return "".join(self.all_parts())
 
+    def compact(self):
+        """
+        Returns this table as a CompactParseTable.
+
+        States keep their order: state i is self.states[i], so for a table
+        made by Grammar.LALR1 or Grammar.MinimalLR1, it is the state with
+        core index i.  Terminals are in order of their strings, and
+        nonterminals are in the order of the grammar's rules.
+        """
+        ir = self.grammar.lower()
+        terminals = sorted([str(t) for t in ir.terminals])
+        terminal_index = dict([(t,i) for i,t in enumerate(terminals)])
+        nonterminals = list(ir.names)
+        nonterminal_index = dict([(n,i) for i,n in enumerate(nonterminals)])
+        row = dict([(item_set.core_index,i) for i,item_set in enumerate(self.states)])
+
+        action = array('i',[0]) * (len(self.states) * len(terminals))
+        for (state_id, terminal_index_in_registry), a in self.action.items():
+            terminal = str(self.grammar.findByIndex(terminal_index_in_registry))
+            if isinstance(a, Shift):
+                word = encode_action(ACTION_SHIFT, row[a.index])
+            elif isinstance(a, Reduce):
+                word = encode_action(ACTION_REDUCE, a.index)
+            else:
+                word = encode_action(ACTION_ACCEPT)
+            action[row[state_id] * len(terminals) + terminal_index[terminal]] = word
+        goto = array('i',[NO_STATE]) * (len(self.states) * len(nonterminals))
+        for (state_id, X), item_set in self.goto.items():
+            goto[row[state_id] * len(nonterminals) + nonterminal_index[X.content]] = row[item_set.core_index]
+        reduction_lhs = array('i',[nonterminal_index[r.item.lhs.content] for r in self.reductions])
+        reduction_length = array('i',[len([x for x in r.item.items() if not x.is_empty()])
+                                      for r in self.reductions])
+        # Maps a terminal registry index to its bit in the compact masks.
+        terminal_bit = dict([(t.reg_info.index, 1 << terminal_index[str(t)]) for t in ir.terminals])
+        valid = masks_to_words([sum([terminal_bit[t] for t in bit_indices(self.valid_terminals[s.core_index])])
+                                for s in self.states], len(terminals))
+        return CompactParseTable(terminals, nonterminals, action, goto,
+                                 reduction_lhs, reduction_length, len(self.conflicts),
+                                 valid=valid)
+
+    def to_json_dict(self):
+        """
+        Returns a JSON-compatible dictionary encoding this table's states,
+        actions, gotos, reductions and conflicts.
+
+        Grammar objects are named by their text rather than by registry index:
+          - a terminal is an index into the "terminals" list of strings,
+          - a nonterminal is its name,
+          - an item is [lhs name, alternative index, position],
+          - a state is its core index, and
+          - an action is its string form: "acc", "s#<state>", or "r#<reduction>".
+        A state only records its kernel items. Loading recomputes the closure.
+        """
+        g = self.grammar
+        terminals = [str(t) for t in g.lower().terminals]
+        terminal_id = dict([(t,i) for i,t in enumerate(terminals)])
+        def terminal_ref(terminal):
+            return terminal_id[str(terminal)]
+        def item_ref(item):
+            alternatives = g.alternatives(item.lhs.content)
+            for i in range(len(alternatives)):
+                if alternatives[i] is item.rule:
+                    return [item.lhs.content, i, item.position]
+            raiseRE("item is not in the grammar: {}".format(str(item)))
+
+        states = []
+        for item_set in self.states:
+            kernel = []
+            for item_id, item in item_set.id_to_item.items():
+                if item.is_kernel():
+                    lookahead = item_set.id_to_lookahead[item_id]
+                    kernel.append([item_ref(item), [terminal_ref(t) for t in lookahead]])
+            states.append([item_set.core_index, kernel])
+        action = [[state_id, terminal_ref(g.findByIndex(terminal_index)), str(a)]
+                  for (state_id, terminal_index), a in self.action.items()]
+        goto = [[state_id, X.content, item_set.core_index]
+                for (state_id, X), item_set in self.goto.items()]
+        conflicts = [[c.item_set.core_index, terminal_ref(c.terminal), str(c.prev_action), str(c.action)]
+                     for c in self.conflicts]
+        return {
+            "version": PARSE_TABLE_FORMAT_VERSION,
+            "terminals": terminals,
+            "states": states,
+            "reductions": [item_ref(r.item) for r in self.reductions],
+            "action": action,
+            "goto": goto,
+            "conflicts": conflicts,
+        }
+
+    @staticmethod
+    def from_json_dict(grammar, data):
+        """
+        Returns the ParseTable encoded by to_json_dict, for a Grammar loaded
+        from the same JSON text, start symbol, and ignored rule.
+
+        The grammar must not have created any item sets yet, so that each
+        state gets back its original core index.
+
+        Raises RuntimeError, KeyError, IndexError, TypeError or ValueError when
+        the data does not match the grammar.
+        """
+        if data["version"] != PARSE_TABLE_FORMAT_VERSION:
+            raiseRE("unsupported parse table format: {}".format(data["version"]))
+        if len(grammar.item_set_core_index) > 0:
+            raiseRE("expected a grammar without item sets")
+        terminal_by_str = dict([(str(t),t) for t in grammar.lower().terminals])
+        terminals = [terminal_by_str[t] for t in data["terminals"]]
+        def make_item(ref):
+            (lhs, alternative, position) = ref
+            return grammar.MakeItem(lhs, grammar.alternatives(lhs)[alternative], position)
+        def make_lookahead(terminal_refs):
+            return LookaheadSet([terminals[t] for t in terminal_refs], registry=grammar.registry)
+
+        states = []
+        by_index = dict()
+        for core_index, kernel in data["states"]:
+            item_set = ItemSet(grammar,[(make_item(ref), make_lookahead(la)) for ref, la in kernel])
+            if item_set.core_index != core_index:
+                raiseRE("state #{} was loaded as #{}".format(core_index, item_set.core_index))
+            states.append(item_set.close(grammar))
+            by_index[core_index] = item_set
+
+        reductions = [Reduce(make_item(ref), i) for i, ref in enumerate(data["reductions"])]
+        def make_action(text):
+            if text == "acc":
+                return Accept()
+            (kind, index) = text.split("#")
+            if kind == "s":
+                return Shift(by_index[int(index)])
+            if kind == "r":
+                return reductions[int(index)]
+            raiseRE("unknown action: {}".format(text))
+
+        action_table = dict()
+        for state_id, t, text in data["action"]:
+            action_table[(state_id, terminals[t].reg_info.index)] = make_action(text)
+        goto = dict()
+        for state_id, name, next_state_id in data["goto"]:
+            goto[(state_id, grammar.MakeSymbolName(name))] = by_index[next_state_id]
+        conflicts = [Conflict(by_index[state_id], terminals[t], make_action(prev), make_action(text))
+                     for state_id, t, prev, text in data["conflicts"]]
+        return ParseTable(grammar, states, action_table, goto, reductions, conflicts)
+
+
+class GrammarIR:
+    """
+    A GrammarIR is a compact lowering of a Grammar in Canonical Form, for use
+    in the inner loops of the analyses.  Rule objects and name lookups are
+    replaced by dense integers.
+
+    Symbols are integers:
+      - a terminal has a terminal id in 0 .. num_terminals-1.
+        Terminal ids follow registry index order.
+      - nonterminal number n has symbol n + num_terminals.
+        Every rule name is a nonterminal, including names defined as a Token.
+
+    Sets of terminals are bitmasks over terminal ids.
+
+    Items are integers indexing a flat item space: a production with k symbols
+    occupies k+1 consecutive item ids, one for each position of the dot.
+    So advancing the dot over a symbol adds 1 to the item id.
+    Productions for items follow Item.items_generated_by_next: Empty
+    alternatives are skipped, and a nonterminal defined as another
+    nonterminal's name takes on that nonterminal's alternatives.
+    They are lowered lazily, on first use.
+
+    Members:
+        .grammar: the Grammar
+        .terminals: list mapping a terminal id to its Rule (a Token or EndOfText)
+        .terminal_id: dictionary mapping a terminal's registry index to its terminal id
+        .num_terminals: the number of terminals
+        .names: list mapping a nonterminal number to its name
+        .nonterminal_id: dictionary mapping a name to its nonterminal number
+        .alternatives: list mapping a nonterminal number to its alternatives,
+            each a tuple of symbols. An Empty alternative is the empty tuple.
+        .alternative_rules: list mapping a nonterminal number to the Rules for
+            its alternatives
+        .first: list mapping a nonterminal number to its First set, without Empty
+        .nullable: list mapping a nonterminal number to True when it derives Empty
+        .follow: list mapping a nonterminal number to its Follow set, or None
+            when its rule is a Token or Empty
+        .suffix_firsts: dictionary mapping the registry index of a Flat
+            production to its First-of-suffix table. See suffix_first.
+        .item_rest: list mapping an item to the pair (bits,derives_empty)
+            for the symbols after the symbol after the dot
+        .item_symbol: array mapping an item to the symbol after the dot,
+            or -1 when the dot is at the end
+        .item_production: array mapping an item to its production
+        .production_lhs: array mapping a production to its nonterminal number
+        .production_rule: list mapping a production to its right-hand side Rule
+        .production_start: array mapping a production to its first item
+    """
+    def __init__(self,grammar):
+        self.grammar = grammar
+        rules = grammar.rules
+
+        self.names = list(rules.keys())
+        self.nonterminal_id = {name: n for n, name in enumerate(self.names)}
+
+        # Find the terminals.
+        terminals = {grammar.end_of_text.reg_info.index: grammar.end_of_text}
+        def add_terminals(rule):
+            if rule.is_terminal():
+                terminals[rule.reg_info.index] = rule
+            elif rule.is_container():
+                for child in rule:
+                    add_terminals(child)
+        for rule in rules.values():
+            add_terminals(rule)
+        self.terminals = [terminals[i] for i in sorted(terminals)]
+        self.terminal_id = {t.reg_info.index: i for i, t in enumerate(self.terminals)}
+        self.num_terminals = len(self.terminals)
+        self.end_of_text_id = self.terminal_id[grammar.end_of_text.reg_info.index]
+
+        self.alternatives = []
+        self.alternative_rules = []
+        for name in self.names:
+            rule = rules[name]
+            alternative_rules = list(rule) if isinstance(rule,Choice) else [rule]
+            self.alternative_rules.append(alternative_rules)
+            self.alternatives.append([self.phrase(alt) for alt in alternative_rules])
+
+        self.compute_first()
+        self.suffix_firsts = dict()
+        self.compute_follow()
+
+        # The item space.
+        self.item_symbol = array('i')
+        self.item_production = array('i')
+        self.item_rest = []
+        self.production_lhs = array('i')
+        self.production_rule = []
+        self.production_start = array('i')
+        # Maps a nonterminal number to the list of its productions, or None
+        # when not yet lowered.
+        self.the_productions = [None] * len(self.names)
+        # Maps an item to its Item object, or None when not yet created.
+        self.item_objects = []
+        # Maps a nonterminal number to its closure template, or None.
+        self.closure_templates = [None] * len(self.names)
+        # Maps a nonterminal number to its closure template over registry
+        # indices, or None.  See registry_closure_template.
+        self.registry_closure_templates = [None] * len(self.names)
+        # Maps a bitmask over terminal ids to the equivalent bitmask
+        # over registry indices.
+        self.registry_bits_memo = {0: 0}
+
+    def symbol(self,rule):
+        """
+        Returns the symbol for a Rule which is a SymbolName or a terminal.
+        """
+        if rule.is_symbol_name():
+            if rule.content not in self.nonterminal_id:
+                raiseRE("undefined nonterminal: {}".format(rule.content))
+            return self.nonterminal_id[rule.content] + self.num_terminals
+        if rule.is_terminal():
+            return self.terminal_id[rule.reg_info.index]
+        raiseRE("not a symbol: {}".format(str(rule)))
+
+    def phrase(self,rule):
+        """
+        Returns the tuple of symbols for a Flat production.
+        """
+        if rule.is_empty():
+            return ()
+        if isinstance(rule,Seq):
+            return tuple([self.symbol(i) for i in rule if not i.is_empty()])
+        return (self.symbol(rule),)
+
+    def is_terminal(self,symbol):
+        return symbol < self.num_terminals
+
+    def compute_first(self):
+        """
+        Computes .nullable from the grammar's nullable analysis, then .first.
+
+        First(A) is the union of the terminals that can begin A directly,
+        and of First(B) for each nonterminal B that can begin A.  That
+        relation is built once, and solved by the 'digraph' algorithm:
+        each strongly connected component of it is visited once, with
+        the components finished in topological order.
+        """
+        num_terminals = self.num_terminals
+        nullable_names = self.grammar.nullable()
+        nullable = [name in nullable_names for name in self.names]
+        self.nullable = nullable
+
+        # Maps a nonterminal number to the terminals beginning it directly.
+        initial = [0] * len(self.names)
+        # Maps a nonterminal number to the nonterminals that can begin it.
+        begins_with = dict()
+        for n, alternatives in enumerate(self.alternatives):
+            starts = set()
+            for alternative in alternatives:
+                for s in alternative:
+                    if s < num_terminals:
+                        initial[n] = initial[n] | (1 << s)
+                        break
+                    starts.add(s - num_terminals)
+                    if not nullable[s - num_terminals]:
+                        break
+            if len(starts) > 0:
+                begins_with[n] = sorted(starts)
+        F = digraph(range(len(self.names)), begins_with, initial)
+        self.first = [F[n] for n in range(len(self.names))]
+
+    def suffix_first(self,rule,position=0):
+        """
+        Returns a pair (bits,derives_empty) for the symbols of a Flat
+        production at the given position and later, where bits is the
+        First set of that suffix without Empty.  Positions are the same as
+        Item positions, and a position past the end gives the empty suffix.
+
+        The pairs for each production are kept in its First-of-suffix table,
+        which is filled by a right-to-left pass over the production, but only
+        as far left as has been asked for.
+        """
+        table = self.suffix_firsts.get(rule.reg_info.index)
+        if table is None:
+            if rule.is_empty():
+                members = []
+            elif isinstance(rule,Seq):
+                members = rule.children
+            else:
+                members = [rule]
+            table = [None] * len(members) + [(0, True)]
+            self.suffix_firsts[rule.reg_info.index] = table
+        position = min(position, len(table) - 1)
+        if table[position] is None:
+            members = rule.children if isinstance(rule,Seq) else [rule]
+            num_terminals = self.num_terminals
+            i = position
+            while table[i] is None:
+                i = i + 1
+            (bits, derives_empty) = table[i]
+            while i > position:
+                i = i - 1
+                member = members[i]
+                if not member.is_empty():
+                    s = self.symbol(member)
+                    if s < num_terminals:
+                        (bits, derives_empty) = (1 << s, False)
+                    elif self.nullable[s - num_terminals]:
+                        bits = bits | self.first[s - num_terminals]
+                    else:
+                        (bits, derives_empty) = (self.first[s - num_terminals], False)
+                table[i] = (bits, derives_empty)
+        return table[position]
+
+    def compute_follow(self):
+        """
+        Computes .follow.
+
+        Follow sets belong to the rule objects, so nonterminals sharing the
+        same rule object also share the Follow set.
+
+        For each production A -> alpha B beta, Follow(B) includes First(beta)
+        without Empty, and also Follow(A) when beta derives Empty.  That
+        relation is built once, reading First(beta) from the First-of-suffix
+        tables, and solved by the 'digraph' algorithm.
+        """
+        num_terminals = self.num_terminals
+        rules = self.grammar.rules
+        # Maps a nonterminal number to the index of its Follow set, or -1
+        # when its rule is a Token or Empty.
+        slot_of_object = dict()
+        slot = []
+        for name in self.names:
+            rule = rules[name]
+            if rule.is_terminal() or rule.is_empty():
+                slot.append(-1)
+            else:
+                slot.append(slot_of_object.setdefault(id(rule),len(slot_of_object)))
+        initial = [0] * len(slot_of_object)
+        start = self.nonterminal_id[self.grammar.start_symbol]
+        if slot[start] >= 0:
+            initial[slot[start]] = 1 << self.end_of_text_id
+
+        # Maps a Follow set index to the set of Follow set indices it includes.
+        includes = dict()
+        for n, alternatives in enumerate(self.alternatives):
+            if slot[n] < 0:
+                continue
+            for rule, alternative in zip(self.alternative_rules[n], alternatives):
+                for i, s in enumerate(alternative):
+                    if s < num_terminals:
+                        continue
+                    b = slot[s - num_terminals]
+                    if b < 0:
+                        continue
+                    (bits, derives_empty) = self.suffix_first(rule,i+1)
+                    initial[b] = initial[b] | bits
+                    if derives_empty and b != slot[n]:
+                        includes.setdefault(b,set()).add(slot[n])
+        includes = {b: sorted(c) for b, c in includes.items()}
+        F = digraph(range(len(initial)), includes, initial)
+        self.follow = [(F[b] if b >= 0 else None) for b in slot]
+
+    def terminal_set(self,bits,derives_empty=False):
+        """
+        Returns the Python set of terminal Rules for a bitmask over terminal ids,
+        also including Empty when derives_empty is True.
+        """
+        result = set([self.terminals[t] for t in bit_indices(bits)])
+        if derives_empty:
+            result.add(self.grammar.empty)
+        return result
+
+    def registry_bits(self,bits):
+        """
+        Returns the bitmask over registry indices for a bitmask over terminal ids.
+        """
+        result = self.registry_bits_memo.get(bits)
+        if result is None:
+            result = 0
+            for t in bit_indices(bits):
+                result = result | (1 << self.terminals[t].reg_info.index)
+            self.registry_bits_memo[bits] = result
+        return result
+
+    def productions(self,n):
+        """
+        Returns the list of productions for items with nonterminal number n
+        on the left-hand side, lowering them on first use.
+        """
+        if self.the_productions[n] is None:
+            rules = self.grammar.rules
+            rule = rules[self.names[n]]
+            if rule.is_symbol_name():
+                rule = rules[rule.content]
+            rhs = [rule] if rule.is_terminal() else rule
+            result = []
+            for production in rhs:
+                if production.is_empty():
+                    continue
+                p = len(self.production_rule)
+                symbols = self.phrase(production)
+                self.production_lhs.append(n)
+                self.production_rule.append(production)
+                self.production_start.append(len(self.item_symbol))
+                for i, s in enumerate(symbols):
+                    self.item_symbol.append(s)
+                    self.item_production.append(p)
+                    self.item_rest.append(self.suffix_first(production,i+1))
+                self.item_symbol.append(-1)
+                self.item_production.append(p)
+                self.item_rest.append((0, True))
+                self.item_objects.extend([None] * (len(symbols) + 1))
+                result.append(p)
+            self.the_productions[n] = result
+        return self.the_productions[n]
+
+    def root_item(self):
+        """
+        Returns the item [ LANGUAGE -> . start_symbol EndOfText ]
+        """
+        return self.production_start[self.productions(self.nonterminal_id[LANGUAGE])[0]]
+
+    def item(self,item_object):
+        """
+        Returns the item for an Item object.
+        """
+        n = self.nonterminal_id[item_object.lhs.content]
+        for p in self.productions(n):
+            if self.production_rule[p].reg_info.index == item_object.rule.reg_info.index:
+                return self.production_start[p] + item_object.position
+        raiseRE("no production for item: {}".format(str(item_object)))
+
+    def item_object(self,item):
+        """
+        Returns the Item object for an item.
+        """
+        result = self.item_objects[item]
+        if result is None:
+            p = self.item_production[item]
+            result = self.grammar.MakeItem(self.names[self.production_lhs[p]],
+                                           self.production_rule[p],
+                                           item - self.production_start[p])
+            self.item_objects[item] = result
+        return result
+
+    def item_rest_first(self,item):
+        """
+        Returns a pair (bits,derives_empty) for the symbols after the
+        symbol after the dot.
+        """
+        return self.item_rest[item]
+
+    def generated(self,item):
+        """
+        Returns the list of items [ B -> . gamma ] generated by an item
+        [ A -> alpha . B beta ], or an empty list when no nonterminal follows the dot.
+        """
+        s = self.item_symbol[item]
+        if s < self.num_terminals:
+            return []
+        return [self.production_start[p] for p in self.productions(s - self.num_terminals)]
+
+    def closure(self,kernel):
+        """
+        Returns the list of items in the closure of the given sequence of items,
+        starting with those items, and then in breadth-first order of discovery,
+        just like ItemSet.close.
+        """
+        result = list(kernel)
+        seen = set(result)
+        for item in result:
+            for candidate in self.generated(item):
+                if candidate not in seen:
+                    seen.add(candidate)
+                    result.append(candidate)
+        return result
+
+    def closure_template(self,n):
+        """
+        Computes the closure template for nonterminal number n.  It is the
+        closure of the items [ B -> . gamma, # ] for each production B -> gamma
+        of nonterminal B, where '#' is a dummy lookahead standing for whatever
+        lookaheads flow into B.  ItemSet.close and lookahead_closure use it.
+
+        The template is cached in self.closure_templates.
+
+        Returns: a list of triples (item, const_bits, inherits) where:
+            item: an item in the closure, with the dot at the start
+            const_bits: a bitmask over terminal ids of the lookaheads the item
+                gets from FIRST sets within the closure
+            inherits: True when the lookaheads flowing into B also flow
+                into the item
+        """
+        if self.closure_templates[n] is None:
+            masks = dict()
+            for p in self.productions(n):
+                masks[self.production_start[p]] = (0, True)
+            dirty = list(masks.keys())
+            while len(dirty) > 0:
+                work_list = dirty
+                dirty = []
+                for parent in work_list:
+                    children = self.generated(parent)
+                    if len(children) == 0:
+                        continue
+                    (const_bits, inherits) = masks[parent]
+                    (rest_bits, rest_derives_empty) = self.item_rest_first(parent)
+                    if rest_derives_empty:
+                        const_bits = const_bits | rest_bits
+                    else:
+                        (const_bits, inherits) = (rest_bits, False)
+                    for candidate in children:
+                        old = masks.get(candidate,None)
+                        new = (const_bits, inherits) if old is None else (old[0] | const_bits, old[1] or inherits)
+                        if new != old:
+                            masks[candidate] = new
+                            dirty.append(candidate)
+            self.closure_templates[n] = [(item, const_bits, inherits) for item, (const_bits, inherits) in masks.items()]
+        return self.closure_templates[n]
+
+    def registry_closure_template(self,n):
+        """
+        Returns closure_template(n) in the terms of ItemSet.close: a list of
+        triples (item_id, const_bits, inherits), where item_id is the registry
+        index of the Item object, and const_bits is a bitmask over registry
+        indices.  It is cached in self.registry_closure_templates.
+        """
+        if self.registry_closure_templates[n] is None:
+            self.registry_closure_templates[n] = [(self.item_object(item).reg_info.index, self.registry_bits(const_bits), inherits)
+                                                  for item, const_bits, inherits in self.closure_template(n)]
+        return self.registry_closure_templates[n]
+
+    def lookahead_closure(self,kernel_item):
+        """
+        Computes the closure of the single LR(1) item [kernel_item, #], where
+        '#' is a dummy lookahead standing for whatever lookahead the kernel
+        item has in a particular item set.
+
+        Returns: a dictionary mapping each item in the closure (including
+        kernel_item itself) to a pair (spontaneous,propagated) where:
+            spontaneous: a bitmask over terminal ids of the lookaheads generated
+                for the item regardless of the kernel item's lookahead
+            propagated: True when the kernel item's lookahead flows into the
+                item's lookahead, i.e. when '#' is in the item's lookahead
+        """
+        result = { kernel_item: (0, True) }
+        s = self.item_symbol[kernel_item]
+        if s < self.num_terminals:
+            return result
+        (spontaneous, propagated) = self.item_rest_first(kernel_item)
+        for item, const_bits, inherits in self.closure_template(s - self.num_terminals):
+            (old_spontaneous, old_propagated) = result.get(item,(0,False))
+            if inherits:
+                result[item] = (old_spontaneous | const_bits | spontaneous, old_propagated or propagated)
+            else:
+                result[item] = (old_spontaneous | const_bits, old_propagated)
+        return result
+
+
+    def lr1_expand(self,kernel):
+        """
+        Closes a canonical LR(1) state, and finds its transitions.
+
+        Args:
+            kernel: the state's kernel, as a tuple of pairs (item, lookahead bits)
+
+        Returns: a pair (closure, goto) where:
+            closure: the list of pairs (item, lookahead bits) in the closure of
+                the kernel, in the order of the closure method
+            goto: a list of pairs (X, next_kernel) where X is a symbol, and
+                next_kernel is the kernel of the state reached over X.
+                The pairs are in order of X's first appearance after a dot in
+                the closure, and there is no transition over EndOfText.
+        """
+        bits_for = dict()
+        for kernel_item, kernel_bits in kernel:
+            for item, (spontaneous, propagated) in self.lookahead_closure(kernel_item).items():
+                bits_for[item] = bits_for.get(item,0) | spontaneous | (kernel_bits if propagated else 0)
+        closure = [(item, bits_for[item]) for item in self.closure([item for item, _ in kernel])]
+
+        next_kernels = dict()
+        for item, bits in closure:
+            x = self.item_symbol[item]
+            if x >= 0 and x != self.end_of_text_id:
+                next_kernels.setdefault(x,[]).append((item+1, bits))
+        return (closure, [(x, tuple(next_kernel)) for x, next_kernel in next_kernels.items()])
+
+    def lr1_conflicts(self):
+        """
+        Finds the conflicts of the canonical LR(1) states.
+
+        Returns: the set of pairs (core, t) such that some canonical LR(1)
+            state has a conflict on terminal id t, where core is the sorted
+            tuple of the state's kernel items.  A conflict is a terminal on
+            which two items reduce, or one item reduces and another shifts
+            or accepts.
+        """
+        result = set()
+        root = ((self.root_item(), 1 << self.end_of_text_id),)
+        seen = set([frozenset(root)])
+        work_list = [root]
+        for kernel in work_list:
+            (closure, goto) = self.lr1_expand(kernel)
+            shifted = 0
+            for item, _ in closure:
+                x = self.item_symbol[item]
+                if 0 <= x < self.num_terminals:
+                    shifted = shifted | (1 << x)
+            reduced = 0
+            for item, bits in closure:
+                if self.item_symbol[item] < 0:
+                    both = bits & (shifted | reduced)
+                    if both:
+                        core = tuple(sorted([i for i, _ in kernel]))
+                        for t in bit_indices(both):
+                            result.add((core, t))
+                    reduced = reduced | bits
+            for _, next_kernel in goto:
+                key = frozenset(next_kernel)
+                if key not in seen:
+                    seen.add(key)
+                    work_list.append(next_kernel)
+        return result
+
+    def lower_all(self):
+        """
+        Lowers the productions of every nonterminal, and computes their
+        closure templates.
+        """
+        for n in range(len(self.names)):
+            self.closure_template(n)
+
+    def __getstate__(self):
+        """
+        Only pickles the integer parts, for use in worker processes.
+        The copy can not lower more productions, so call lower_all first.
+        """
+        state = dict(self.__dict__)
+        for name in ('grammar','terminals','alternative_rules','production_rule','item_objects','registry_closure_templates'):
+            state[name] = None
+        return state
+
+
+# The GrammarIR of a worker process.  See Grammar.LR1_ItemSets.
+worker_ir = None
+
+def init_worker(ir):
+    global worker_ir
+    worker_ir = ir
+
+def worker_lr1_expand(kernel):
+    return worker_ir.lr1_expand(kernel)
 
 class Grammar:
     """
@@ -1817,6 +2700,17 @@ class Grammar:
         """
         return self.rules[rule_name]
 
+    def alternatives(self, rule_name):
+        """
+        Returns the right-hand sides of the named rule, as an iterable over
+        Rules.  Assumes the grammar is in Canonical Form.
+        A rule defined as another rule's name takes on that rule's alternatives.
+        """
+        rhs = self.rules[rule_name]
+        if rhs.is_symbol_name():
+            rhs = self.rules[rhs.content]
+        return [rhs] if rhs.is_terminal() else rhs
+
     def findByIndex(self, obj_index):
         """
         Finds a registered object by its index.
@@ -1838,12 +2732,24 @@ class Grammar:
 
         self.json_text = json_text
         self.start_symbol = start_symbol
+        self.ignore = ignore
         self.empty = Empty(reg=self)
         self.end_of_text = EndOfText(reg=self)
+        assert self.empty.reg_info.index == EMPTY_INDEX
+        assert self.end_of_text.reg_info.index == END_OF_TEXT_INDEX
 
         # Maps an item set core (ie. no lookaheads) to its sequential index.
         self.item_set_core_index = dict()
 
+        # The GrammarIR lowering of the rules, or None. See lower().
+        self.lowered = None
+        # The set of names of rules deriving the empty string, or None.
+        # See nullable().
+        self.nullable_names = None
+        # Maps a bitmask of registry indices to its interned LookaheadSet.
+        # See interned_lookahead.
+        self.interned_lookaheads = dict()
+
         # First decode it without any interpretation.
         pass0 = json.loads(json_text)
 
@@ -1865,12 +2771,17 @@ class Grammar:
         # Remove any rules that should be ignored
         # The WGSL grammar has _reserved, which includes 'attribute' but
         # that is also the name of a different grammar rule.
-        if ignore in pass0["rules"]:
-            del pass0["rules"][ignore]
+        # Keep its JSON, for the reserved words of the tokenizer.
+        self.ignored_json_rule = pass0["rules"].pop(ignore, None)
 
         # Now decode, transforming leaves and nonterminals to Rule objects.
         memo = {} # memoization table used during construction
         pass1 = walk(pass0, lambda dct: json_hook(self,memo,True,dct))
+        # A rule that is just a string token of the same name, like
+        # c -> 'c', is referenced as that token.
+        for (name, rule) in pass1["rules"].items():
+            if isinstance(rule, Fixed) and rule.content == name:
+                memo[("SYMBOL",name)] = rule
         pass2 = walk(pass1, lambda dct: json_hook(self,memo,False,dct))
         self.json_grammar = pass2
 
@@ -1944,10 +2855,35 @@ class Grammar:
         """
         self.rules = canonicalize_grammar(self,self.empty)
         self.is_canonical = True
+        self.lowered = None
+        self.nullable_names = None
 
     def reset_first_follow(self):
         for _, rule in self.rules.items():
             rule.reset_first_follow()
+        self.lowered = None
+        self.nullable_names = None
+
+    def nullable(self):
+        """
+        Returns the set of names of the rules that derive the empty string,
+        computing it on first use.  See compute_nullable.
+        Like the GrammarIR, it is discarded by canonicalize and
+        reset_first_follow.
+        Assumes the grammar is in Canonical Form.
+        """
+        if self.nullable_names is None:
+            self.nullable_names = compute_nullable(self.rules)
+        return self.nullable_names
+
+    def lower(self):
+        """
+        Returns the GrammarIR for this grammar's rules, creating it on first use.
+        Assumes the grammar is in Canonical Form.
+        """
+        if self.lowered is None:
+            self.lowered = GrammarIR(self)
+        return self.lowered
 
     def compute_first(self):
         """
@@ -2041,16 +2977,41 @@ class Grammar:
         content = ("\n\n" if po.more_newlines else "\n").join(parts)
         return content
 
-    def register_item_set(self,item_set):
+    def interned_lookahead(self,bits):
+        """
+        Returns the shared, immutable LookaheadSet for a bitmask of registry indices.
+        """
+        result = self.interned_lookaheads.get(bits)
+        if result is None:
+            result = LookaheadSet(bits=bits,registry=self.registry)
+            result.interned = True
+            self.interned_lookaheads[bits] = result
+        return result
+
+    def register_item_set(self,item_set,copy=0):
         """
         Registers an item set, and return an index such that any item set with
         the same core will map to the same index.
         Indices start at 0 and go up by 1.
 
+        A nonzero copy registers another state with the same core, for a
+        parser whose states are not identified with their cores.  It gets
+        an index of its own.  See MinimalLR1.
+
         Returns its index.
         """
         assert isinstance(item_set,ItemSet)
-        core = item_set.kernel_item_ids
+        return self.register_core(item_set.kernel_item_ids, copy)
+
+    def register_core(self,core,copy=0):
+        """
+        Registers an item set core, given as the frozenset of its kernel
+        Items, without making an ItemSet.  See register_item_set.
+
+        Returns its index.
+        """
+        if copy > 0:
+            core = (core, copy)
         if core in self.item_set_core_index:
             return self.item_set_core_index[core]
         # Register it
@@ -2389,25 +3350,29 @@ class Grammar:
             A ->  B | epsilon
             B ->  beta1 | beta2 | epsilon
 
-        Then replace A by B in all rules.
+        Then replace A by B in all rules.  More generally, B may be any
+        nonterminal deriving the empty string.
         """
 
-        has_empty = set()
+        # The rules may have been rewritten since the nullable analysis.
+        self.nullable_names = None
+        nullable = self.nullable()
+        visited = set()
         # Map a rule name to the rule name it should be replaced by.
         replacement = dict()
 
         for A in reversed(self.preorder()):
+            visited.add(A)
             A_rule = self.rules[A]
             (non_empties,empties) = A_rule.partition_epsilon()
             if len(empties) > 0:
-                has_empty.add(A)
                 # We've visited descendants already. See if this is an inlining case.
                 if len(non_empties) == 1:
                     # Does it look like 'B'?
                     option = non_empties[0].as_container()
                     if len(option) == 1:
                         first = option[0]
-                        if first.is_symbol_name() and first.content in has_empty:
+                        if first.is_symbol_name() and first.content in visited and first.content in nullable:
                             replacement[A] = first.content
                             #print("  replacing {} with {}".format(A,first.content))
 
@@ -2430,6 +3395,127 @@ class Grammar:
 
         self.remove_unused_rules()
 
+    def eliminate_empty(self):
+        """
+        Rewrites the rules so no nonterminal derives the empty string.
+        The language is unchanged.
+
+        The LR item sets skip empty productions.  That is enough to check
+        the grammar for conflicts, but the parse table then rejects text
+        where an optional phrase is absent.  After this rewrite, the parse
+        table accepts the language, and can drive a parser.
+
+        The rewrite:
+          - Replaces each production by its variants omitting any subset of
+            its nullable symbols, except the empty variant.
+          - Replaces a nonterminal whose only alternative is another
+            nonterminal by that nonterminal.
+          - Makes repetitions left-recursive, rewriting A -> alpha A | alpha
+            to A -> A alpha | alpha.  Then a list can end without the parser
+            looking past its separator, as with a trailing comma.
+          - Merges repetitions of the same phrase.  Otherwise a shared
+            prefix, like the attributes of declarations, has a reduce/reduce
+            conflict.
+        """
+        assert self.is_canonical
+
+        def options(rule):
+            return rule.as_container() if isinstance(rule, Choice) else [rule]
+
+        def rename(replacement):
+            for name, rule in list(self.rules.items()):
+                if rule.is_terminal():
+                    continue
+                changed = False
+                new_options = []
+                for option in options(rule):
+                    parts = []
+                    for x in option.as_container():
+                        if x.is_symbol_name() and x.content in replacement:
+                            x = self.MakeSymbolName(replacement[x.content])
+                            changed = True
+                        parts.append(x)
+                    new_options.append(parts[0] if len(parts) == 1 else self.MakeSeq(parts))
+                if changed:
+                    self.rules[name] = self.MakeChoice(new_options)
+            for name in replacement:
+                del self.rules[name]
+
+        nullable = self.nullable()
+        only_empty = set([name for name, rule in self.rules.items()
+                          if all([x.is_empty() for x in options(rule)])])
+        for name, rule in list(self.rules.items()):
+            if rule.is_terminal():
+                continue
+            new_options = []
+            for option in options(rule):
+                if option.is_empty():
+                    continue
+                # The choices for each symbol: keep it, or omit it.
+                choices = []
+                for x in option.as_container():
+                    if x.is_symbol_name() and x.content in only_empty:
+                        choices.append([None])
+                    elif x.is_symbol_name() and x.content in nullable:
+                        choices.append([x, None])
+                    else:
+                        choices.append([x])
+                for variant in itertools.product(*choices):
+                    parts = [x for x in variant if x is not None]
+                    if len(parts) > 0:
+                        new_option = parts[0] if len(parts) == 1 else self.MakeSeq(parts)
+                        if new_option not in new_options:
+                            new_options.append(new_option)
+            self.rules[name] = self.MakeChoice(new_options)
+        for name in only_empty:
+            del self.rules[name]
+
+        # Inline nonterminals that only rename another.
+        replacement = dict()
+        for name, rule in self.rules.items():
+            if name not in (LANGUAGE, self.start_symbol) and not rule.is_terminal():
+                rule_options = options(rule)
+                if len(rule_options) == 1 and rule_options[0].is_symbol_name():
+                    replacement[name] = rule_options[0].content
+        for name in replacement:
+            while replacement[name] in replacement:
+                replacement[name] = replacement[replacement[name]]
+        rename(replacement)
+
+        for name, rule in self.rules.items():
+            rule_options = options(rule)
+            if rule.is_terminal() or len(rule_options) != 2:
+                continue
+            for (recursive, base) in (rule_options, reversed(rule_options)):
+                phrase = recursive.as_container()
+                if phrase[-1].is_symbol_name() and phrase[-1].content == name and \
+                        list(phrase[:-1]) == list(base.as_container()):
+                    self.rules[name] = self.MakeChoice([self.MakeSeq([phrase[-1]] + list(phrase[:-1])), base])
+                    break
+
+        # Merge rules with the same alternatives, up to their own name.
+        while True:
+            representative = dict()
+            replacement = dict()
+            for name in sorted(self.rules.keys()):
+                rule = self.rules[name]
+                if name in (LANGUAGE, self.start_symbol) or rule.is_terminal():
+                    continue
+                key = tuple(sorted([tuple(["" if x.is_symbol_name() and x.content == name else str(x)
+                                           for x in option.as_container()])
+                                    for option in options(rule)]))
+                if key in representative:
+                    replacement[name] = representative[key]
+                else:
+                    representative[key] = name
+            if len(replacement) == 0:
+                break
+            rename(replacement)
+
+        self.reset_first_follow()
+        self.compute_first()
+        self.compute_follow()
+
     def dedup_rhs(self,inline_stop=set(),verbose=False):
         """
         If two nonterminals have the same right hand side, combine them.
@@ -2827,65 +3913,270 @@ class Grammar:
             else:
                 table[action_key] = action
 
+        ir = self.lower()
         for lhs, rule in self.rules.items():
             if rule.is_container():
                 # Top-level rules are Choice nodes.
                 if not isinstance(rule,Choice):
                     raise RuntimeError("expected Choice node for "+
                        +"'{}' rule, got: {}".format(lhs,rule))
+                n = ir.nonterminal_id[lhs]
                 # For each rule A -> alpha,
-                for rhs in rule:
-                    for x in first(self,rhs.as_container()):
-                        if x.is_empty():
-                            # Add A -> alpha to M[A,b] for each terminal
-                            # b in Follow(A)
-                            for f in rule.follow:
-                                add(lhs,f,LLReduce(lhs,rhs))
-                        else:
-                            # For each terminal x in First(alpha), add
-                            # A -> alpha to M[A,x]
-                            add(lhs,x,LLReduce(lhs,rhs))
+                for rhs in ir.alternative_rules[n]:
+                    (bits, derives_empty) = ir.suffix_first(rhs)
+                    if derives_empty:
+                        # Add A -> alpha to M[A,b] for each terminal
+                        # b in Follow(A)
+                        for f in bit_indices(ir.follow[n]):
+                            add(lhs,ir.terminals[f],LLReduce(lhs,rhs))
+                    # For each terminal x in First(alpha), add
+                    # A -> alpha to M[A,x]
+                    for x in bit_indices(bits):
+                        add(lhs,ir.terminals[x],LLReduce(lhs,rhs))
         return (table,conflicts)
 
-    def LR1_ItemSets(self):
+    def LR1_ItemSets(self, workers=None):
         """
         Constructs the LR(1) sets of items.
 
         Args:
             self: Grammar in canonical form, with computed First
                 and Follow sets.
+            workers: None, or the number of worker processes used to close
+                the states discovered in each round.  The result does not
+                depend on the number of workers.
 
-        Returns: a list of the LR1(1) item-sets for the grammar.
+        Returns: a list of the LR1(1) item-sets for the grammar, ordered by
+            core index, and then by order of discovery.
         """
+        # This runs over the GrammarIR.  A state is given by its kernel, a
+        # tuple of pairs (item, lookahead bits), and is identified by the
+        # frozenset of those pairs.
+        #
+        # Each round closes the states discovered in the previous round, and
+        # then follows their transitions, in order of discovery.  That order
+        # only depends on the grammar, so the core numbering is deterministic.
+        ir = self.lower()
+
+        # Register the cores in the same order as for the LALR(1) item sets,
+        # so a state has the same core index in both.
+        self.lr0_states()
+
+        executor = None
+        if (workers is not None) and (workers > 1):
+            ir.lower_all()
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                              initializer=init_worker,
+                                                              initargs=(ir,))
+        def expand_all(kernels):
+            if executor is None:
+                return [ir.lr1_expand(kernel) for kernel in kernels]
+            chunksize = 1 + len(kernels) // (4 * workers)
+            return list(executor.map(worker_lr1_expand, kernels, chunksize=chunksize))
+
+        def lookahead(bits):
+            return self.interned_lookahead(ir.registry_bits(bits))
+        def make_item_set(kernel):
+            # Creating the ItemSet registers its core.
+            return ItemSet(self, [(ir.item_object(item), lookahead(bits)) for item, bits in kernel])
 
         # The root item is the one representing the entire language.
-        # Since the grammar is in canonical form, it's a Choice over a
-        # single sequence.
-        root_item = self.MakeItem(LANGUAGE, self.rules[LANGUAGE][0],0)
-
-        # An ItemSet can be found by any of the items in its core.
-        # Within an ItemSet, an item maps to its lookahead set.
-
-        root_item_set = ItemSet(self, {root_item: LookaheadSet({self.end_of_text})}).close(self)
-
-        LR1_item_sets_result = set({root_item_set})
+        root_kernel = ((ir.root_item(), 1 << ir.end_of_text_id),)
+        seen = set([frozenset(root_kernel)])
+        frontier = [(root_kernel, make_item_set(root_kernel))]
+        LR1_item_sets_result = []
+        try:
+            while len(frontier) > 0:
+                expansions = expand_all([kernel for kernel, _ in frontier])
+                next_frontier = []
+                for (kernel, item_set), (closure, goto) in zip(frontier, expansions):
+                    for item, bits in closure[len(kernel):]:
+                        item_set.internal_add(ir.item_object(item), lookahead(bits))
+                    item_set.is_closed = True
+                    LR1_item_sets_result.append(item_set)
+                    for _, next_kernel in goto:
+                        key = frozenset(next_kernel)
+                        if key not in seen:
+                            seen.add(key)
+                            next_frontier.append((next_kernel, make_item_set(next_kernel)))
+                frontier = next_frontier
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # The sort is stable, so preserves discovery order within a core.
+        LR1_item_sets_result.sort(key=lambda item_set: item_set.core_index)
+        return LR1_item_sets_result
+
+    def MinimalLR1(self):
+        """
+        Constructs a minimal LR(1) parser table, in the manner of Pager's
+        practical general method.
+
+        States are built as for canonical LR(1), but a new state is merged
+        into an existing state with the same core when the two are weakly
+        compatible.  For an LR(1) grammar, weak compatibility guarantees the
+        merge can not make a reduce-reduce conflict, so the table has no
+        conflicts.  Most cores are not split, so there are about as many
+        states as for LALR(1).
+
+        For a grammar that is not LR(1), merging can still make conflicts
+        that the canonical LR(1) states do not have.  So when the table has
+        conflicts, they are checked against the canonical LR(1) states, and
+        those only made by merging are listed in StateSplits.merge_conflicts.
+        The other conflicts are genuine LR(1) conflicts.
+
+        A state keeps the core index of its LALR(1) item set.  When a core
+        is split, each state after the first for that core gets a new index,
+        after those of all the cores.
 
-        dirty_set = LR1_item_sets_result.copy()
-        while len(dirty_set) > 0:
-            work_list = dirty_set.copy()
-            dirty_set = set()
-            # Sort the work list so we get deterministic ordering, and therefore
-            # deterministic itemset core numbering.
-            for item_set in sorted(work_list):
-                (_,gotos) = item_set.gotos(self)
-                for (X, dest_item_set) in gotos:
-                    if dest_item_set not in LR1_item_sets_result:
-                        LR1_item_sets_result.add(dest_item_set)
-                        dirty_set.add(dest_item_set)
+        Args:
+            self: Grammar in canonical form, with computed First
+                and Follow sets.
 
-        return sorted(LR1_item_sets_result,key=ItemSet.pretty_key)
+        Returns: a pair (ParseTable, StateSplits)
+        """
+        # This runs over the GrammarIR.  A state is given by its core, a
+        # sorted tuple of kernel items, and the list of their lookahead bits.
+        ir = self.lower()
+
+        # Register the cores in the same order as for the LALR(1) item sets,
+        # so a state has the same core index in both.
+        self.lr0_states()
+
+        core_of_state = []
+        bits_of_state = []
+        # Maps a state to a dictionary mapping a symbol to the next state.
+        goto_of_state = []
+        # Maps a core to the list of its states, in order of creation.
+        states_of_core = dict()
+        work_list = deque()
+        queued = set()
+
+        def enqueue(state):
+            if state not in queued:
+                queued.add(state)
+                work_list.append(state)
+
+        def weakly_compatible(L, M):
+            # Merging is safe unless some pair of items gets a lookahead in
+            # common from the merge, but had none in either state.
+            for i in range(len(L)):
+                for j in range(i+1, len(L)):
+                    if ((L[i] & M[j]) | (L[j] & M[i])) and not (L[i] & L[j]) and not (M[i] & M[j]):
+                        return False
+            return True
 
-    def LALR1(self, max_item_sets=None):
+        def find_or_add(kernel):
+            # Returns the state for the kernel: a compatible state with the
+            # same core, which absorbs the kernel's lookaheads, or a new one.
+            bits_of_item = dict(kernel)
+            core = tuple(sorted(bits_of_item))
+            L = [bits_of_item[item] for item in core]
+            states = states_of_core.setdefault(core,[])
+            for state in states:
+                M = bits_of_state[state]
+                if weakly_compatible(L, M):
+                    merged = [l | m for l, m in zip(L, M)]
+                    if merged != M:
+                        bits_of_state[state] = merged
+                        enqueue(state)
+                    return state
+            state = len(core_of_state)
+            core_of_state.append(core)
+            bits_of_state.append(L)
+            goto_of_state.append(dict())
+            states.append(state)
+            enqueue(state)
+            return state
+
+        def expand(state):
+            return ir.lr1_expand(tuple(zip(core_of_state[state], bits_of_state[state])))
+
+        root = find_or_add(((ir.root_item(), 1 << ir.end_of_text_id),))
+        while len(work_list) > 0:
+            state = work_list.popleft()
+            queued.remove(state)
+            (_, goto) = expand(state)
+            goto_of_state[state] = dict([(x, find_or_add(next_kernel)) for x, next_kernel in goto])
+
+        # Merging can redirect a transition to another state, leaving
+        # lookaheads behind that no longer flow into a state, and states that
+        # are no longer reachable.  Recompute the lookaheads of the reachable
+        # states from scratch, along the final transitions.
+        reachable = [root]
+        visited = set(reachable)
+        for state in reachable:
+            for next_state in goto_of_state[state].values():
+                if next_state not in visited:
+                    visited.add(next_state)
+                    reachable.append(next_state)
+        for state in reachable:
+            bits_of_state[state] = [0] * len(core_of_state[state])
+        bits_of_state[root] = [1 << ir.end_of_text_id]
+        enqueue(root)
+        while len(work_list) > 0:
+            state = work_list.popleft()
+            queued.remove(state)
+            (_, goto) = expand(state)
+            for x, next_kernel in goto:
+                next_state = goto_of_state[state][x]
+                next_bits = bits_of_state[next_state]
+                bits_of_item = dict(next_kernel)
+                merged = [b | bits_of_item[item] for item, b in zip(core_of_state[next_state], next_bits)]
+                if merged != next_bits:
+                    bits_of_state[next_state] = merged
+                    enqueue(next_state)
+
+        # Make the ItemSets.  The first state of a core gets its core index.
+        def lookahead(bits):
+            return self.interned_lookahead(ir.registry_bits(bits))
+        item_set_of_state = dict()
+        # Maps a core to the ItemSets of its reachable states.
+        item_sets_of_core = dict()
+        for state in sorted(reachable):
+            core = core_of_state[state]
+            item_set = ItemSet(self, [(ir.item_object(item), lookahead(bits))
+                                      for item, bits in zip(core, bits_of_state[state])])
+            copies = item_sets_of_core.setdefault(core,[])
+            if len(copies) > 0:
+                item_set.core_index = self.register_item_set(item_set, len(copies))
+            copies.append(item_set)
+            item_set_of_state[state] = item_set
+        for state, item_set in item_set_of_state.items():
+            (closure, goto) = expand(state)
+            for item, bits in closure[len(core_of_state[state]):]:
+                item_set.internal_add(ir.item_object(item), lookahead(bits))
+            item_set.is_closed = True
+            item_set.goto = dict()
+            for x, next_kernel in goto:
+                X = ir.item_object(next_kernel[0][0]-1).next()
+                edge = ItemSet.GotoEdge(X)
+                for item, bits in next_kernel:
+                    edge.add(ir.item_object(item-1), ir.item_object(item), lookahead(bits))
+                edge.next_item_set_cache = item_set_of_state[goto_of_state[state][x]]
+                item_set.goto[X.reg_info.index] = edge
+
+        by_index = dict([(item_set.core_index, item_set) for item_set in item_set_of_state.values()])
+        parse_table = self.make_parse_table(by_index)
+
+        merge_conflicts = []
+        if parse_table.has_conflicts():
+            lr1_conflicts = ir.lr1_conflicts()
+            core_of_item_set = dict([(id(item_set), core_of_state[state])
+                                     for state, item_set in item_set_of_state.items()])
+            for conflict in parse_table.conflicts:
+                t = ir.terminal_id[conflict.terminal.reg_info.index]
+                if (core_of_item_set[id(conflict.item_set)], t) not in lr1_conflicts:
+                    merge_conflicts.append(conflict)
+
+        splits = StateSplits(len(item_sets_of_core), len(by_index),
+                             dict([(copies[0].core_index, len(copies))
+                                   for copies in item_sets_of_core.values() if len(copies) > 1]),
+                             merge_conflicts)
+        return (parse_table, splits)
+
+    def LALR1(self, max_item_sets=None, engine=LALR1_ENGINE_SWEEP, cache_dir=None):
         """
         Constructs an LALR(1) parser table.
 
@@ -2895,15 +4186,130 @@ class Grammar:
             max_item_sets:
                 An artificial limit on the number of item set cores created.
                 May terminate the algorithm before it has computed the full answer.
+            engine: The method used to compute the LALR(1) item sets.
+                One of LALR1_ENGINES.  All engines produce the same result.
+            cache_dir: None, or the path of a directory caching parse tables.
+                When set, and max_item_sets is None, load the table from the
+                cache if present there, and otherwise save it there.
+                See parse_table_cache_key.
+
+        Returns: a ParseTable
+        """
+
+        cache_path = None
+        if (cache_dir is not None) and (max_item_sets is None):
+            cache_path = os.path.join(cache_dir, "{}.json".format(self.parse_table_cache_key()))
+            parse_table = self.read_parse_table(cache_path)
+            if parse_table is not None:
+                return parse_table
 
-        Returns: a tuple:
-            - a list of the LALR1(1) item-sets for the grammar.
-            - an action table, mapping (item_set, terminal) to an Action
-            - an array of Reduction objects, where the ith has index i
-            - a list of conflicts
+        by_index = self.lalr1_item_sets(engine, max_item_sets=max_item_sets)
+        parse_table = self.make_parse_table(by_index)
+        if cache_path is not None:
+            self.write_parse_table(parse_table, cache_path)
+        return parse_table
+
+    def LALR1_conflict_report(self, max_conflicts=1, max_item_sets=None, engine=LALR1_ENGINE_SWEEP, cache_dir=None):
         """
+        Returns the first conflicts of the LALR(1) parser table.
+
+        This does not fail fast: the item sets and their lookaheads are
+        computed in full, as for LALR1, since the engines only settle
+        lookaheads at the end.  Only making the action table is cut short:
+        just the item sets with a reduction are examined, since shifts alone
+        never conflict, and that stops at the first max_conflicts conflicts.
 
-        # Part 1. Compute LALR(1) item sets
+        Args:
+            max_conflicts: The number of conflicts at which to stop.
+            max_item_sets, engine: As for LALR1.
+            cache_dir: None, or the path of a directory caching parse tables.
+                When it has the table, report its conflicts instead.
+                The cache is not written.
+
+        Returns: a list of at most max_conflicts Conflicts, in order of the
+            core index of their item sets.  It is empty when the table has
+            no conflicts.
+        """
+        if (cache_dir is not None) and (max_item_sets is None):
+            cache_path = os.path.join(cache_dir, "{}.json".format(self.parse_table_cache_key()))
+            parse_table = self.read_parse_table(cache_path)
+            if parse_table is not None:
+                return parse_table.conflicts[:max_conflicts]
+        by_index = self.lalr1_item_sets(engine, max_item_sets=max_item_sets)
+        return self.make_parse_table(by_index, max_conflicts=max_conflicts).conflicts[:max_conflicts]
+
+    def lalr1_item_sets(self, engine, max_item_sets=None):
+        """
+        Returns a dictionary mapping a core index to its closed LALR(1) ItemSet,
+        computed with the given engine.  See LALR1.
+        """
+        if engine == LALR1_ENGINE_SWEEP:
+            return self.lalr1_sweep(max_item_sets=max_item_sets)
+        if engine == LALR1_ENGINE_WORKLIST:
+            return self.lalr1_worklist(max_item_sets=max_item_sets)
+        if engine == LALR1_ENGINE_PROPAGATE:
+            return self.lalr1_propagate(max_item_sets=max_item_sets)
+        if engine == LALR1_ENGINE_DEREMER_PENNELLO:
+            return self.lalr1_deremer_pennello(max_item_sets=max_item_sets)
+        raise RuntimeError("unknown LALR(1) engine: {}".format(engine))
+
+    def parse_table_cache_key(self):
+        """
+        Returns a hex digest naming this grammar's LALR(1) ParseTable in a cache.
+
+        It covers the rules the table is built from, as they are now, the
+        start symbol, the ignored rule, and the analyzer's source code.  So
+        the same JSON text, transformed differently, as by eliminate_empty or
+        lalr.py -recursive, gets a different key.  All LALR1 engines compute
+        the same table, so the engine is not part of the key.
+        """
+        h = hashlib.sha256()
+        parts = [analyzer_digest(), self.start_symbol, self.ignore]
+        for name, rule in self.rules.items():
+            parts.append("{}:{}".format(name, str(rule)))
+        for part in parts:
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def read_parse_table(self, path):
+        """
+        Returns the ParseTable saved at the given path by write_parse_table,
+        or None if it does not exist or cannot be loaded into this grammar.
+        """
+        if not os.path.exists(path) or len(self.item_set_core_index) > 0:
+            return None
+        try:
+            with open(path) as infile:
+                return ParseTable.from_json_dict(self, json.load(infile))
+        except (RuntimeError, KeyError, IndexError, TypeError, ValueError) as e:
+            print("ignoring cached parse table {}: {}".format(path, e), file=sys.stderr)
+            # Forget any item sets made while loading, so core indices
+            # computed from scratch start at 0 again.
+            self.item_set_core_index = dict()
+            return None
+
+    def write_parse_table(self, parse_table, path):
+        """
+        Saves a ParseTable to the given path, creating directories as needed.
+        Writes to a temporary file first, so readers never see a partial table.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path,'w') as outfile:
+            json.dump(parse_table.to_json_dict(), outfile, separators=(',',':'))
+        os.replace(temp_path, path)
+
+    def lalr1_sweep(self, max_item_sets=None):
+        """
+        Computes the LALR(1) item sets by repeatedly sweeping over all
+        known item sets, propagating lookaheads along goto edges,
+        until nothing changes.
+
+        Returns: a dictionary mapping a core index to its closed LALR(1) ItemSet.
+        """
 
         # Mapping from a core index to an already-discovered item set.
         by_index = dict()
@@ -2943,10 +4349,362 @@ class Grammar:
                         dirty_set.add(item_set_for_X.core_index)
                         keep_going = True
 
-        # Now this is a list of item_sets
-        sorted_item_set_core_ids = sorted(item_set_core_ids)
+        return by_index
+
+    def lalr1_worklist(self, max_item_sets=None):
+        """
+        Computes the LALR(1) item sets like lalr1_sweep, but each round only
+        revisits the item sets that were created or whose lookaheads grew in
+        the previous round.  The work done is proportional to the number
+        of changes, rather than to the number of rounds times the number of
+        item sets.
+
+        Each round visits its item sets in decreasing core index order, just
+        like lalr1_sweep.  Item sets are only discovered by visiting newly
+        created item sets, so the core numbering is the same.
+
+        Returns: a dictionary mapping a core index to its closed LALR(1) ItemSet.
+        """
+        by_index = dict()
+
+        root_item = self.MakeItem(LANGUAGE, self.rules[LANGUAGE][0],0)
+        root_item_set = ItemSet(self, {root_item: LookaheadSet({self.end_of_text})}).close(self)
+        by_index[root_item_set.core_index] = root_item_set
+
+        dirty_set = set({root_item_set.core_index})
+        while len(dirty_set) > 0:
+            if max_item_sets is not None:
+                if len(by_index) > max_item_sets:
+                    break
+            work_list = sorted(dirty_set, reverse=True)
+            dirty_set = set()
+            for core_index in work_list:
+                (_,gotos) = by_index[core_index].gotos(self,by_index_memo=by_index,changed_item_sets=dirty_set)
+                for (X, item_set_for_X) in gotos:
+                    if item_set_for_X.core_index not in by_index:
+                        by_index[item_set_for_X.core_index] = item_set_for_X
+
+        return by_index
+
+    def lr0_item_sets(self, max_item_sets=None):
+        """
+        Computes the LR(0) item sets, i.e. the LALR(1) item set cores, with
+        empty lookaheads.
+
+        Item sets are discovered in the same order as lalr1_sweep discovers
+        them, so they get the same core indices: Each round expands the item
+        sets discovered in the previous round, in decreasing core index order.
+
+        Returns: a dictionary mapping a core index to its closed ItemSet.
+        """
+        return self.lr0_automaton(max_item_sets=max_item_sets)[0]
+
+    def lr0_states(self, max_item_sets=None):
+        """
+        Computes the LR(0) states over the GrammarIR, and registers their
+        cores, in the order lr0_item_sets discovers them, but without making
+        ItemSets.  So a canonical or minimal LR(1) construction calls it to
+        give its states the core indices of the LALR(1) item sets.
+
+        Item sets are discovered in the same order as lalr1_sweep discovers
+        them: Each round expands the item sets discovered in the previous
+        round, in decreasing core index order.
 
-        # Part 2. Compute the action table and conflicts.
+        Args:
+            max_item_sets: as for lr0_item_sets
+
+        Returns: a dictionary mapping a core index to a triple
+            (kernel, closure, goto) in order of discovery, where:
+                kernel: the tuple of kernel items
+                closure: the list of items in the closure, starting with the kernel
+                goto: None when exploration was cut short by max_item_sets, or
+                    a dictionary mapping a symbol to the core index of the next
+                    state, in order of the symbol's first appearance after a
+                    dot in the closure
+            Items and symbols are those of the GrammarIR.
+        """
+        ir = self.lower()
+        states = dict()
+        # Maps a kernel, as a frozenset of items, to its core index.
+        core_of_kernel = dict()
+
+        def find_or_add(kernel):
+            # Returns a pair (created, core_index)
+            key = frozenset(kernel)
+            if key in core_of_kernel:
+                return (False, core_of_kernel[key])
+            core_index = self.register_core(frozenset([ir.item_object(item) for item in kernel]))
+            core_of_kernel[key] = core_index
+            states[core_index] = (kernel, ir.closure(kernel), None)
+            return (True, core_index)
+
+        frontier = [find_or_add((ir.root_item(),))[1]]
+        while len(frontier) > 0:
+            if max_item_sets is not None:
+                if len(states) > max_item_sets:
+                    break
+            work_list = sorted(frontier, reverse=True)
+            frontier = []
+            for core_index in work_list:
+                (kernel, closure, _) = states[core_index]
+                goto = dict()
+                for x, items in self.lr0_sources(closure).items():
+                    (created, goto[x]) = find_or_add(tuple([item+1 for item in items]))
+                    if created:
+                        frontier.append(goto[x])
+                states[core_index] = (kernel, closure, goto)
+        return states
+
+    def lr0_sources(self, closure):
+        """
+        Partitions the items of a closure over the GrammarIR according to the
+        next symbol to be consumed.  There is no transition over EndOfText.
+
+        Returns: a dictionary mapping a symbol to the list of items with the
+            symbol after the dot, in order of the symbol's first appearance
+        """
+        ir = self.lower()
+        sources = dict()
+        for item in closure:
+            x = ir.item_symbol[item]
+            if x >= 0 and x != ir.end_of_text_id:
+                sources.setdefault(x,[]).append(item)
+        return sources
+
+    def lr0_automaton(self, max_item_sets=None):
+        """
+        Computes the LR(0) item sets over the GrammarIR, as for lr0_item_sets,
+        making an ItemSet with GotoEdges for each state of lr0_states.
+
+        Args:
+            max_item_sets: as for lr0_item_sets
+
+        Returns: a pair (by_index, states) where
+            by_index is a dictionary mapping a core index to its closed ItemSet,
+                with empty lookaheads
+            states is the result of lr0_states
+        """
+        ir = self.lower()
+        states = self.lr0_states(max_item_sets=max_item_sets)
+        empty = self.interned_lookahead(0)
+        by_index = dict()
+        for core_index, (kernel, closure, _) in states.items():
+            item_set = ItemSet(self, {ir.item_object(item): empty for item in kernel})
+            for item in closure[len(kernel):]:
+                item_set.internal_add(ir.item_object(item), empty)
+            item_set.is_closed = True
+            by_index[core_index] = item_set
+        for core_index, (kernel, closure, goto) in states.items():
+            if goto is None:
+                continue
+            item_set = by_index[core_index]
+            item_set.goto = dict()
+            for x, items in self.lr0_sources(closure).items():
+                X = ir.item_object(items[0]).next()
+                edge = ItemSet.GotoEdge(X)
+                for item in items:
+                    edge.add(ir.item_object(item), ir.item_object(item+1), empty)
+                edge.next_item_set_cache = by_index[goto[x]]
+                item_set.goto[X.reg_info.index] = edge
+        return (by_index, states)
+
+    def lalr1_propagate(self, max_item_sets=None):
+        """
+        Computes the LALR(1) item sets by the efficient construction in the
+        Dragon Book, 1st ed., Algorithm 4.13:
+
+        1. Build the LR(0) item sets.
+        2. For each kernel item K in item set I, close [K, #] once, where '#' is
+           a dummy lookahead.  For each resulting item [B -> gamma . X delta, a]:
+           - when a is not '#', then a is generated spontaneously for kernel
+             item [B -> gamma X . delta] in goto(I,X)
+           - when a is '#', lookaheads propagate from K in I to kernel item
+             [B -> gamma X . delta] in goto(I,X)
+        3. Propagate lookaheads over that fixed graph of kernel items until
+           settling.
+        4. Compute the lookaheads of non-kernel items from their kernel items.
+
+        Returns: a dictionary mapping a core index to its closed LALR(1) ItemSet.
+
+        This runs over the GrammarIR, with lookaheads as bitmasks over terminal ids.
+        """
+        ir = self.lower()
+        (by_index, states) = self.lr0_automaton(max_item_sets=max_item_sets)
+
+        # Closures are independent of the item set, so compute each one once.
+        closures = dict()
+        def closure(kernel_item):
+            if kernel_item not in closures:
+                closures[kernel_item] = ir.lookahead_closure(kernel_item)
+            return closures[kernel_item]
+
+        # A kernel item in an item set is the pair (core index, item).
+        # Maps it to its lookahead bits.
+        lookahead = defaultdict(int)
+        # Maps it to the list of kernel items its lookahead propagates to.
+        propagates_to = defaultdict(list)
+
+        root_index = self.item_set_core_index[frozenset({ir.item_object(ir.root_item())})]
+        lookahead[(root_index,ir.root_item())] = 1 << ir.end_of_text_id
+
+        for core_index, (kernel, _, goto) in states.items():
+            if goto is None:
+                # Exploration was cut short by max_item_sets
+                continue
+            for kernel_item in kernel:
+                source = (core_index,kernel_item)
+                for item, (spontaneous, propagated) in closure(kernel_item).items():
+                    x = ir.item_symbol[item]
+                    if x not in goto:
+                        # The dot is at the end, or there is no transition over EndOfText
+                        continue
+                    dest = (goto[x], item+1)
+                    lookahead[dest] = lookahead[dest] | spontaneous
+                    if propagated:
+                        propagates_to[source].append(dest)
+
+        dirty = list(lookahead.keys())
+        while len(dirty) > 0:
+            work_list = dirty
+            dirty = []
+            for source in work_list:
+                bits = lookahead[source]
+                for dest in propagates_to[source]:
+                    if bits & ~lookahead[dest]:
+                        lookahead[dest] = lookahead[dest] | bits
+                        dirty.append(dest)
+
+        for core_index, (kernel, _, _) in states.items():
+            bits_for = defaultdict(int)
+            for kernel_item in kernel:
+                kernel_bits = lookahead[(core_index,kernel_item)]
+                for item, (spontaneous, propagated) in closure(kernel_item).items():
+                    bits_for[item] = bits_for[item] | spontaneous | (kernel_bits if propagated else 0)
+            item_set = by_index[core_index]
+            for item, bits in bits_for.items():
+                item_set.merge_lookahead(ir.item_object(item).reg_info.index, ir.registry_bits(bits))
+        return by_index
+
+    def lalr1_deremer_pennello(self, max_item_sets=None):
+        """
+        Computes the LALR(1) item sets by first building the LR(0) item sets,
+        and then computing lookaheads in a single pass, using the method of
+        DeRemer and Pennello, "Efficient Computation of LALR(1) Look-Ahead Sets",
+        TOPLAS 1982.
+
+        For each nonterminal transition (p,A), i.e. from state p on nonterminal A:
+
+            Follow(p,A) is the set of terminals that can follow A in state p.
+
+            DR(p,A) is the set of terminals appearing after the dot in goto(p,A).
+
+            (p,A) reads (r,C) when r = goto(p,A) has a transition on C, and C
+                derives the empty string.
+
+            (p,A) includes (p',B) when B -> beta A gamma is a production,
+                gamma derives the empty string, and p' reaches p by
+                following the symbols of beta.
+
+        Then:
+            Read = digraph(reads, DR)
+            Follow = digraph(includes, Read)
+
+        Finally, the lookahead of an item [B -> alpha . beta] in state q is the
+        union of Follow(p',B) over the states p' that reach q by following alpha.
+        That generalizes DeRemer and Pennello's 'lookback' relation to all items,
+        not just reductions, because we also print the lookaheads of every item.
+
+        Returns: a dictionary mapping a core index to its closed LALR(1) ItemSet.
+        """
+        by_index = self.lr0_item_sets(max_item_sets=max_item_sets)
+
+        nullable_names = self.nullable()
+        def nullable(X):
+            return X.content in nullable_names
+
+        def goto_state(item_set,X):
+            if item_set.goto is None:
+                # Exploration was cut short by max_item_sets
+                return None
+            edge = item_set.goto.get(X.reg_info.index,None)
+            return None if edge is None else edge.next_item_set_cache
+
+        # A nonterminal transition is a pair (core index, nonterminal reg index).
+        # The augmented start item is represented by ROOT, which is followed by
+        # the end of text.
+        # Terminal sets are LookaheadSet bitmasks.
+        ROOT = None
+        transitions = [ROOT]
+        DR = { ROOT: END_OF_TEXT_BIT }
+        reads = dict()
+        for core_index, item_set in by_index.items():
+            for xid, edge in (item_set.goto or dict()).items():
+                if not edge.x.is_symbol_name():
+                    continue
+                t = (core_index, xid)
+                transitions.append(t)
+                r = edge.next_item_set_cache
+                bits = 0
+                for i in r.id_to_item.values():
+                    if not i.at_end() and i.next().is_terminal():
+                        bits = bits | (1 << i.next().reg_info.index)
+                DR[t] = bits
+                reads[t] = [(r.core_index, cid) for cid, c_edge in (r.goto or dict()).items()
+                            if c_edge.x.is_symbol_name() and nullable(c_edge.x)]
+        Read = digraph(transitions, reads, DR)
+
+        # Follow the symbols of each production, starting at each nonterminal
+        # transition, to find the 'includes' relation and the sources of each
+        # item's lookahead.
+        includes = defaultdict(list)
+        # Maps (core index, item reg index) to the transitions whose Follow
+        # set flows into that item's lookahead.
+        sources = defaultdict(list)
+        def trace(item_set,item,source):
+            while item_set is not None:
+                sources[(item_set.core_index,item.reg_info.index)].append(source)
+                if item.at_end():
+                    break
+                X = item.next()
+                if X.is_symbol_name() and item.rest_derives_empty:
+                    includes[(item_set.core_index,X.reg_info.index)].append(source)
+                item_set = goto_state(item_set,X)
+                item = self.MakeItem(item.lhs,item.rule,item.position+1)
+
+        root_item = self.MakeItem(LANGUAGE, self.rules[LANGUAGE][0],0)
+        root_item_set = by_index[self.item_set_core_index[frozenset({root_item})]]
+        trace(root_item_set,root_item,ROOT)
+        for t in transitions[1:]:
+            (core_index, xid) = t
+            item_set = by_index[core_index]
+            for item in item_set.id_to_item.values():
+                if item.position == 0 and item.lhs.reg_info.index == xid:
+                    trace(item_set,item,t)
+        Follow = digraph(transitions, includes, Read)
+
+        for (core_index, item_id), item_sources in sources.items():
+            bits = 0
+            for source in item_sources:
+                bits = bits | Follow[source]
+            by_index[core_index].merge_lookahead(item_id, bits)
+        return by_index
+
+    def make_parse_table(self, by_index, max_conflicts=None):
+        """
+        Computes the action and goto tables from closed LALR(1) item sets.
+
+        Args:
+            by_index: a dictionary mapping a core index to its closed LALR(1) ItemSet
+            max_conflicts: None, or a number of conflicts at which to stop.
+                When set, item sets without a reduction are skipped, so the
+                table is incomplete, and only good for its conflicts.
+                See LALR1_conflict_report.
+
+        Returns: a ParseTable
+        """
+        sorted_item_set_core_ids = sorted(by_index)
+
+        # Compute the action table and conflicts.
         # Do this as a second pass because it's conceivable that an item set may
         # go from non-accepting to accepting during initial exploration
         # of the item sets.
@@ -2988,7 +4746,11 @@ class Grammar:
         nonterminal_goto = dict()
 
         for item_set_core_id in sorted_item_set_core_ids:
+            if max_conflicts is not None and len(conflicts) >= max_conflicts:
+                break
             item_set = by_index[item_set_core_id]
+            if max_conflicts is not None and not any([i.at_end() for i in item_set.id_to_item.values()]):
+                continue
             # Register Reduce and Accept actions
             for item_id, lookahead in item_set.id_to_lookahead.items():
                 item = item_set.id_to_item[item_id]
@@ -2999,6 +4761,9 @@ class Grammar:
                     for terminal in lookahead:
                         addAction(item_set, terminal, make_reduce(item))
 
+            if item_set.goto is None:
+                # Exploration was cut short by max_item_sets
+                continue
             # Register Shift actions
             for xid, edge in item_set.goto.items():
                 X = self.findByIndex(xid)
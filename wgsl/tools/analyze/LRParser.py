@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+#
+# Copyright 2022 Google LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of works must retain the original copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the original
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#
+# 3. Neither the name of the W3C nor the names of its contributors
+# may be used to endorse or promote products derived from this work
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A table-driven LR parser runtime, in pure Python.
+
+It runs the tables exported by CompactParseTable.py over a stream of
+terminal indices, or over text split into tokens by Tokenizer.py.
+It can build a parse tree, or only validate the input.  On a syntax error
+it reports the token position, the parser state, and the terminals the
+state expects.
+
+The parser works the same way on a CompactParseTable and on a
+CombParseTable, and on tables loaded from files.  Tables made by
+CompactParseTable.optimized skip chain reductions, so their parse trees
+omit those nodes, and their default reductions can reduce before a syntax
+error is detected.  Such a table reports the expected terminals of the
+state where the error was detected.
+"""
+
+from CompactParseTable import ACTION_ERROR, ACTION_SHIFT, ACTION_REDUCE, ACTION_ACCEPT, END_OF_TEXT, NO_STATE
+from Tokenizer import utf8_offsets
+
+
+class ParseError(RuntimeError):
+    """
+    A syntax error found by Parser.
+
+    Members:
+      .position:  The index of the failing token.  The end of text is at
+                  the index after the last token.  When parsing text,
+                  the byte offset of the token instead.
+      .state:     The parser state that has no action for the token.
+      .terminal:  The name of the failing terminal.
+      .expected:  The names of the terminals with an action in that state.
+    """
+    def __init__(self,position,state,terminal,expected,unit="token"):
+        self.position = position
+        self.state = state
+        self.terminal = terminal
+        self.expected = expected
+        super().__init__("syntax error at {} {} in state {}: {}, expected one of: {}".format(
+            unit, position, state, terminal, " ".join(expected)))
+
+
+class ParseTree:
+    """
+    A node of a parse tree.
+
+    Members:
+      .symbol:    The name of the terminal or nonterminal.
+      .children:  The list of child nodes.  Empty for a terminal.
+      .position:  For a terminal, the index of its token, or its byte offset
+                  when parsing text.  Otherwise None.
+    """
+    def __init__(self,symbol,children=None,position=None):
+        self.symbol = symbol
+        self.children = [] if children is None else children
+        self.position = position
+
+    def is_terminal(self):
+        return self.position is not None
+
+    def __str__(self):
+        if self.is_terminal():
+            return self.symbol
+        return "({})".format(" ".join([self.symbol] + [str(c) for c in self.children]))
+
+
+class Parser:
+    """
+    An LR parser driven by a compact parse table.
+
+    Members:
+      .table:     The CompactParseTable or CombParseTable.
+      .steps:     The number of shift and reduce steps taken by the most
+                  recent parse.
+      .valid:     Maps a state to the bitmask of its valid terminals.
+    """
+    def __init__(self,table):
+        self.table = table
+        self.end_of_text = table.terminal_index[END_OF_TEXT]
+        self.steps = 0
+        self.valid = [table.valid_terminals(s) for s in range(table.num_states)]
+
+    @staticmethod
+    def from_parse_table(parse_table):
+        """
+        Returns a parser for a Grammar.ParseTable.
+        """
+        return Parser(parse_table.compact())
+
+    def terminal_indices(self,names):
+        """
+        Returns the terminal indices for a sequence of terminal names,
+        e.g. "'fn'" or "/[0-9]+/".
+
+        Raises KeyError for an unknown name.
+        """
+        terminal_index = self.table.terminal_index
+        return [terminal_index[name] for name in names]
+
+    def expected(self,state):
+        """
+        Returns the names of the terminals with an action in a state.
+        """
+        table = self.table
+        return [t for i, t in enumerate(table.terminals)
+                if table.lookup_action(state,i) != ACTION_ERROR]
+
+    def can_shift(self,stack,terminal):
+        """
+        Returns True if the parser, with the given state stack, would shift
+        or accept the terminal after any reductions.  The stack is unchanged.
+        """
+        table = self.table
+        lookup_action = table.lookup_action
+        depth = len(stack)
+        # The states pushed by reductions, above stack[:depth].
+        pushed = []
+        while True:
+            word = lookup_action(pushed[-1] if pushed else stack[depth - 1], terminal)
+            kind = word & 3
+            if kind == ACTION_SHIFT or kind == ACTION_ACCEPT:
+                return True
+            if kind != ACTION_REDUCE:
+                return False
+            reduction = word >> 2
+            length = table.reduction_length[reduction]
+            popped = min(length, len(pushed))
+            del pushed[len(pushed) - popped:]
+            depth -= length - popped
+            next_state = table.lookup_goto(pushed[-1] if pushed else stack[depth - 1],
+                                           table.reduction_lhs[reduction])
+            if next_state == NO_STATE:
+                return False
+            pushed.append(next_state)
+
+    def parse(self,terminals,build_tree=False):
+        """
+        Parses a sequence of terminal indices, followed by end of text.
+
+        Returns the ParseTree of the start symbol when build_tree is true,
+        and None otherwise.
+
+        Raises ParseError on a syntax error.
+        """
+        terminals = list(terminals)
+        terminals.append(self.end_of_text)
+        positions = iter(range(len(terminals)))
+        def next_token(stack):
+            position = next(positions)
+            return (terminals[position], position)
+        return self.run(next_token, build_tree, "token")
+
+    def parse_text(self,tokenizer,text,build_tree=False):
+        """
+        Parses text, split into tokens by a Tokenizer for the table's terminals.
+
+        Tokenization is interleaved with parsing.  The tokenizer only tries
+        the valid terminals of the current state.  Where several tokens
+        match, the parser takes the longest one it can shift, or the first
+        if it can shift none.  Zero width tokens are taken wherever the
+        parser can shift them.  Positions are byte offsets into the UTF-8
+        encoding of the text.
+
+        Returns the ParseTree of the start symbol when build_tree is true,
+        and None otherwise.
+
+        Raises ParseError on a syntax error, and TokenizeError for text that
+        is not a token.
+        """
+        valid = self.valid
+        templates = tokenizer.template_lists(text)
+        offset = utf8_offsets(text)
+        zero_width = tokenizer.zero_width
+        # The position after the last token.
+        last = [0]
+        def next_token(stack):
+            mask = valid[stack[-1]]
+            for terminal in zero_width:
+                if (mask >> terminal) & 1 and self.can_shift(stack,terminal):
+                    return (terminal, offset(last[0]))
+            position = tokenizer.skip(text,last[0])
+            if position >= len(text):
+                last[0] = position
+                return (self.end_of_text, offset(position))
+            matches = tokenizer.candidates(text,position,templates,mask)
+            if not matches:
+                # Report the token the state does not expect.
+                matches = tokenizer.candidates(text,position,templates)
+            if not matches:
+                raise tokenizer.invalid_token(text,position)
+            (end, terminal) = matches[0]
+            if len(matches) > 1:
+                for (e, t) in matches:
+                    if self.can_shift(stack,t):
+                        (end, terminal) = (e, t)
+                        break
+            last[0] = end
+            return (terminal, offset(position))
+        return self.run(next_token, build_tree, "byte")
+
+    def run(self,next_token,build_tree,unit):
+        """
+        Runs the parser, calling next_token with the state stack for each
+        token, which returns the pair (terminal index, position).
+        """
+        table = self.table
+        lookup_action = table.lookup_action
+        lookup_goto = table.lookup_goto
+        reduction_lhs = table.reduction_lhs
+        reduction_length = table.reduction_length
+        stack = [0]
+        # The tree nodes for the symbols on the stack, after the start state.
+        nodes = []
+        steps = 0
+        (terminal, position) = next_token(stack)
+        while True:
+            state = stack[-1]
+            word = lookup_action(state, terminal)
+            # Inline action_kind and action_argument.
+            kind = word & 3
+            if kind == ACTION_SHIFT:
+                stack.append(word >> 2)
+                if build_tree:
+                    nodes.append(ParseTree(table.terminals[terminal], position=position))
+                (terminal, position) = next_token(stack)
+            elif kind == ACTION_REDUCE:
+                reduction = word >> 2
+                length = reduction_length[reduction]
+                lhs = reduction_lhs[reduction]
+                if length > 0:
+                    del stack[-length:]
+                next_state = lookup_goto(stack[-1], lhs)
+                if next_state == NO_STATE:
+                    raise RuntimeError("no goto from state {} over {}".format(
+                        stack[-1], table.nonterminals[lhs]))
+                stack.append(next_state)
+                if build_tree:
+                    children = nodes[len(nodes) - length:]
+                    del nodes[len(nodes) - length:]
+                    nodes.append(ParseTree(table.nonterminals[lhs], children))
+            elif kind == ACTION_ACCEPT:
+                self.steps = steps
+                return nodes[-1] if build_tree else None
+            else:
+                self.steps = steps
+                raise ParseError(position, state, table.terminals[terminal], self.expected(state), unit)
+            steps += 1
+
+    def validate(self,terminals):
+        """
+        Returns None when the sequence of terminal indices parses,
+        and the ParseError otherwise.
+        """
+        try:
+            self.parse(terminals)
+        except ParseError as e:
+            return e
+        return None
+
+    def validate_all(self,inputs):
+        """
+        Validates each sequence of terminal indices in inputs.
+        Returns a list with None for each input that parses, and the
+        ParseError for each input that does not.
+        """
+        return [self.validate(terminals) for terminals in inputs]
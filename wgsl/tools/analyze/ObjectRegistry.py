@@ -39,6 +39,8 @@ class RegistryInfo:
     """
     Info tracked for a registered object
     """
+    __slots__ = ('registry', 'obj', 'index')
+
     def __init__(self,registry,obj,index):
         # The ObjectRegistry managing this object
         self.registry = registry
@@ -64,10 +66,14 @@ class RegisterableObject:
      - keys must not change
 
     .class_id:
-     - an integer unique to self.__class__
+     - an integer unique to self.__class__, usually a class attribute
 
     It has a reg_info object.
+
+    Subclasses should declare __slots__ to avoid a per-instance __dict__.
     """
+    __slots__ = ('reg_info', 'key')
+
     def __init__(self,**kwargs):
         # assert 'key' in dir(self) #. This is surprisingly slow
         self.reg_info = None
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+#
+# Copyright 2022 Google LLC
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of works must retain the original copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the original
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#
+# 3. Neither the name of the W3C nor the names of its contributors
+# may be used to endorse or promote products derived from this work
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A tokenizer generated from the Fixed and Pattern tokens of a grammar, for
+the table-driven parser in LRParser.py.
+
+The tokens are the terminals of a CompactParseTable, named as the grammar
+prints them: 'text' for a Fixed token, and /regex/ for a Pattern token.
+The tokenizer finds every token matching at a position, and returns them
+longest first.  A token is only looked for at positions whose first code
+point can start it, found from the parsed regular expression.
+
+Fixed tokens matching the grammar's word pattern are keywords.  They are
+found by matching the word pattern, then looking up the matched text, as
+Treesitter does.  Keywords and other tokens may match the same text as the
+word pattern, so the parser picks the first one valid in its state.
+Reserved words are not keywords, and do not match the word pattern either,
+so they are not tokens at all.
+
+The tokenizer skips blankspace and comments, including nested block
+comments.  Tokens of the WGSL external scanner (grammar/src/scanner.c) are
+written as /\\u200B_name/ placeholders by the Grammar.  The tokenizer gives
+them the text the scanner matches, and finds template lists with the
+template list discovery algorithm of the WGSL specification.
+
+Token positions are code point indices into the text, except in Token,
+which has byte offsets into its UTF-8 encoding.
+"""
+
+import re
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from CompactParseTable import END_OF_TEXT
+
+
+# The prefix of the names of external tokens, in terminal names.
+EXTERNAL_PREFIX = "/\\u200B"
+
+TEMPLATE_ARGS_START = '_template_args_start'
+TEMPLATE_ARGS_END = '_template_args_end'
+DISAMBIGUATE_TEMPLATE = '_disambiguate_template'
+
+# The text matched by the external tokens of the WGSL scanner.
+# The template list delimiters are only matched where template list
+# discovery finds them.
+EXTERNAL_TEXT = {
+    '_less_than': '<',
+    '_less_than_equal': '<=',
+    '_shift_left': '<<',
+    '_shift_left_assign': '<<=',
+    '_greater_than': '>',
+    '_greater_than_equal': '>=',
+    '_shift_right': '>>',
+    '_shift_right_assign': '>>=',
+}
+
+# First code points are tracked for ASCII.  This stands for all others.
+NON_ASCII = 128
+ALL_CODES = frozenset(range(NON_ASCII + 1))
+
+
+class TokenizeError(RuntimeError):
+    """
+    Text that is not a token.
+
+    Members:
+      .position:  The byte offset of the text in its UTF-8 encoding.
+    """
+    def __init__(self,position,message):
+        self.position = position
+        super().__init__("{} at byte {}".format(message, position))
+
+
+class Token:
+    """
+    A token of text.
+
+    Members:
+      .terminal:  The terminal index.
+      .start:     The byte offset of the start of the token.
+      .end:       The byte offset of the end of the token.
+    """
+    __slots__ = ('terminal', 'start', 'end')
+
+    def __init__(self,terminal,start,end):
+        self.terminal = terminal
+        self.start = start
+        self.end = end
+
+    def __eq__(self,other):
+        return (self.terminal, self.start, self.end) == (other.terminal, other.start, other.end)
+
+    def __repr__(self):
+        return "Token({},{},{})".format(self.terminal, self.start, self.end)
+
+
+def utf8_offsets(text):
+    """
+    Returns a function mapping increasing code point indices into text
+    to byte offsets into its UTF-8 encoding.
+    """
+    if text.isascii():
+        return lambda position: position
+    state = [0, 0]
+    def offset(position):
+        (last, last_offset) = state
+        last_offset += len(text[last:position].encode('utf-8'))
+        state[0] = position
+        state[1] = last_offset
+        return last_offset
+    return offset
+
+
+_xid_classes = None
+
+def xid_classes():
+    """
+    Returns regular expression character class contents for the
+    Unicode XID_Start and XID_Continue properties.
+    """
+    global _xid_classes
+    if _xid_classes is None:
+        # Python identifiers are made of these, plus '_' at the start.
+        start = []
+        cont = []
+        for code in range(0x110000):
+            c = chr(code)
+            for (ranges, member) in ((start, c.isidentifier() and c != '_'),
+                                     (cont, ('a' + c).isidentifier())):
+                if member:
+                    if ranges and ranges[-1][1] == code - 1:
+                        ranges[-1][1] = code
+                    else:
+                        ranges.append([code, code])
+        _xid_classes = tuple(["".join(["\\U{:08x}-\\U{:08x}".format(lo, hi) for lo, hi in ranges])
+                              for ranges in (start, cont)])
+    return _xid_classes
+
+
+def python_regex(pattern):
+    """
+    Returns a Python regular expression for a grammar Pattern.
+    """
+    if "\\p{" in pattern:
+        (start, cont) = xid_classes()
+        pattern = pattern.replace("\\p{XID_Start}", start).replace("\\p{XID_Continue}", cont)
+    return pattern
+
+
+def first_codes(items):
+    """
+    Returns a pair (codes, nullable) for a parsed regular expression, where
+    codes is the set of ASCII code points that can start a match, plus
+    NON_ASCII if others can, and nullable is True if it matches empty text.
+    The set may be larger than needed, but never smaller.
+    """
+    codes = set()
+    for op, av in items:
+        name = str(op)
+        nullable = False
+        if name == 'LITERAL':
+            codes.add(min(av, NON_ASCII))
+        elif name == 'IN':
+            for (op2, av2) in av:
+                name2 = str(op2)
+                if name2 == 'LITERAL':
+                    codes.add(min(av2, NON_ASCII))
+                elif name2 == 'RANGE':
+                    codes.update(range(min(av2[0], NON_ASCII), min(av2[1], NON_ASCII) + 1))
+                else:
+                    return (ALL_CODES, False)
+        elif name == 'SUBPATTERN':
+            (sub, nullable) = first_codes(av[-1])
+            codes.update(sub)
+        elif name == 'BRANCH':
+            for branch in av[1]:
+                (sub, branch_nullable) = first_codes(branch)
+                codes.update(sub)
+                nullable = nullable or branch_nullable
+        elif name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+            (sub, nullable) = first_codes(av[2])
+            codes.update(sub)
+            nullable = nullable or av[0] == 0
+        elif name == 'AT':
+            nullable = True
+        else:
+            return (ALL_CODES, False)
+        if not nullable:
+            return (codes, False)
+    return (codes, True)
+
+
+class Tokenizer:
+    """
+    A longest-match tokenizer for the terminals of a parse table.
+
+    Members:
+      .terminals:     The terminal names.
+      .end_of_text:   The terminal index of the end of text.
+      .reserved:      The set of reserved words.
+      .zero_width:    The terminal indices of tokens matched with no text.
+                      The parser decides when to use them.
+      .template_args_start, .template_args_end:
+                      The terminal indices of template list delimiters,
+                      or None.
+    """
+    def __init__(self,terminals,skip=(),word=None,reserved=()):
+        """
+        Args:
+           terminals: the terminal names, as in CompactParseTable.terminals
+           skip: the names of Pattern terminals to skip between tokens
+           word: the name of the Pattern terminal for words, or None
+           reserved: the words the word pattern does not match
+        """
+        self.terminals = terminals
+        self.end_of_text = terminals.index(END_OF_TEXT)
+        self.reserved = frozenset(reserved)
+        self.zero_width = []
+        self.template_args_start = None
+        self.template_args_end = None
+        # A list of (text, terminal index)
+        fixed = []
+        # A list of (Python regular expression, terminal index)
+        patterns = []
+        skip_patterns = []
+        self.word = None
+        for i, name in enumerate(terminals):
+            if name.startswith("'"):
+                fixed.append((name[1:-1], i))
+            elif name.startswith(EXTERNAL_PREFIX):
+                external = name[len(EXTERNAL_PREFIX):-1]
+                if external in EXTERNAL_TEXT:
+                    fixed.append((EXTERNAL_TEXT[external], i))
+                elif external == TEMPLATE_ARGS_START:
+                    self.template_args_start = i
+                elif external == TEMPLATE_ARGS_END:
+                    self.template_args_end = i
+                elif external == DISAMBIGUATE_TEMPLATE:
+                    self.zero_width.append(i)
+                # Other externals, like block comments, are not matched as tokens.
+            elif name.startswith("/"):
+                regex = python_regex(name[1:-1])
+                if name in skip:
+                    skip_patterns.append(regex)
+                elif name == word:
+                    self.word = (re.compile(regex), i)
+                else:
+                    patterns.append((regex, i))
+
+        # Maps the text of a keyword to its terminal index.
+        self.keywords = dict()
+        if self.word is not None:
+            for (text, i) in fixed:
+                if self.word[0].fullmatch(text):
+                    self.keywords[text] = i
+        # Maps a first code point, or NON_ASCII, to the list of
+        # (preference, text or compiled regex, terminal index)
+        # for the tokens it can start.  Lower preferences win ties.
+        self.dispatch = [[] for _ in range(NON_ASCII + 1)]
+        for (text, i) in fixed:
+            if text not in self.keywords:
+                self.dispatch[min(ord(text[0]), NON_ASCII)].append((0, text, i))
+        for (regex, i) in patterns:
+            (codes, nullable) = first_codes(sre_parse.parse(regex))
+            if nullable:
+                raise RuntimeError("pattern matches empty text: {}".format(terminals[i]))
+            compiled = re.compile(regex)
+            for code in codes:
+                self.dispatch[code].append((1, compiled, i))
+        if self.word is not None:
+            (codes, _) = first_codes(sre_parse.parse(self.word[0].pattern))
+            for code in codes:
+                self.dispatch[code].append((2, None, self.word[1]))
+        self.skip_regex = re.compile("(?:{})+".format("|".join(skip_patterns))) if skip_patterns else None
+
+    @staticmethod
+    def from_grammar(grammar,terminals):
+        """
+        Returns a tokenizer for the given terminals of a Grammar, skipping the
+        grammar's extras and with keywords for its word token.
+        The strings of the rule the grammar ignored, like _reserved in WGSL,
+        are the reserved words.
+        """
+        json_grammar = grammar.json_grammar
+        skip = set([str(grammar.rules[str(x)]) for x in json_grammar.get("extras",[])])
+        word = json_grammar.get("word")
+        word = None if word is None else str(grammar.rules[str(word)])
+        reserved = []
+        def add_strings(dct):
+            if dct.get("type") == "STRING":
+                reserved.append(dct["value"])
+            for member in dct.get("members",[]):
+                add_strings(member)
+            if isinstance(dct.get("content"),dict):
+                add_strings(dct["content"])
+        if grammar.ignored_json_rule is not None:
+            add_strings(grammar.ignored_json_rule)
+        return Tokenizer(terminals,skip,word,reserved)
+
+    def skip(self,text,position):
+        """
+        Returns the position after the blankspace and comments starting at
+        a position.
+
+        Raises TokenizeError for an unterminated block comment.
+        """
+        while True:
+            if self.skip_regex is not None:
+                m = self.skip_regex.match(text,position)
+                if m:
+                    position = m.end()
+            if not text.startswith("/*",position):
+                return position
+            # Block comments nest.
+            start = position
+            depth = 1
+            position += 2
+            while depth > 0:
+                open_at = text.find("/*",position)
+                close_at = text.find("*/",position)
+                if close_at < 0:
+                    raise TokenizeError(utf8_offsets(text)(start), "unterminated block comment")
+                if 0 <= open_at < close_at:
+                    depth += 1
+                    position = open_at + 2
+                else:
+                    depth -= 1
+                    position = close_at + 2
+
+    def candidates(self,text,position,templates=None,valid=None):
+        """
+        Returns a list of (end, terminal index) for the tokens matching at a
+        position, longest first.  Equally long Fixed tokens come first, then
+        Patterns, and then the word pattern.  Where the word pattern matches
+        a reserved word, only tokens at least as long as it match.
+
+        Args:
+           templates: the pair of sets from template_lists, or None
+           valid: a bitmask over terminal indices, or None.  Only those
+              terminals are tried, as for the valid terminals of a parser
+              state.  See CompactParseTable.valid_terminals.
+        """
+        if templates is not None:
+            if position in templates[0]:
+                return [(position + 1, self.template_args_start)]
+            if position in templates[1]:
+                return [(position + 1, self.template_args_end)]
+        matches = []
+        # The end of a reserved word at the position, or None.
+        reserved_end = None
+        for (preference, matcher, terminal) in self.dispatch[min(ord(text[position]), NON_ASCII)]:
+            if valid is not None and preference < 2 and not (valid >> terminal) & 1:
+                continue
+            if preference == 0:
+                if text.startswith(matcher,position):
+                    matches.append((-len(matcher), 0, terminal))
+            elif preference == 1:
+                m = matcher.match(text,position)
+                if m:
+                    matches.append((position - m.end(), 1, terminal))
+            else:
+                # One match finds both the word and any keyword.
+                m = self.word[0].match(text,position)
+                if m:
+                    if m.group() in self.reserved:
+                        reserved_end = m.end()
+                    elif valid is None or (valid >> terminal) & 1:
+                        matches.append((position - m.end(), 2, terminal))
+                    keyword = self.keywords.get(m.group())
+                    if keyword is not None and (valid is None or (valid >> keyword) & 1):
+                        matches.append((position - m.end(), 0, keyword))
+        if reserved_end is not None:
+            matches = [match for match in matches if position - match[0] >= reserved_end]
+        if len(matches) > 1:
+            matches.sort()
+        return [(position - length, terminal) for (length, _, terminal) in matches]
+
+    def invalid_token(self,text,position):
+        """
+        Returns the TokenizeError for text at a position that is not a token.
+        """
+        message = "invalid token"
+        if self.word is not None:
+            m = self.word[0].match(text,position)
+            if m and m.group() in self.reserved:
+                message = "reserved word '{}'".format(m.group())
+        return TokenizeError(utf8_offsets(text)(position), message)
+
+    def template_lists(self,text):
+        """
+        Returns a pair of sets: the positions of the '<' starting template
+        lists, and the positions of the '>' ending them.
+
+        This is the template list discovery algorithm of the WGSL
+        specification.
+        """
+        starts = set()
+        ends = set()
+        # A stack of (position, nesting depth) for each candidate '<'.
+        pending = []
+        depth = 0
+        position = 0
+        word = self.word[0] if self.word is not None else None
+        while True:
+            position = self.skip(text,position)
+            if position >= len(text):
+                break
+            c = text[position]
+            # Skip literals, so a suffix like the 'f' in 1.0f is not a word.
+            if c.isdigit() or (c == '.' and text[position + 1:position + 2].isdigit()):
+                literal = [end for (end, _) in self.candidates(text,position)]
+                if literal:
+                    position = literal[0]
+                    continue
+            m = word.match(text,position) if word is not None else None
+            if m:
+                position = self.skip(text,m.end())
+                if text.startswith('<',position):
+                    pending.append((position, depth))
+                    position += 1
+                    if text.startswith('<',position) or text.startswith('=',position):
+                        # A template argument does not start with '<' or '='.
+                        pending.pop()
+                        position += 1
+                continue
+            if c == '>':
+                if pending and pending[-1][1] == depth:
+                    starts.add(pending.pop()[0])
+                    ends.add(position)
+                    position += 1
+                    continue
+                position += 1
+                if text.startswith('=',position):
+                    position += 1
+            elif c in '([':
+                depth += 1
+                position += 1
+            elif c in ')]':
+                while pending and pending[-1][1] >= depth:
+                    pending.pop()
+                depth = max(0, depth - 1)
+                position += 1
+            elif c == '!':
+                position += 1
+                if text.startswith('=',position):
+                    position += 1
+            elif c == '=':
+                position += 1
+                if text.startswith('=',position):
+                    position += 1
+                    continue
+                # An assignment ends any expression.
+                depth = 0
+                pending.clear()
+            elif c in ';{:':
+                depth = 0
+                pending.clear()
+                position += 1
+            elif text.startswith('&&',position) or text.startswith('||',position):
+                while pending and pending[-1][1] >= depth:
+                    pending.pop()
+                position += 2
+            else:
+                position += 1
+        return (starts, ends)
+
+    def tokens(self,text):
+        """
+        Returns the list of Tokens in text, taking the longest match at each
+        position, and the first when several match.  The end of text and
+        zero width tokens are not included.
+
+        The parser can pick a different token where several match.
+        See LRParser.Parser.parse_text.
+
+        Raises TokenizeError for text that is not a token.
+        """
+        templates = self.template_lists(text)
+        offset = utf8_offsets(text)
+        result = []
+        position = 0
+        while True:
+            position = self.skip(text,position)
+            if position >= len(text):
+                return result
+            matches = self.candidates(text,position,templates)
+            if not matches:
+                raise self.invalid_token(text,position)
+            (end, terminal) = matches[0]
+            result.append(Token(terminal, offset(position), offset(end)))
+            position = end
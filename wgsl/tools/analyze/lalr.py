@@ -42,8 +42,119 @@ import os
 import re
 import subprocess
 import sys
+import time
 
-from Grammar import Grammar, PrintOption
+from Grammar import Grammar, PrintOption, LALR1_ENGINES, LALR1_ENGINE_SWEEP
+from CompactParseTable import CombParseTable
+from LRParser import Parser, ParseError
+from Tokenizer import Tokenizer, TokenizeError
+
+
+def write_tables(parse_table, args):
+    """
+    Saves the parser table in the binary formats requested by the arguments.
+    """
+    if args.table or args.comb:
+        compact = parse_table.compact()
+        if args.optimize:
+            (compact, optimization) = compact.optimized()
+            print("optimized: {}".format(optimization), file=sys.stderr)
+        if args.classes:
+            compact = compact.with_terminal_classes()
+            print("{}".format(compact.terminal_classes_str()), end='', file=sys.stderr)
+        print("{}".format(compact.valid_terminals_str()), end='', file=sys.stderr)
+        if args.table:
+            compact.write(args.table)
+        if args.comb:
+            comb = CombParseTable.from_compact(compact)
+            comb.write(args.comb)
+            print("{}: {}".format(args.comb, comb.size_str()), file=sys.stderr)
+
+
+def read_examples(bs_file):
+    """
+    Returns a list of (name, WGSL source) for the examples in the Bikeshed
+    source of the WGSL spec that should parse.  As in tools/extract-grammar.py,
+    function-scope and type-scope examples are placed in a translation unit.
+    """
+    with open(bs_file) as infile:
+        lines = infile.read().split("\n")
+    examples = []
+    i = 0
+    while i < len(lines):
+        m = re.match(r"\s*<div class='(example wgsl[^']*)'", lines[i])
+        i += 1
+        if not m:
+            continue
+        name = "{}:{}".format(bs_file, i)
+        while "<xmp" not in lines[i]:
+            i += 1
+        i += 1
+        start = i
+        while "</xmp>" not in lines[i]:
+            i += 1
+        text = "\n".join(lines[start:i])
+        kind = m.group(1)
+        if "expect-error" in kind:
+            continue
+        if "function-scope" in kind:
+            text = "fn function__scope____() {{\n{}\n}}".format(text)
+        if "type-scope" in kind:
+            # The type may be followed by a line comment.
+            text = "const type_scope____: {0}\n=\n{0}\n();".format(text)
+        examples.append((name, text))
+    return examples
+
+
+def parse_examples(g, args):
+    """
+    Tokenizes and parses the WGSL examples in the Bikeshed file named by
+    the arguments with the table-driven parser, and reports throughput.
+    Returns the number of examples that failed to parse.
+    """
+    # Without empty productions, the LALR(1) parse table accepts the language.
+    g.eliminate_empty()
+    parse_table = g.LALR1(max_item_sets=args.limit,engine=args.engine,cache_dir=args.cache)
+    if parse_table.has_conflicts():
+        print("parse table has {} conflicts".format(len(parse_table.conflicts)))
+        return 1
+    compact = parse_table.compact()
+    print("{}".format(compact.valid_terminals_str()), end='')
+    tokenizer = Tokenizer.from_grammar(g, compact.terminals)
+    if len(tokenizer.reserved) > 0:
+        print("tokenizer rejects {} reserved words".format(len(tokenizer.reserved)))
+    else:
+        print("tokenizer has no reserved words: they tokenize as identifiers")
+    examples = read_examples(args.examples)
+    num_bytes = sum([len(text.encode('utf-8')) for (_, text) in examples])
+
+    start = time.perf_counter()
+    num_tokens = sum([len(tokenizer.tokens(text)) for (_, text) in examples])
+    seconds = time.perf_counter() - start
+    print("tokenized {} examples, {} bytes, {} tokens in {:.3f}s: {:.2f} MB/s, {:.0f} tokens/s".format(
+        len(examples), num_bytes, num_tokens, seconds, num_bytes / seconds / 1e6, num_tokens / seconds))
+
+    tables = [("LALR(1)", compact)]
+    if args.optimize:
+        (optimized, optimization) = compact.optimized()
+        tables.append(("optimized", optimized))
+        print("optimized: {}".format(optimization))
+    errors = 0
+    for (table_name, table) in tables:
+        parser = Parser(table)
+        steps = 0
+        start = time.perf_counter()
+        for (name, text) in examples:
+            try:
+                parser.parse_text(tokenizer, text)
+                steps += parser.steps
+            except (ParseError, TokenizeError) as e:
+                print("{}: {}".format(name, e))
+                errors += 1
+        seconds = time.perf_counter() - start
+        print("{} table: parsed {} examples in {:.3f}s, {} shift and reduce steps".format(
+            table_name, len(examples), seconds, steps))
+    return errors
 
 
 def main():
@@ -81,11 +192,56 @@ def main():
     argparser.add_argument('-lalr',
                            help='compute LALR(1) parser table and associated conflicts',
                            action="store_true")
+    argparser.add_argument('-minimal',
+                           help='compute minimal LR(1) parser table and associated conflicts, '
+                                'splitting LALR(1) states only where merging them could cause a conflict',
+                           action="store_true")
+    argparser.add_argument('-conflicts', type=int,
+                           metavar='N',
+                           help='only report the first N conflicts of the LALR(1) parser table, '
+                                'and print just those conflicts and their item sets.  '
+                                'The item sets are still computed in full.  '
+                                'Exits with status 1 if there are any')
+    argparser.add_argument('-examples',
+                           metavar='BS_FILE',
+                           help='tokenize and parse the WGSL examples in the Bikeshed source BS_FILE '
+                                'with the table-driven parser, after eliminating empty productions, '
+                                'and report throughput.  With -optimize, also parse with the optimized table')
     argparser.add_argument('-lr',
                            help='compute LR(1) item sets',
                            action="store_true")
+    argparser.add_argument('-jobs', type=int,
+                           help='number of worker processes for computing LR(1) item sets')
     argparser.add_argument('-limit', type=int,
                            help='limit on number of LALR(1) item sets')
+    argparser.add_argument('-cache',
+                           metavar='DIR',
+                           help='directory for caching LALR(1) parse tables, '
+                                'keyed by a hash of the grammar and the analyzer')
+    argparser.add_argument('-table',
+                           metavar='FILE',
+                           help='with -lalr or -minimal, also save the parser table to FILE '
+                                'in the compact binary format of CompactParseTable.py')
+    argparser.add_argument('-comb',
+                           metavar='FILE',
+                           help='with -lalr or -minimal, also save the parser table to FILE '
+                                'compressed into comb vectors, and report the compression ratio')
+    argparser.add_argument('-optimize',
+                           help='with -table, -comb, or -examples, give the table default reductions, '
+                                'and bypass chain reductions',
+                           action="store_true")
+    argparser.add_argument('-classes',
+                           help='with -table or -comb, merge terminals with the same actions in every state '
+                                'into terminal classes, sharing a column of the action table',
+                           action="store_true")
+    argparser.add_argument('-engine',
+                           choices=LALR1_ENGINES,
+                           default=LALR1_ENGINE_SWEEP,
+                           help='method for computing LALR(1) lookaheads: '
+                                'sweep: propagate along goto edges until settling; '
+                                'worklist: like sweep, but only revisit changed item sets; '
+                                'propagate: spontaneous and propagated lookaheads over the LR(0) item sets; '
+                                'dp: DeRemer-Pennello relations over the LR(0) item sets')
     args = argparser.parse_args()
     with open(args.json_file) as infile:
         json_text = "".join(infile.readlines())
@@ -151,16 +307,35 @@ def main():
     else:
         g = Grammar.Load(json_text, 'translation_unit')
 
+    if args.examples:
+        sys.exit(1 if parse_examples(g, args) > 0 else 0)
+    if args.conflicts is not None:
+        conflicts = g.LALR1_conflict_report(max_conflicts=args.conflicts,max_item_sets=args.limit,
+                                            engine=args.engine,cache_dir=args.cache)
+        for c in conflicts:
+            print("=Conflict: {}\n\n{}\n".format(c, c.item_set))
+        sys.exit(1 if conflicts else 0)
     if args.lalr:
         print("=Grammar:\n")
         print(g.pretty_str())
-        parse_table = g.LALR1(max_item_sets=args.limit)
+        parse_table = g.LALR1(max_item_sets=args.limit,engine=args.engine,cache_dir=args.cache)
+        parse_table.write(sys.stdout)
+        write_tables(parse_table, args)
+        if parse_table.has_conflicts():
+            sys.exit(1)
+        sys.exit(0)
+    if args.minimal:
+        print("=Grammar:\n")
+        print(g.pretty_str())
+        (parse_table, splits) = g.MinimalLR1()
         parse_table.write(sys.stdout)
+        write_tables(parse_table, args)
+        print("\n=State splits: {}".format(splits), end='')
         if parse_table.has_conflicts():
             sys.exit(1)
         sys.exit(0)
     if args.lr:
-        lr1_itemsets = g.LR1_ItemSets()
+        lr1_itemsets = g.LR1_ItemSets(workers=args.jobs)
         for IS in lr1_itemsets:
             print("\n{}".format(str(IS)))
         sys.exit(0)
@@ -35,8 +35,12 @@
 Unit tests for Grammar.py
 """
 
+import json
 import unittest
 import Grammar
+import CompactParseTable
+import LRParser
+import Tokenizer
 import sys
 
 def first_str(g,name):
@@ -635,6 +639,92 @@ class DragonBook(unittest.TestCase):
         self.assertEqual(strset(r.follow), "')' '*' '+' EndOfText")
 
 
+class FirstFollow_cycles(unittest.TestCase):
+    # 'a' and 'b' begin each other through nullable prefixes, and 'c' and 'd'
+    # end each other, so both dependency graphs have cycles.
+    def setUp(self):
+        self.g = _gl("s",
+                     _def("s",_seq(_sym("a"),_sym("b"),_sym("c"),_fixed('x'))),
+                     _def("a",_choice(_seq(_sym("b"),_fixed('p')),_empty())),
+                     _def("b",_choice(_seq(_sym("a"),_fixed('q')),_empty())),
+                     _def("c",_seq(_fixed('('),_sym("d"))),
+                     _def("d",_choice(_seq(_fixed('y'),_sym("c")),_empty())))
+
+    def test_first(self):
+        self.assertEqual(strset(self.g.find("s").first()), "'(' 'p' 'q'")
+        self.assertEqual(strset(self.g.find("a").first()), "'p' 'q' {}".format(EPSILON))
+        self.assertEqual(strset(self.g.find("b").first()), "'p' 'q' {}".format(EPSILON))
+        self.assertEqual(strset(self.g.find("c").first()), "'('")
+        self.assertEqual(strset(self.g.find("d").first()), "'y' {}".format(EPSILON))
+
+    def test_follow(self):
+        self.assertEqual(strset(self.g.find("s").follow), "EndOfText")
+        self.assertEqual(strset(self.g.find("a").follow), "'(' 'p' 'q'")
+        self.assertEqual(strset(self.g.find("b").follow), "'(' 'p'")
+        self.assertEqual(strset(self.g.find("c").follow), "'x'")
+        self.assertEqual(strset(self.g.find("d").follow), "'x'")
+
+
+class Nullable(unittest.TestCase):
+    def setUp(self):
+        # 'e' derives the empty string through a chain, and twice over.
+        self.g = _gl("s",
+                     _def("s",_seq(_sym("e"),_sym("h"))),
+                     _def("e",_choice(_seq(_sym("f"),_sym("f")),_fixed('x'))),
+                     _def("f",_sym("g")),
+                     _def("g",_choice(_seq(_sym("e"),_fixed('y')),_empty())),
+                     _def("h",_seq(_sym("f"),_fixed('z'))))
+
+    def test_nullable(self):
+        self.assertEqual(sorted(self.g.nullable()), ["e", "f", "g"])
+
+    def test_matches_naive_fixed_point(self):
+        # Sweep over all the productions until nothing changes.
+        expected = set()
+        changed = True
+        while changed:
+            changed = False
+            for name, rule in self.g.rules.items():
+                if name in expected:
+                    continue
+                for option in rule.as_container():
+                    if all([x.is_empty() or (x.is_symbol_name() and x.content in expected)
+                            for x in option.as_container()]):
+                        expected.add(name)
+                        changed = True
+                        break
+        self.assertEqual(expected, set(["e", "f", "g"]))
+        self.assertEqual(self.g.nullable(), expected)
+
+    def test_cached(self):
+        nullable = self.g.nullable()
+        self.assertIs(nullable, self.g.nullable())
+        self.g.reset_first_follow()
+        self.assertIsNot(nullable, self.g.nullable())
+        self.assertEqual(nullable, self.g.nullable())
+
+    def test_compute_nullable(self):
+        self.assertEqual(Grammar.compute_nullable(self.g.rules), self.g.nullable())
+
+
+class EpsilonRefactor(unittest.TestCase):
+    def test_inlines_nullable(self):
+        # B derives the empty string, though it has no empty production.
+        # So A is replaced by B.  But Q is not nullable, so P is kept.
+        g = _gl("s",
+                _def("s",_seq(_fixed('a'),_sym("A"),_sym("P"),_fixed('b'))),
+                _def("A",_choice(_sym("B"),_empty())),
+                _def("B",_seq(_sym("C"),_sym("D"))),
+                _def("C",_choice(_fixed('c'),_empty())),
+                _def("D",_choice(_fixed('d'),_empty())),
+                _def("P",_choice(_sym("Q"),_empty())),
+                _def("Q",_fixed('q')))
+        g.epsilon_refactor()
+        self.assertEqual(sorted(g.rules.keys()), ["B", "C", "D", "P", "Q", "language", "s"])
+        [option] = g.rules["s"].as_container()
+        self.assertEqual([str(x) for x in option.as_container()], ["'a'", "B", "P", "'b'"])
+
+
 class SimpleWgsl_First(unittest.TestCase):
 
     def setUp(self):
@@ -1282,50 +1372,89 @@ class ItemSet_is_accepting(unittest.TestCase):
         i1_ = Grammar.ItemSet(self.g,{i1:self.l_end_and}).close(self.g)
         self.assertFalse(i1_.is_accepting())
 
-class Lookahead_is_a_set(unittest.TestCase):
+class LookaheadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_17,'E')
+
+    def la(self,*contents):
+        """Returns a LookaheadSet over the Fixed tokens with the given spellings"""
+        return Grammar.LookaheadSet([self.g.MakeFixed(c) for c in contents])
+
+class Lookahead_is_a_set(LookaheadTestCase):
     def test_init_empty(self):
         x = Grammar.LookaheadSet()
-        self.assertTrue(x == set())
+        self.assertEqual(len(x),0)
+        self.assertEqual(list(x),[])
 
     def test_init_single(self):
-        x = Grammar.LookaheadSet({1})
-        self.assertTrue(x == set({1}))
+        x = self.la('id')
+        self.assertEqual(len(x),1)
+        self.assertTrue(self.g.MakeFixed('id') in x)
+        self.assertFalse(self.g.MakeFixed('+') in x)
 
     def test_init_several(self):
-        x = Grammar.LookaheadSet({1,2,9})
-        self.assertTrue(x == set({9,2,1}))
+        x = self.la('id','+','*')
+        self.assertEqual(x,self.la('*','+','id'))
+        self.assertEqual(set(x),set([self.g.MakeFixed(c) for c in ['*','+','id']]))
+
+    def test_init_copy(self):
+        x = self.la('id','+')
+        y = Grammar.LookaheadSet(x)
+        self.assertEqual(x,y)
+        self.assertTrue(y.merge(self.la('*')))
+        self.assertNotEqual(x,y)
+
+    def test_eq_other_types(self):
+        x = Grammar.LookaheadSet()
+        self.assertFalse(x == None)
+        self.assertFalse(x == set())
+        self.assertFalse(x == 0)
+        self.assertTrue(x != set())
 
     def test_str_empty(self):
         x = Grammar.LookaheadSet({})
         self.assertEqual(str(x),"{}")
 
     def test_str_several_is_ordered(self):
-        x = Grammar.LookaheadSet({9,2,1})
-        self.assertEqual(str(x),"{1 2 9}")
+        x = self.la('id','+','(')
+        self.assertEqual(str(x),"{'(' '+' 'id'}")
+
+    def test_end_of_text(self):
+        x = self.la('id')
+        self.assertFalse(x.includesEndOfText())
+        x.merge(Grammar.LookaheadSet({self.g.end_of_text}))
+        self.assertTrue(x.includesEndOfText())
+        self.assertEqual(str(x),"{'id' EndOfText}")
 
-class Lookahead_merge(unittest.TestCase):
+class Lookahead_merge(LookaheadTestCase):
     def test_merge_empty(self):
-        x = Grammar.LookaheadSet({1,2,3})
+        x = self.la('(','+','*')
         b = x.merge(Grammar.LookaheadSet({}))
-        self.assertEqual(str(x),"{1 2 3}")
+        self.assertEqual(str(x),"{'(' '*' '+'}")
         self.assertFalse(b)
 
     def test_merge_same(self):
-        x = Grammar.LookaheadSet({1,2,3})
-        b = x.merge(Grammar.LookaheadSet({1,2,3}))
-        self.assertEqual(str(x),"{1 2 3}")
+        x = self.la('(','+','*')
+        b = x.merge(self.la('(','+','*'))
+        self.assertEqual(str(x),"{'(' '*' '+'}")
         self.assertFalse(b)
 
     def test_merge_disjoint(self):
-        x = Grammar.LookaheadSet({-1,9,4})
-        b = x.merge(Grammar.LookaheadSet({1,2,3}))
-        self.assertEqual(str(x),"{-1 1 2 3 4 9}")
+        x = self.la(')','id')
+        b = x.merge(self.la('(','+','*'))
+        self.assertEqual(str(x),"{'(' ')' '*' '+' 'id'}")
         self.assertTrue(b)
 
     def test_merge_overlap(self):
-        x = Grammar.LookaheadSet({1,2,4})
-        b = x.merge(Grammar.LookaheadSet({1,2,3}))
-        self.assertEqual(str(x),"{1 2 3 4}")
+        x = self.la('(','+','id')
+        b = x.merge(self.la('(','+','*'))
+        self.assertEqual(str(x),"{'(' '*' '+' 'id'}")
+        self.assertTrue(b)
+
+    def test_merge_into_empty(self):
+        x = Grammar.LookaheadSet()
+        b = x.merge(self.la('id'))
+        self.assertEqual(str(x),"{'id'}")
         self.assertTrue(b)
 
 
@@ -1477,6 +1606,41 @@ class LR1_items(unittest.TestCase):
         got_str = [str(i) for i in got]
         self.assertEqual(got_str, expected)
 
+    def test_ex442_workers(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+        got_str = [str(i) for i in g.LR1_ItemSets(workers=2)]
+        self.assertEqual(got_str, EX442_LR1_ITEMS_CLOSED_EXPECTED)
+
+    def test_workers_agree(self):
+        expected = [str(i) for i in Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LR1_ItemSets()]
+        g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+        self.assertEqual([str(i) for i in g.LR1_ItemSets(workers=3)], expected)
+
+    def test_core_indices_match_lalr1(self):
+        def cores(item_sets):
+            return set([(i.core_index, i.kernel_item_ids) for i in item_sets])
+        lalr1_cores = cores(Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LALR1_ItemSets())
+        item_sets = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LR1_ItemSets()
+        self.assertEqual(set([(i,str(sorted([str(x) for x in k]))) for i,k in cores(item_sets)]),
+                         set([(i,str(sorted([str(x) for x in k]))) for i,k in lalr1_cores]))
+        self.assertEqual(len(set(item_sets)), len(item_sets))
+        self.assertEqual([i.core_index for i in item_sets], sorted([i.core_index for i in item_sets]))
+
+    def test_pickled_ir(self):
+        import pickle
+        ir = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').lower()
+        ir.lower_all()
+        copy = pickle.loads(pickle.dumps(ir))
+        self.assertIsNone(copy.grammar)
+        kernel = ((ir.root_item(), 1 << ir.end_of_text_id),)
+        while True:
+            expected = ir.lr1_expand(kernel)
+            self.assertEqual(copy.lr1_expand(kernel), expected)
+            (_, goto) = expected
+            if len(goto) == 0:
+                break
+            kernel = goto[-1][1]
+
 class LALR1_items(unittest.TestCase):
     def test_ex442(self):
         g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
@@ -1564,6 +1728,288 @@ class LALR1_gotos(unittest.TestCase):
         got = "".join(parse_table.goto_parts())
         self.assertEqual(got, expected)
 
+class Digraph(unittest.TestCase):
+    def test_chain(self):
+        R = {'a':['b'], 'b':['c']}
+        initial = {'a':{1}, 'b':{2}, 'c':{3}}
+        F = Grammar.digraph(['a','b','c'],R,initial)
+        self.assertEqual(F, {'a':{1,2,3}, 'b':{2,3}, 'c':{3}})
+
+    def test_cycle(self):
+        R = {'a':['b'], 'b':['c'], 'c':['a','d']}
+        initial = {'a':{1}, 'b':{2}, 'c':{3}, 'd':{4}}
+        F = Grammar.digraph(['a','b','c','d'],R,initial)
+        self.assertEqual(F, {'a':{1,2,3,4}, 'b':{1,2,3,4}, 'c':{1,2,3,4}, 'd':{4}})
+
+    def test_bitmasks(self):
+        R = {'a':['a','b']}
+        F = Grammar.digraph(['b','a'],R,{'a':1,'b':4})
+        self.assertEqual(F, {'a':5, 'b':4})
+
+class LALR1_engines_agree(unittest.TestCase):
+    def check(self,json_text,start_symbol):
+        expected = str(Grammar.Grammar.Load(json_text,start_symbol).LALR1())
+        for engine in Grammar.LALR1_ENGINES:
+            g = Grammar.Grammar.Load(json_text,start_symbol)
+            got = str(g.LALR1(engine=engine))
+            self.maxDiff = None
+            self.assertEqual(got, expected, engine)
+
+    def test_ex417(self):
+        self.check(DRAGON_BOOK_EXAMPLE_4_17,'E')
+
+    def test_ex442(self):
+        self.check(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+
+    def test_star(self):
+        self.check(STAR_GRAMMAR,'s')
+
+    def test_simple_wgsl(self):
+        self.check(SIMPLE_WGSL,'translation_unit')
+
+    def test_nullable_between(self):
+        # Exercise the 'reads' relation: B and C can vanish between A and 'z'.
+        g = _g(_def('s',_seq(_sym('A'),_sym('B'),_sym('C'),_fixed('z'))),
+               _def('A',_choice(_seq(_fixed('a'),_sym('A')),_fixed('a'))),
+               _def('B',_optional(_fixed('b'))),
+               _def('C',_star(_seq(_sym('A'),_fixed('c')))))
+        self.check(g,'s')
+
+    def test_deremer_pennello_ex442(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+        parse_table = g.LALR1(engine=Grammar.LALR1_ENGINE_DEREMER_PENNELLO)
+        self.assertEqual([str(i) for i in parse_table.states], EX442_LALR1_ITEMS_CLOSED_EXPECTED)
+        self.assertEqual("".join(parse_table.action_parts()), EX442_ACTIONS)
+        self.assertEqual("".join(parse_table.goto_parts()), EX442_GOTOS)
+
+    def test_pointer_assignment(self):
+        # Dragon Book grammar 4.20, where lookaheads must propagate into
+        # item sets reached from several places.
+        g = _g(_def('S',_choice(_seq(_sym('L'),_fixed('='),_sym('R')),_sym('R'))),
+               _def('L',_choice(_seq(_fixed('*'),_sym('R')),_fixed('id'))),
+               _def('R',_sym('L')))
+        self.check(g,'S')
+
+class Lookahead_closure(unittest.TestCase):
+    def setUp(self):
+        self.g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+
+    def closure_as_str(self,kernel_item):
+        ir = self.g.lower()
+        result = dict()
+        for item, (spontaneous, propagated) in ir.lookahead_closure(ir.item(kernel_item)).items():
+            la = Grammar.LookaheadSet(bits=ir.registry_bits(spontaneous),registry=self.g.registry)
+            result[str(ir.item_object(item))] = (str(la), propagated)
+        return result
+
+    def test_root(self):
+        root_item = self.g.MakeItem(Grammar.LANGUAGE,self.g.rules[Grammar.LANGUAGE][0],0)
+        self.assertEqual(self.closure_as_str(root_item),
+            {'language -> · translation_unit EndOfText': ('{}', True),
+             'translation_unit -> · C C': ('{EndOfText}', False),
+             "C -> · 'c' C": ("{'c' 'd'}", False),
+             "C -> · 'd'": ("{'c' 'd'}", False)})
+
+    def test_propagated(self):
+        # In translation_unit -> C · C, nothing follows the second C, so the
+        # kernel item's lookahead flows into the C items.
+        kernel_item = self.g.MakeItem('translation_unit',self.g.rules['translation_unit'][0],1)
+        self.assertEqual(self.closure_as_str(kernel_item),
+            {'translation_unit -> C · C': ('{}', True),
+             "C -> · 'c' C": ('{}', True),
+             "C -> · 'd'": ('{}', True)})
+
+class Closure_template(unittest.TestCase):
+    def test_ex417(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_17,'E')
+        ir = g.lower()
+        n = ir.nonterminal_id['E']
+        template = ir.closure_template(n)
+        self.assertIs(template, ir.closure_templates[n])
+        got = [(str(ir.item_object(item)), str(Grammar.LookaheadSet(bits=ir.registry_bits(const_bits),registry=g.registry)), inherits)
+               for item, const_bits, inherits in template]
+        self.assertEqual(got,
+            [('E -> · T Eprime', '{}', True),
+             ('T -> · F Tprime', "{'+'}", True),
+             ('F -> · paren_left E paren_right', "{'*' '+'}", True),
+             ("F -> · 'id'", "{'*' '+'}", True),
+             ("paren_left -> · '('", "{'(' 'id'}", False)])
+
+    def test_close_matches_closure(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_17,'E')
+        ir = g.lower()
+        root_item = g.MakeItem(Grammar.LANGUAGE,g.rules[Grammar.LANGUAGE][0],0)
+        item_set = Grammar.ItemSet(g,{root_item:Grammar.LookaheadSet({g.end_of_text})}).close(g)
+        self.assertEqual(list(item_set.id_to_item.values()),
+                         [ir.item_object(item) for item in ir.closure([ir.item(root_item)])])
+        self.assertTrue(item_set.is_closed)
+
+class GrammarIR_lowering(unittest.TestCase):
+    def setUp(self):
+        self.g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_17,'E')
+        self.ir = self.g.lower()
+
+    def test_cached(self):
+        self.assertIs(self.ir, self.g.lower())
+
+    def test_terminals(self):
+        ir = self.ir
+        self.assertEqual([str(t) for t in ir.terminals], ["EndOfText", "'id'", "'+'", "'*'", "'('", "')'"])
+        self.assertEqual(ir.end_of_text_id, 0)
+        for i, t in enumerate(ir.terminals):
+            self.assertTrue(ir.is_terminal(i))
+            self.assertEqual(ir.symbol(t), i)
+
+    def test_alternatives(self):
+        ir = self.ir
+        n = ir.nonterminal_id['Eprime']
+        self.assertEqual(ir.alternatives[n],
+                         [(ir.symbol(self.g.MakeSymbolName('plus')),
+                           ir.symbol(self.g.MakeSymbolName('T')),
+                           ir.symbol(self.g.MakeSymbolName('Eprime'))),
+                          ()])
+        self.assertFalse(ir.is_terminal(ir.symbol(self.g.MakeSymbolName('T'))))
+
+    def test_first_follow_match_rules(self):
+        ir = self.ir
+        for name, rule in self.g.rules.items():
+            n = ir.nonterminal_id[name]
+            self.assertEqual(ir.terminal_set(ir.first[n], ir.nullable[n]), rule.first(), name)
+            if ir.follow[n] is None:
+                self.assertTrue(rule.is_terminal())
+            else:
+                self.assertEqual(ir.terminal_set(ir.follow[n]), rule.follow, name)
+
+    def test_suffix_first(self):
+        ir = self.ir
+        n = ir.nonterminal_id['Eprime']
+        rule = ir.alternative_rules[n][0]
+        def suffix(position):
+            (bits, derives_empty) = ir.suffix_first(rule,position)
+            return (strset(ir.terminal_set(bits)), derives_empty)
+        self.assertEqual(suffix(0), ("'+'", False))
+        self.assertEqual(suffix(1), ("'(' 'id'", False))
+        self.assertEqual(suffix(2), ("'+'", True))
+        self.assertEqual(suffix(3), ("", True))
+        self.assertEqual(suffix(4), ("", True))
+        # Items and the item space read the same table.
+        for position in range(4):
+            item = self.g.MakeItem('Eprime',rule,position)
+            self.assertEqual(item.rest_firsts_without_empty.bits,
+                             ir.registry_bits(ir.suffix_first(rule,position+1)[0]))
+            self.assertEqual(ir.item_rest[ir.item(item)], ir.suffix_first(rule,position+1))
+
+    def test_items(self):
+        ir = self.ir
+        root = ir.root_item()
+        self.assertEqual(str(ir.item_object(root)), "language -> · E EndOfText")
+        self.assertEqual(str(ir.item_object(root+1)), "language -> E · EndOfText")
+        self.assertEqual(ir.item_symbol[root+1], ir.end_of_text_id)
+        self.assertEqual(ir.item_symbol[root+2], -1)
+        for item in ir.closure([root]):
+            self.assertEqual(ir.item(ir.item_object(item)), item)
+        self.assertEqual([str(ir.item_object(i)) for i in ir.closure([root])],
+            ["language -> · E EndOfText",
+             "E -> · T Eprime",
+             "T -> · F Tprime",
+             "F -> · paren_left E paren_right",
+             "F -> · 'id'",
+             "paren_left -> · '('"])
+
+    def test_lr0_automaton(self):
+        (by_index, states) = self.g.lr0_automaton()
+        self.assertEqual(sorted(by_index), sorted(states))
+        for core_index, (kernel, closure, goto) in states.items():
+            item_set = by_index[core_index]
+            self.assertEqual(list(item_set.id_to_item.values()),
+                             [self.ir.item_object(i) for i in closure])
+            self.assertEqual(closure[:len(kernel)], list(kernel))
+            self.assertEqual([edge.next_item_set_cache.core_index for edge in item_set.goto.values()],
+                             list(goto.values()))
+            for la in item_set.id_to_lookahead.values():
+                self.assertEqual(len(la), 0)
+
+class ItemSet_gotos_changed_item_sets(unittest.TestCase):
+    def test_ex442(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+        root_item = g.MakeItem(Grammar.LANGUAGE,g.rules[Grammar.LANGUAGE][0],0)
+        root = Grammar.ItemSet(g,{root_item:Grammar.LookaheadSet({g.end_of_text})}).close(g)
+        by_index = {root.core_index: root}
+
+        # First visit creates every destination.
+        changed = set()
+        (_,gotos) = root.gotos(g,by_index_memo=by_index,changed_item_sets=changed)
+        self.assertEqual(changed, set([i.core_index for (_,i) in gotos]))
+        for (_,item_set) in gotos:
+            by_index[item_set.core_index] = item_set
+
+        # Nothing changes on a second visit.
+        changed = set()
+        root.gotos(g,by_index_memo=by_index,changed_item_sets=changed)
+        self.assertEqual(changed, set())
+
+        # Visiting [translation_unit -> C . C] creates the state after the
+        # second C, and adds EndOfText to the lookaheads of the existing
+        # states after 'c' and 'd'.
+        by_symbol = dict([(str(X),i) for (X,i) in gotos])
+        changed = set()
+        (_,gotos) = by_symbol["C"].gotos(g,by_index_memo=by_index,changed_item_sets=changed)
+        expected = set([i.core_index for (_,i) in gotos])
+        self.assertEqual(changed, expected)
+        self.assertIn(by_symbol["'c'"].core_index, changed)
+        self.assertIn(by_symbol["'d'"].core_index, changed)
+
+class ItemSet_NextItemSet(unittest.TestCase):
+    def start(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+        root_item = g.MakeItem(Grammar.LANGUAGE,g.rules[Grammar.LANGUAGE][0],0)
+        root = Grammar.ItemSet(g,{root_item:Grammar.LookaheadSet({g.end_of_text})}).close(g)
+        by_index = {root.core_index: root}
+        (_,gotos) = root.gotos(g,by_index_memo=by_index)
+        for (_,item_set) in gotos:
+            by_index[item_set.core_index] = item_set
+        return (g, root, by_index, dict([(str(X),i) for (X,i) in gotos]))
+
+    def test_existing_core(self):
+        # An edge into an existing core finds it without making an ItemSet.
+        (g, _, by_index, by_symbol) = self.start()
+        after_c = by_symbol["'c'"]
+        num_cores = len(g.item_set_core_index)
+        # From [C -> 'c' . C], 'c' leads back to the same state, and 'd' to
+        # the state after 'd'.  Only the state after C is new.
+        closed = []
+        close = Grammar.ItemSet.close
+        def counting_close(item_set,grammar):
+            closed.append(item_set)
+            return close(item_set,grammar)
+        Grammar.ItemSet.close = counting_close
+        try:
+            (_,gotos) = after_c.gotos(g,by_index_memo=by_index)
+        finally:
+            Grammar.ItemSet.close = close
+        targets = dict([(str(X),i) for (X,i) in gotos])
+        self.assertEqual(closed, [targets["C"]])
+        self.assertIs(targets["'c'"], after_c)
+        self.assertIs(targets["'d'"], by_symbol["'d'"])
+        self.assertEqual(len(g.item_set_core_index), num_cores + 1)
+
+    def test_lookaheads_copy_on_write(self):
+        # Item sets share the interned lookaheads of the source items, and
+        # merging into one replaces it, leaving the others unchanged.
+        (g, root, _, by_symbol) = self.start()
+        after_C = by_symbol["C"]
+        [(item_id, lookahead)] = [(i, la) for (i, la) in after_C.id_to_lookahead.items()
+                                  if after_C.id_to_item[i].is_kernel()]
+        root_lookaheads = set([id(la) for la in root.id_to_lookahead.values()])
+        self.assertIn(id(lookahead), root_lookaheads)
+        self.assertIs(lookahead, g.interned_lookahead(lookahead.bits))
+        self.assertRaises(RuntimeError, lookahead.merge, Grammar.LookaheadSet({g.MakeFixed('c')}))
+        self.assertTrue(after_C.merge_lookahead(item_id, Grammar.LookaheadSet({g.MakeFixed('c')}).bits))
+        self.assertFalse(after_C.merge_lookahead(item_id, Grammar.LookaheadSet({g.MakeFixed('c')}).bits))
+        self.assertIsNot(after_C.id_to_lookahead[item_id], lookahead)
+        self.assertEqual(set([id(la) for la in root.id_to_lookahead.values()]), root_lookaheads)
+        self.assertEqual(str(after_C.id_to_lookahead[item_id]), "{'c' EndOfText}")
+
 class Grammar_registers_objects(unittest.TestCase):
     def test_star(self):
         g = Grammar.Grammar.Load(STAR_GRAMMAR,'s')
@@ -1572,6 +2018,758 @@ class Grammar_registers_objects(unittest.TestCase):
         self.assertEqual(at.reg_info.obj, at)
         self.assertEqual(at.reg_info.index, 2)
 
+class Memory_budget(unittest.TestCase):
+    # Compare the traced allocation for copies of the automaton's objects
+    # in their __slots__ layouts against the same attributes held in
+    # per-instance dicts.  A relative check does not depend on the
+    # interpreter's absolute object sizes.
+
+    def analyzer_objects(self, states):
+        objects = list(states)
+        for item_set in states:
+            if item_set.goto is not None:
+                objects.extend(item_set.goto.values())
+            objects.extend(item_set.id_to_item.values())
+            objects.extend(item_set.id_to_lookahead.values())
+        return objects
+
+    def copy_size(self, objects, slotted):
+        import tracemalloc
+        with_dict = dict()
+        tracemalloc.start()
+        try:
+            copies = []
+            for obj in objects:
+                cls = type(obj)
+                if slotted:
+                    copy = object.__new__(cls)
+                else:
+                    if cls not in with_dict:
+                        with_dict[cls] = type(cls.__name__, (object,), {})
+                    copy = with_dict[cls]()
+                for c in cls.__mro__:
+                    for name in c.__dict__.get('__slots__',()):
+                        if hasattr(obj,name):
+                            setattr(copy,name,getattr(obj,name))
+                copies.append(copy)
+            return tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+    def check_smaller(self, states):
+        objects = self.analyzer_objects(states)
+        self.assertLess(self.copy_size(objects,True), self.copy_size(objects,False))
+
+    def test_lalr1(self):
+        g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+        self.check_smaller(g.LALR1().states)
+
+    def test_lr1(self):
+        g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+        self.check_smaller(g.LR1_ItemSets())
+
+    def test_no_instance_dict(self):
+        g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+        states = g.LALR1().states
+        objects = list(g.registry.index_to_object.values())
+        objects.extend(states)
+        objects.extend([edge for item_set in states for edge in item_set.goto.values()])
+        objects.extend([obj.reg_info for obj in objects if hasattr(obj,'reg_info')])
+        for obj in objects:
+            self.assertFalse(hasattr(obj,'__dict__'), type(obj).__name__)
+
+# An ambiguous grammar:  e -> e '+' e | 'id'
+AMBIGUOUS_SUM = """
+{
+  "name": "ambiguous_sum",
+  "rules": {
+    "e": {
+      "type": "CHOICE",
+      "members": [
+        {
+          "type": "SEQ",
+          "members": [
+            { "type": "SYMBOL", "name": "e" },
+            { "type": "STRING", "value": "+" },
+            { "type": "SYMBOL", "name": "e" }
+          ]
+        },
+        { "type": "STRING", "value": "id" }
+      ]
+    }
+  },
+  "extras": [],
+  "conflicts": [],
+  "externals": [],
+  "inline": [],
+  "supertypes": []
+}
+"""
+
+class ParseTable_cache(unittest.TestCase):
+    def assertRoundTrips(self,json_text,start):
+        import json
+        table = Grammar.Grammar.Load(json_text,start).LALR1()
+        data = json.loads(json.dumps(table.to_json_dict()))
+        loaded = Grammar.ParseTable.from_json_dict(Grammar.Grammar.Load(json_text,start), data)
+        self.assertEqual(str(loaded), str(table))
+        return loaded
+
+    def test_round_trip(self):
+        self.assertRoundTrips(SIMPLE_WGSL,'translation_unit')
+        self.assertRoundTrips(DRAGON_BOOK_EXAMPLE_4_17,'E')
+
+    def test_round_trip_conflicts(self):
+        loaded = self.assertRoundTrips(AMBIGUOUS_SUM,'e')
+        self.assertTrue(loaded.has_conflicts())
+
+    def test_needs_fresh_grammar(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+        data = g.LALR1().to_json_dict()
+        self.assertRaises(RuntimeError, Grammar.ParseTable.from_json_dict, g, data)
+
+    def test_key(self):
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+        key = g.parse_table_cache_key()
+        self.assertEqual(key, Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit').parse_table_cache_key())
+        self.assertNotEqual(key, Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'C').parse_table_cache_key())
+        self.assertNotEqual(key, Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit',ignore='x').parse_table_cache_key())
+        # Only the rules count, not the JSON text they were loaded from.
+        self.assertEqual(key, Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42+' ','translation_unit').parse_table_cache_key())
+        # The rules as transformed after loading count.
+        g = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+        g.rules['C'] = g.MakeChoice([g.MakeSeq([g.MakeFixed('c')])])
+        self.assertNotEqual(key, g.parse_table_cache_key())
+
+    def test_cache_dir(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as cache_dir:
+            expected = str(Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LALR1())
+            # A limited run is not saved.
+            Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LALR1(max_item_sets=3,cache_dir=cache_dir)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+            g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+            self.assertEqual(str(g.LALR1(cache_dir=cache_dir)), expected)
+            path = os.path.join(cache_dir, g.parse_table_cache_key() + '.json')
+            self.assertEqual(os.listdir(cache_dir), [os.path.basename(path)])
+
+            # Load from the cache.
+            for engine in Grammar.LALR1_ENGINES:
+                g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+                self.assertEqual(str(g.LALR1(cache_dir=cache_dir,engine=engine)), expected)
+
+            # A damaged entry is recomputed, and replaced.
+            with open(path,'w') as f:
+                f.write('{"version": 1, "terminals": ["nope"]}')
+            stderr = sys.stderr
+            try:
+                sys.stderr = open(os.devnull,'w')
+                g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+                self.assertEqual(str(g.LALR1(cache_dir=cache_dir)), expected)
+            finally:
+                sys.stderr.close()
+                sys.stderr = stderr
+            g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+            self.assertIsNotNone(g.read_parse_table(path))
+
+class LALR1_conflict_report(unittest.TestCase):
+    def ambiguous(self):
+        return _g(_def('e',_choice(_seq(_sym('e'),_fixed('+'),_sym('e')),
+                                   _seq(_sym('e'),_fixed('*'),_sym('e')),
+                                   _fixed('x'))))
+
+    def test_no_conflicts(self):
+        for engine in Grammar.LALR1_ENGINES:
+            g = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit')
+            self.assertEqual(g.LALR1_conflict_report(max_conflicts=5,engine=engine), [])
+
+    def test_first_conflicts(self):
+        expected = [str(c) for c in Grammar.Grammar.Load(self.ambiguous(),'e').LALR1().conflicts]
+        self.assertGreater(len(expected), 2)
+        for engine in Grammar.LALR1_ENGINES:
+            g = Grammar.Grammar.Load(self.ambiguous(),'e')
+            conflicts = g.LALR1_conflict_report(max_conflicts=2,engine=engine)
+            self.assertEqual([str(c) for c in conflicts], expected[:2])
+            g = Grammar.Grammar.Load(self.ambiguous(),'e')
+            conflicts = g.LALR1_conflict_report(max_conflicts=100,engine=engine)
+            self.assertEqual([str(c) for c in conflicts], expected)
+            self.assertIn(conflicts[0].item_set.core_index, [s.core_index for s in g.LALR1().states])
+
+    def test_cache(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as d:
+            expected = [str(c) for c in Grammar.Grammar.Load(AMBIGUOUS_SUM,'e').LALR1(cache_dir=d).conflicts]
+            # The item sets are not recomputed, so the engine is not used.
+            g = Grammar.Grammar.Load(AMBIGUOUS_SUM,'e')
+            self.assertEqual([str(c) for c in g.LALR1_conflict_report(max_conflicts=1,engine='none',cache_dir=d)],
+                             expected[:1])
+            g = Grammar.Grammar.Load(AMBIGUOUS_SUM,'e')
+            self.assertRaises(RuntimeError, g.LALR1_conflict_report, engine='none')
+
+class MinimalLR1(unittest.TestCase):
+    def lr1_not_lalr1(self):
+        # Dragon book exercise 4.7.3: LR(1), but not LALR(1).
+        """
+        language = S
+        S = 'a' E 'c' | 'a' F 'd' | 'b' F 'c' | 'b' E 'd'
+        E = 'e'
+        F = 'e'
+        """
+        (a, b, c, d, e) = [_fixed(x) for x in "abcde"]
+        E = _sym("E")
+        F = _sym("F")
+        SDef = _def("S", _choice(_seq(a,E,c),_seq(a,F,d),_seq(b,F,c),_seq(b,E,d)))
+        return _gl("S", SDef, _def("E",e), _def("F",e))
+
+    def assertSameAsLALR1(self,json_text,start):
+        expected = Grammar.Grammar.Load(json_text,start).LALR1()
+        (parse_table, splits) = Grammar.Grammar.Load(json_text,start).MinimalLR1()
+        self.assertEqual(str(parse_table), str(expected))
+        self.assertEqual(splits.split, dict())
+        self.assertEqual(splits.states, len(expected.states))
+        self.assertEqual(splits.cores, len(expected.states))
+
+    def test_ex442(self):
+        self.assertSameAsLALR1(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit')
+
+    def test_simple_wgsl(self):
+        self.assertSameAsLALR1(SIMPLE_WGSL,'translation_unit')
+
+    def test_keeps_lr1_conflicts(self):
+        self.assertSameAsLALR1(AMBIGUOUS_SUM,'e')
+        self.assertTrue(Grammar.Grammar.Load(AMBIGUOUS_SUM,'e').MinimalLR1()[0].has_conflicts())
+
+    def test_keeps_lr1_conflicts_genuine(self):
+        (parse_table, splits) = Grammar.Grammar.Load(AMBIGUOUS_SUM,'e').MinimalLR1()
+        self.assertTrue(parse_table.has_conflicts())
+        self.assertEqual(splits.merge_conflicts, [])
+
+    def test_merge_conflicts(self):
+        # Not LR(1): E and F conflict on 'x' after both 'a' 'e' and 'b' 'e'.
+        # So the two states are weakly compatible, and merging them makes
+        # conflicts on 'c' and 'd' that the canonical LR(1) states do not have.
+        """
+        language = S
+        S = 'a' E 'c' | 'a' F 'd' | 'b' F 'c' | 'b' E 'd'
+          | 'a' E 'x' | 'a' F 'x' | 'b' E 'x' | 'b' F 'x'
+        E = 'e'
+        F = 'e'
+        """
+        (a, b, c, d, e, x) = [_fixed(t) for t in "abcdex"]
+        E = _sym("E")
+        F = _sym("F")
+        SDef = _def("S", _choice(_seq(a,E,c),_seq(a,F,d),_seq(b,F,c),_seq(b,E,d),
+                                 _seq(a,E,x),_seq(a,F,x),_seq(b,E,x),_seq(b,F,x)))
+        g = _gl("S", SDef, _def("E",e), _def("F",e))
+        (parse_table, splits) = g.MinimalLR1()
+        self.assertEqual(splits.split, dict())
+        self.assertEqual(sorted([str(c.terminal) for c in parse_table.conflicts]), ["'c'", "'d'", "'x'"])
+        self.assertEqual(sorted([str(c.terminal) for c in splits.merge_conflicts]), ["'c'", "'d'"])
+        self.assertIn("2 conflicts from merging states:\n", str(splits))
+
+    def test_splits_reduce_reduce_conflict(self):
+        lalr1 = self.lr1_not_lalr1().LALR1()
+        self.assertEqual(len(lalr1.conflicts), 2)
+        (parse_table, splits) = self.lr1_not_lalr1().MinimalLR1()
+        self.assertFalse(parse_table.has_conflicts())
+        # Only the state reached by 'e' is split.
+        [conflict_index] = set([c.item_set.core_index for c in lalr1.conflicts])
+        self.assertEqual(splits.split, {conflict_index: 2})
+        self.assertEqual(splits.cores, len(lalr1.states))
+        self.assertEqual(splits.states, len(lalr1.states) + 1)
+        self.assertEqual(len(parse_table.states), splits.states)
+        self.assertEqual(str(splits), "14 states for 13 cores, 1 cores split\n#{}: 2 states\n".format(conflict_index))
+        # The new state gets the next index, and the same core.
+        new_state = parse_table.core_index_to_state[len(lalr1.states)]
+        self.assertEqual(strset(new_state.kernel_item_ids),
+                         strset(lalr1.core_index_to_state[conflict_index].kernel_item_ids))
+
+class CompactParseTable_format(unittest.TestCase):
+    def assertSameActions(self,compact,parse_table):
+        g = parse_table.grammar
+        num_actions = 0
+        for state in range(compact.num_states):
+            for terminal in range(len(compact.terminals)):
+                if compact.lookup_action(state,terminal) != CompactParseTable.ACTION_ERROR:
+                    num_actions += 1
+        self.assertEqual(num_actions, len(parse_table.action))
+        for (state_id, terminal_index), action in parse_table.action.items():
+            terminal = compact.terminal_index[str(g.findByIndex(terminal_index))]
+            self.assertEqual(CompactParseTable.action_str(compact.lookup_action(state_id,terminal)), str(action))
+        num_gotos = len([x for x in compact.goto if x != CompactParseTable.NO_STATE])
+        self.assertEqual(num_gotos, len(parse_table.goto))
+        for (state_id, X), item_set in parse_table.goto.items():
+            nonterminal = compact.nonterminal_index[X.content]
+            self.assertEqual(compact.lookup_goto(state_id,nonterminal), item_set.core_index)
+        for r in parse_table.reductions:
+            self.assertEqual(compact.nonterminals[compact.reduction_lhs[r.index]], r.item.lhs.content)
+            self.assertEqual(compact.reduction_length[r.index], len(r.item.items()))
+
+    def test_ex442(self):
+        parse_table = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit').LALR1()
+        compact = parse_table.compact()
+        self.assertSameActions(compact, parse_table)
+        self.assertEqual(compact.num_states, len(parse_table.states))
+        self.assertEqual(compact.num_conflicts, 0)
+
+    def test_conflicts(self):
+        parse_table = Grammar.Grammar.Load(AMBIGUOUS_SUM,'e').LALR1()
+        compact = parse_table.compact()
+        self.assertSameActions(compact, parse_table)
+        self.assertEqual(compact.num_conflicts, len(parse_table.conflicts))
+
+    def test_round_trip(self):
+        import os, tempfile
+        parse_table = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LALR1()
+        compact = parse_table.compact()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'table.bin')
+            compact.write(path)
+            loaded = CompactParseTable.CompactParseTable.load(path)
+            try:
+                self.assertSameActions(loaded, parse_table)
+                self.assertEqual(loaded.terminals, compact.terminals)
+                self.assertEqual(loaded.nonterminals, compact.nonterminals)
+                self.assertEqual(loaded.to_bytes(), compact.to_bytes())
+            finally:
+                loaded.close()
+            self.assertIsNone(loaded.mapped)
+
+    def test_bad_data(self):
+        data = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit').LALR1().compact().to_bytes()
+        from_bytes = CompactParseTable.CompactParseTable.from_bytes
+        self.assertRaises(RuntimeError, from_bytes, data[:10])
+        self.assertRaises(RuntimeError, from_bytes, b'x' + data[1:])
+        self.assertRaises(RuntimeError, from_bytes, data[:8] + b'\x63' + data[9:])
+        self.assertRaises(RuntimeError, from_bytes, data[:-1])
+
+class CombParseTable_format(unittest.TestCase):
+    def assertSameAsParseTable(self,comb,parse_table):
+        # Check every state and symbol, including the error entries.
+        g = parse_table.grammar
+        terminals = [g.lower().terminals[i] for i in range(g.lower().num_terminals)]
+        for state in parse_table.states:
+            for terminal in terminals:
+                action = parse_table.action.get((state.core_index, terminal.reg_info.index))
+                expected = "err" if action is None else str(action)
+                word = comb.lookup_action(state.core_index, comb.terminal_index[str(terminal)])
+                self.assertEqual(CompactParseTable.action_str(word), expected)
+            for n, name in enumerate(comb.nonterminals):
+                next_state = parse_table.goto.get((state.core_index, g.MakeSymbolName(name)))
+                expected = CompactParseTable.NO_STATE if next_state is None else next_state.core_index
+                self.assertEqual(comb.lookup_goto(state.core_index, n), expected)
+
+    def comb(self,json_text,start):
+        parse_table = Grammar.Grammar.Load(json_text,start).LALR1()
+        return (CompactParseTable.CombParseTable.from_compact(parse_table.compact()), parse_table)
+
+    def test_ex442(self):
+        self.assertSameAsParseTable(*self.comb(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit'))
+
+    def test_simple_wgsl(self):
+        (comb, parse_table) = self.comb(SIMPLE_WGSL,'translation_unit')
+        self.assertSameAsParseTable(comb, parse_table)
+        self.assertLess(comb.size(), comb.dense_size())
+        self.assertGreater(comb.compression_ratio(), 1)
+
+    def test_conflicts(self):
+        (comb, parse_table) = self.comb(AMBIGUOUS_SUM,'e')
+        self.assertSameAsParseTable(comb, parse_table)
+        self.assertEqual(comb.num_conflicts, len(parse_table.conflicts))
+
+    def test_comb_vector(self):
+        rows = [[0,0,5,0],
+                [7,0,0,0],
+                [0,0,0,0],
+                [1,1,1,2],
+                [0,3,0,4]]
+        v = CompactParseTable.CombVector.compress(rows,4)
+        for r, row in enumerate(rows):
+            for c, x in enumerate(row):
+                self.assertEqual(v.lookup(r,c), x)
+        self.assertEqual(list(v.default), [0,0,0,1,0])
+        # Only the entries that differ from the default take slots.
+        self.assertEqual(len([r for r in v.check if r >= 0]), 5)
+
+    def test_round_trip(self):
+        import os, tempfile
+        (comb, parse_table) = self.comb(SIMPLE_WGSL,'translation_unit')
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'table.comb')
+            comb.write(path)
+            loaded = CompactParseTable.CombParseTable.load(path)
+            try:
+                self.assertSameAsParseTable(loaded, parse_table)
+                self.assertEqual(loaded.to_bytes(), comb.to_bytes())
+                self.assertRaises(RuntimeError, CompactParseTable.CompactParseTable.from_bytes, loaded.to_bytes())
+            finally:
+                loaded.close()
+
+class CompactParseTable_optimized(unittest.TestCase):
+    def expression_grammar(self):
+        return DragonBook_4_34().toy_grammar_inline_fixed()
+
+    def tokens(self,table,*terminals):
+        return [table.terminal_index["'{}'".format(t)] for t in terminals]
+
+    def steps(self,table,terminals):
+        parser = LRParser.Parser(table)
+        parser.parse(terminals)
+        return parser.steps
+
+    def accepts(self,table,terminals):
+        try:
+            self.steps(table,terminals)
+            return True
+        except LRParser.ParseError:
+            return False
+
+    def assertSameLanguage(self,table,optimized,max_length):
+        import itertools
+        terminals = [i for i, t in enumerate(table.terminals) if t != CompactParseTable.END_OF_TEXT]
+        num_accepted = 0
+        for length in range(max_length + 1):
+            for sentence in itertools.product(terminals, repeat=length):
+                accepted = self.accepts(table,sentence)
+                self.assertEqual(self.accepts(optimized,sentence), accepted)
+                num_accepted += accepted
+        self.assertGreater(num_accepted, 0)
+
+    def test_same_language(self):
+        table = self.expression_grammar().LALR1().compact()
+        for options in ((True,False),(False,True),(True,True)):
+            self.assertSameLanguage(table, table.optimized(*options)[0], 5)
+
+    def test_same_language_ex442(self):
+        table = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit').LALR1().compact()
+        self.assertSameLanguage(table, table.optimized()[0], 6)
+
+    def test_default_reductions(self):
+        table = self.expression_grammar().LALR1().compact()
+        (optimized, stats) = table.optimized(chain_reductions=False)
+        self.assertEqual(stats.default_reductions, 6)
+        self.assertEqual(stats.redirected_gotos, 0)
+        num_errors = len([w for w in table.action if w == CompactParseTable.ACTION_ERROR])
+        self.assertLess(len([w for w in optimized.action if w == CompactParseTable.ACTION_ERROR]), num_errors)
+        # Default reductions do not change the number of steps.
+        tokens = self.tokens(table,'id','+','id','*','id')
+        self.assertEqual(self.steps(optimized,tokens), self.steps(table,tokens))
+
+    def test_chain_reductions(self):
+        table = self.expression_grammar().LALR1().compact()
+        (optimized, stats) = table.optimized()
+        # Only the state for T -> F is bypassed. The state after E -> T
+        # can also shift '*'.
+        self.assertEqual(stats.bypassed_states, 1)
+        self.assertEqual(str(stats), "6 default reductions, 1 chain reduction states bypassed by 3 gotos")
+        # Saves one step for each F reduced to a T.
+        tokens = self.tokens(table,'id','+','id','*','(','id','+','id',')')
+        self.assertEqual(self.steps(table,tokens), 23)
+        self.assertEqual(self.steps(optimized,tokens), 19)
+
+    def test_syntax_error(self):
+        table = self.expression_grammar().LALR1().compact()
+        (optimized, _) = table.optimized()
+        for t in (table, optimized):
+            self.assertRaises(LRParser.ParseError, self.steps, t, self.tokens(table,'id','id'))
+            self.assertRaises(LRParser.ParseError, self.steps, t, self.tokens(table,'(','id'))
+
+class CompactParseTable_classes(unittest.TestCase):
+    def unused_tokens_grammar(self):
+        # The token rules are not reachable from the start symbol, so the
+        # tokens are an error in every state.
+        rules = json.loads(DRAGON_BOOK_EXAMPLE_4_42)
+        rules['rules']['_comment'] = {'type': 'PATTERN', 'value': '//.*'}
+        rules['rules']['_blankspace'] = {'type': 'PATTERN', 'value': '\\s'}
+        return Grammar.Grammar.Load(json.dumps(rules),'translation_unit')
+
+    def assertSameLookups(self,table,classed):
+        for state in range(table.num_states):
+            for terminal in range(len(table.terminals)):
+                self.assertEqual(classed.lookup_action(state,terminal), table.lookup_action(state,terminal))
+            for nonterminal in range(len(table.nonterminals)):
+                self.assertEqual(classed.lookup_goto(state,nonterminal), table.lookup_goto(state,nonterminal))
+
+    def test_identity(self):
+        table = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LALR1().compact()
+        self.assertEqual(list(table.terminal_class), list(range(len(table.terminals))))
+        classed = table.with_terminal_classes()
+        self.assertEqual(classed.num_classes, len(table.terminals))
+        self.assertSameLookups(table, classed)
+
+    def test_unused_tokens(self):
+        table = self.unused_tokens_grammar().LALR1().compact()
+        classed = table.with_terminal_classes()
+        self.assertEqual(classed.num_classes, len(table.terminals) - 1)
+        self.assertEqual(len(classed.action), classed.num_states * classed.num_classes)
+        self.assertSameLookups(table, classed)
+        self.assertEqual(classed.terminal_classes_str(),
+                         "4 terminal classes for 5 terminals\n///.*/ /\\s/\n")
+        # Classing again changes nothing.
+        self.assertEqual(classed.with_terminal_classes().to_bytes(), classed.to_bytes())
+
+    def test_optimized(self):
+        table = self.unused_tokens_grammar().LALR1().compact()
+        (optimized, _) = table.with_terminal_classes().optimized()
+        self.assertEqual(optimized.to_bytes(), table.optimized()[0].with_terminal_classes().to_bytes())
+
+    def test_round_trip(self):
+        classed = self.unused_tokens_grammar().LALR1().compact().with_terminal_classes()
+        loaded = CompactParseTable.CompactParseTable.from_bytes(classed.to_bytes())
+        self.assertEqual(list(loaded.terminal_class), list(classed.terminal_class))
+        self.assertSameLookups(classed, loaded)
+        comb = CompactParseTable.CombParseTable.from_compact(classed)
+        loaded = CompactParseTable.CombParseTable.from_bytes(comb.to_bytes())
+        self.assertEqual(loaded.num_classes, classed.num_classes)
+        self.assertSameLookups(classed, loaded)
+
+    def test_bad_class_map(self):
+        classed = self.unused_tokens_grammar().LALR1().compact().with_terminal_classes()
+        classed.terminal_class[0] = classed.num_classes
+        self.assertRaises(RuntimeError, CompactParseTable.CompactParseTable.from_bytes, classed.to_bytes())
+
+class CompactParseTable_valid_terminals(unittest.TestCase):
+    def many_tokens_grammar(self):
+        # More terminals than fit in one word of a mask.
+        return _gl('s', _def('s', _seq(_choice(*[_fixed('t{}'.format(i)) for i in range(40)]), _fixed('end'))))
+
+    def assertMasksAreActions(self,compact):
+        for state in range(compact.num_states):
+            mask = compact.valid_terminals(state)
+            expected = [t for t in range(len(compact.terminals))
+                        if compact.lookup_action(state,t) != CompactParseTable.ACTION_ERROR]
+            self.assertEqual(list(Grammar.bit_indices(mask)), expected)
+
+    def test_parse_table(self):
+        parse_table = Grammar.Grammar.Load(DRAGON_BOOK_EXAMPLE_4_42,'translation_unit').LALR1()
+        for state in parse_table.states:
+            expected = set([t for (s, t) in parse_table.action if s == state.core_index])
+            self.assertEqual(set(Grammar.bit_indices(parse_table.valid_terminals[state.core_index])), expected)
+        self.assertMasksAreActions(parse_table.compact())
+
+    def test_many_terminals(self):
+        compact = self.many_tokens_grammar().LALR1().compact()
+        self.assertGreater(len(compact.terminals), 32)
+        self.assertEqual(CompactParseTable.valid_words(len(compact.terminals)), 2)
+        self.assertMasksAreActions(compact)
+        self.assertEqual(bin(compact.valid_terminals(0)).count('1'), 40)
+
+    def test_kept_by_optimization(self):
+        compact = Grammar.Grammar.Load(SIMPLE_WGSL,'translation_unit').LALR1().compact()
+        (optimized, stats) = compact.optimized()
+        self.assertGreater(stats.default_reductions, 0)
+        classed = optimized.with_terminal_classes()
+        for state in range(compact.num_states):
+            self.assertEqual(optimized.valid_terminals(state), compact.valid_terminals(state))
+            self.assertEqual(classed.valid_terminals(state), compact.valid_terminals(state))
+
+    def test_round_trip(self):
+        compact = self.many_tokens_grammar().LALR1().compact()
+        comb = CompactParseTable.CombParseTable.from_compact(compact)
+        for loaded in [CompactParseTable.CompactParseTable.from_bytes(compact.to_bytes()),
+                       CompactParseTable.CombParseTable.from_bytes(comb.to_bytes()),
+                       comb]:
+            for state in range(compact.num_states):
+                self.assertEqual(loaded.valid_terminals(state), compact.valid_terminals(state))
+
+    def test_tokenizer(self):
+        compact = self.many_tokens_grammar().LALR1().compact()
+        t = Tokenizer.Tokenizer(compact.terminals)
+        end = compact.terminal_index["'end'"]
+        self.assertEqual(t.candidates("end", 0), [(3, end)])
+        self.assertEqual(t.candidates("end", 0, valid=compact.valid_terminals(0)), [])
+        self.assertEqual(t.candidates("t12", 0, valid=compact.valid_terminals(0)),
+                         [(3, compact.terminal_index["'t12'"]), (2, compact.terminal_index["'t1'"])])
+
+class LRParser_runtime(unittest.TestCase):
+    def parser(self):
+        return LRParser.Parser.from_parse_table(DragonBook_4_34().toy_grammar_inline_fixed().LALR1())
+
+    def tokens(self,parser,*terminals):
+        return parser.terminal_indices(["'{}'".format(t) for t in terminals])
+
+    def test_tree(self):
+        p = self.parser()
+        tree = p.parse(self.tokens(p,'id','+','id','*','id'), build_tree=True)
+        self.assertEqual(str(tree), "(E (E (T (F 'id'))) '+' (T (T (F 'id')) '*' (F 'id')))")
+        self.assertFalse(tree.is_terminal())
+        leaves = [tree.children[1], tree.children[2].children[1]]
+        self.assertEqual([(x.symbol, x.position) for x in leaves], [("'+'", 1), ("'*'", 3)])
+        # 5 shifts, and 8 reductions: 3 to F, 3 to T, and 2 to E.
+        self.assertEqual(p.steps, 13)
+
+    def test_validate(self):
+        p = self.parser()
+        self.assertIsNone(p.parse(self.tokens(p,'(','id',')')))
+        self.assertIsNone(p.validate(self.tokens(p,'id','*','id')))
+
+    def test_syntax_error(self):
+        p = self.parser()
+        e = p.validate(self.tokens(p,'id','+'))
+        self.assertIsInstance(e, LRParser.ParseError)
+        self.assertEqual(e.position, 2)
+        self.assertEqual(e.terminal, CompactParseTable.END_OF_TEXT)
+        self.assertEqual(e.expected, ["'('", "'id'"])
+        self.assertEqual(p.expected(e.state), e.expected)
+        e = p.validate(self.tokens(p,'id',')'))
+        self.assertEqual((e.position, e.terminal), (1, "')'"))
+        self.assertEqual(e.expected, ["'+'", CompactParseTable.END_OF_TEXT])
+        self.assertRaises(LRParser.ParseError, p.parse, [])
+
+    def test_validate_all(self):
+        p = self.parser()
+        inputs = [self.tokens(p,'id'), self.tokens(p,'(','id'), self.tokens(p,'id','+','id')]
+        results = p.validate_all(inputs)
+        self.assertIsNone(results[0])
+        self.assertEqual(results[1].position, 2)
+        self.assertIsNone(results[2])
+
+    def test_table_forms(self):
+        # Every form of the table accepts the same inputs.
+        import itertools
+        compact = self.parser().table
+        parsers = [LRParser.Parser(t) for t in (compact,
+                                                compact.optimized()[0],
+                                                compact.with_terminal_classes(),
+                                                CompactParseTable.CombParseTable.from_compact(compact),
+                                                CompactParseTable.CompactParseTable.from_bytes(compact.to_bytes()))]
+        terminals = [i for i, t in enumerate(compact.terminals) if t != CompactParseTable.END_OF_TEXT]
+        inputs = [x for n in range(5) for x in itertools.product(terminals, repeat=n)]
+        expected = [e is None for e in parsers[0].validate_all(inputs)]
+        self.assertIn(True, expected)
+        for p in parsers[1:]:
+            self.assertEqual([e is None for e in p.validate_all(inputs)], expected)
+
+class Tokenizer_generated(unittest.TestCase):
+    def grammar(self):
+        # var ident : type ;  where a type may have a template list.
+        rules = json.loads(_g(
+            _def('translation_unit', _rep1(_sym('decl'))),
+            _def('decl', _seq(_fixed('var'), _sym('ident'), _optional(_seq(_fixed(':'), _sym('type'))), _fixed(';'))),
+            _def('type', _seq(_sym('ident'),
+                              _optional(_seq(_sym('_template_args_start'), _sym('type'), _sym('_template_args_end'))))),
+            _def('ident', _pattern('[_\\\\p{XID_Start}][\\\\p{XID_Continue}]*')),
+            _def('_blankspace', _pattern('\\\\s')),
+            _def('_comment', _pattern('//.*')),
+            _def('_reserved', _choice(_fixed('NULL'), _fixed('async')))))
+        rules['extras'].append({'type': 'SYMBOL', 'name': '_comment'})
+        rules['externals'] = [{'type': 'SYMBOL', 'name': '_template_args_start'},
+                              {'type': 'SYMBOL', 'name': '_template_args_end'},
+                              {'type': 'SYMBOL', 'name': '_less_than'}]
+        return Grammar.Grammar.Load(json.dumps(rules),'translation_unit')
+
+    def tokenizer(self,g):
+        g.eliminate_empty()
+        compact = g.LALR1().compact()
+        return (Tokenizer.Tokenizer.from_grammar(g, compact.terminals), compact)
+
+    def names(self,tokenizer,text):
+        return [(tokenizer.terminals[t.terminal], t.start, t.end) for t in tokenizer.tokens(text)]
+
+    def test_keywords(self):
+        (t, _) = self.tokenizer(self.grammar())
+        ident = "/[_\\p{XID_Start}][\\p{XID_Continue}]*/"
+        self.assertEqual(self.names(t, "var variable;"),
+                         [("'var'",0,3), (ident,4,12), ("';'",12,13)])
+
+    def test_reserved_words(self):
+        (t, compact) = self.tokenizer(self.grammar())
+        self.assertEqual(t.reserved, {'NULL', 'async'})
+        ident = "/[_\\p{XID_Start}][\\p{XID_Continue}]*/"
+        self.assertEqual(self.names(t, "var asynchronous;"),
+                         [("'var'",0,3), (ident,4,16), ("';'",16,17)])
+        try:
+            t.tokens("var async;")
+            self.fail("expected a TokenizeError")
+        except Tokenizer.TokenizeError as e:
+            self.assertEqual(e.position, 4)
+            self.assertIn("reserved word 'async'", str(e))
+        # A shorter token does not match at a reserved word either.
+        swizzle = Tokenizer.Tokenizer([CompactParseTable.END_OF_TEXT, "/[a-z]+/", "/[rgba]/"],
+                                      word="/[a-z]+/", reserved=["async"])
+        self.assertEqual(swizzle.candidates("async", 0), [])
+        self.assertEqual(swizzle.candidates("asyncs", 0), [(6, 1), (1, 2)])
+        p = LRParser.Parser(compact)
+        self.assertRaises(Tokenizer.TokenizeError, p.parse_text, t, "var NULL;")
+
+    def test_comments(self):
+        (t, _) = self.tokenizer(self.grammar())
+        self.assertEqual([x.start for x in t.tokens("var /* a /* nested */ b */ x // c\n;")], [0, 27, 34])
+        self.assertRaises(Tokenizer.TokenizeError, t.tokens, "var /* /* */ x;")
+        self.assertRaises(Tokenizer.TokenizeError, t.tokens, "var x ?")
+
+    def test_byte_offsets(self):
+        (t, _) = self.tokenizer(self.grammar())
+        self.assertEqual([(x.start, x.end) for x in t.tokens("var \u00e9t\u00e9 ;")], [(0,3), (4,9), (10,11)])
+        try:
+            t.tokens("var \u00e9 ?")
+            self.fail("expected a TokenizeError")
+        except Tokenizer.TokenizeError as e:
+            self.assertEqual(e.position, 7)
+
+    def test_template_lists(self):
+        (t, _) = self.tokenizer(self.grammar())
+        self.assertEqual(t.template_lists("a<b>;"), ({1}, {3}))
+        self.assertEqual(t.template_lists("a<b<c>>;"), ({1, 3}, {5, 6}))
+        self.assertEqual(t.template_lists("a<b;"), (set(), set()))
+        self.assertEqual(t.template_lists("(a<b)>c;"), (set(), set()))
+        self.assertEqual(t.template_lists("a<=b>c;"), (set(), set()))
+
+    def test_parse_text(self):
+        (t, compact) = self.tokenizer(self.grammar())
+        p = LRParser.Parser(compact)
+        tree = p.parse_text(t, "var x;\nvar y: array<vec<f32>>;", build_tree=True)
+        self.assertEqual(tree.symbol, 'translation_unit')
+        self.assertIsNone(p.parse_text(t, "var x : f32 ;"))
+        try:
+            p.parse_text(t, "var x : ;")
+            self.fail("expected a ParseError")
+        except LRParser.ParseError as e:
+            self.assertEqual(e.position, 8)
+            self.assertIn("byte 8", str(e))
+
+
+class Grammar_eliminate_empty(unittest.TestCase):
+    def grammar(self):
+        # Optional and repeated phrases, and a rule that can be empty.
+        return _gl('s',
+                   _def('s', _seq(_optional(_fixed('a')), _sym('t'), _fixed('c'))),
+                   _def('t', _rep(_fixed('b'))))
+
+    def accepts(self,g,*terminals):
+        p = LRParser.Parser.from_parse_table(g.LALR1())
+        return p.validate(p.terminal_indices(["'{}'".format(x) for x in terminals])) is None
+
+    def test_rejects_without_elimination(self):
+        # The item sets skip the empty productions of the optional phrases.
+        self.assertFalse(self.accepts(self.grammar(),'c'))
+
+    def test_accepts_after_elimination(self):
+        g = self.grammar()
+        g.eliminate_empty()
+        self.assertFalse(g.LALR1().has_conflicts())
+        for phrase in [('c',), ('a','c'), ('b','c'), ('a','b','b','c'), ('b','b','b','c')]:
+            self.assertTrue(self.accepts(g,*phrase), phrase)
+        for phrase in [(), ('a',), ('a','a','c'), ('c','b')]:
+            self.assertFalse(self.accepts(g,*phrase), phrase)
+
+    def test_cache_key(self):
+        g = self.grammar()
+        key = g.parse_table_cache_key()
+        g.eliminate_empty()
+        self.assertNotEqual(g.parse_table_cache_key(), key)
+
+
+class Grammar_json_memo(unittest.TestCase):
+    def test_string_named_like_rule(self):
+        # The string 'b' and the rule named b are different symbols.
+        g = _gl('s',
+                _def('s', _seq(_sym('b'), _fixed('b'))),
+                _def('b', _fixed('x')))
+        self.assertEqual(str(g.rules['s']), "( Choice ( Seq b 'b' ) )")
+        self.assertEqual(str(g.rules['b']), "'x'")
+
 # Example 4.21
 class DragonBook_4_21(unittest.TestCase):
     def toy_grammar(self):